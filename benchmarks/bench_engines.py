@@ -0,0 +1,256 @@
+"""
+Benchmark das tarefas do plugin sobre redes sintéticas (benchmarks/synthetic_network.py), fora do QGIS desktop.
+
+Motores:
+    engine      topologia, tracing, segmentos de isolamento, verificação de conectividade e planejamento de
+                desligamentos (sementes como obras) direto dos arrays
+                (somente numpy, sem QGIS)
+    tracing     TracingPipelines (montagem da topologia pelas camadas + tracing)
+    findpoints  FindPoints sobre as redes alcançadas pelo tracing
+    ramal       LancamentoRamal para todos os hidrômetros
+
+Cada caso roda em um processo próprio para que o pico de memória (RSS) seja somente dele.
+Os motores do QGIS usam um QgsApplication sem interface (defina QGIS_PREFIX_PATH se necessário).
+
+    python benchmarks/bench_engines.py --topology grid street --segments 1000 100000 --engines engine tracing
+    python benchmarks/bench_engines.py --segments 1000000 --geopackage-dir /tmp/bench --output results.jsonl
+
+Com --output cada resultado é acrescentado como uma linha JSON (com o commit atual) para acompanhar regressões.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_network import TOPOLOGIES, generate, to_attributes, to_topology, write_layers  # noqa: E402
+
+ENGINES = ('engine', 'tracing', 'findpoints', 'ramal')
+
+
+def peak_rss_mb():
+    """Pico de memória residente do processo (MB)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+
+def start_qgis():
+    from qgis.core import QgsApplication
+
+    QgsApplication.setPrefixPath(os.environ.get('QGIS_PREFIX_PATH', '/usr'), True)
+    app = QgsApplication([], False)
+    app.initQgis()
+    return app
+
+
+def seeds_for(network, count, seed):
+    rng = np.random.default_rng(seed + 1)
+    return sorted(rng.choice(network.n_pipes, size=min(count, network.n_pipes), replace=False).tolist())
+
+
+def run_engine(network, case):
+    from core.tracing_engine import build_segments, trace_many
+    from core.connectivity_qa import check_connectivity
+    from core.geometry_kernels import SegmentGrid
+    from core.outage_planner import plan_outages
+    from core.valve_failure import ValveFailureAnalysis
+
+    metrics = {}
+    start = time.perf_counter()
+    topology = to_topology(network)
+    topology.lists()
+    metrics['topology_s'] = time.perf_counter() - start
+
+    attributes = to_attributes(network)
+
+    start = time.perf_counter()
+    results = trace_many(topology, seeds_for(network, case['seeds'], case['seed']),
+                         attributes.valve_state, attributes.diameter)
+    metrics['trace_s'] = time.perf_counter() - start
+    unique = {id(r): r for r in results.values()}.values()
+    metrics['iterations'] = sum(r.iterations for r in unique)
+    metrics['max_frontier'] = max((r.max_frontier for r in unique), default=0)
+    metrics['pipes_reached'] = sum(len(r.pipe_indices) for r in unique)
+
+    start = time.perf_counter()
+    segments = build_segments(topology, attributes.valve_state, attributes.diameter)
+    metrics['segments_s'] = time.perf_counter() - start
+    metrics['isolation_segments'] = len(segments)
+
+    start = time.perf_counter()
+    starts = network.node_xy[network.pipe_nodes[:, 0]]
+    ends = network.node_xy[network.pipe_nodes[:, 1]]
+    grid = SegmentGrid(starts, ends, np.arange(network.n_pipes), 30)
+    owners, _, _ = grid.nearest(network.hydrometer_xy)
+    metrics['nearest_s'] = time.perf_counter() - start
+    metrics['hydrometers_linked'] = int((owners >= 0).sum())
+
+    start = time.perf_counter()
+    errors = check_connectivity(starts, ends, np.arange(network.n_pipes), network.valve_nodes,
+                                network.node_xy[network.valve_nodes])
+    metrics['connectivity_s'] = time.perf_counter() - start
+    metrics['connectivity_errors'] = len(errors['kind'])
+
+    start = time.perf_counter()
+    analysis = ValveFailureAnalysis(topology, attributes.valve_state, attributes.diameter, segments)
+    lengths = np.hypot(*(ends - starts).T)
+    plan = plan_outages(analysis, seeds_for(network, case['seeds'], case['seed']), lengths)
+    metrics['outage_s'] = time.perf_counter() - start
+    metrics['shutdowns'] = len(plan.shutdowns)
+
+    metrics['time_s'] = (metrics['topology_s'] + metrics['trace_s'] + metrics['segments_s'] + metrics['nearest_s']
+                         + metrics['connectivity_s'] + metrics['outage_s'])
+    return metrics
+
+
+def run_qgis_engine(network, case):
+    app = start_qgis()
+    from qgis.core import QgsProject
+
+    path = None
+    if case['geopackage_dir']:
+        os.makedirs(case['geopackage_dir'], exist_ok=True)
+        path = os.path.join(case['geopackage_dir'], f"{case['topology']}-{case['segments']}-{case['seed']}.gpkg")
+
+    start = time.perf_counter()
+    pipelines, valves, hydrometers = write_layers(network, path)
+    QgsProject.instance().addMapLayers([pipelines, valves, hydrometers])
+    metrics = {'layers_s': time.perf_counter() - start, 'rss_before_mb': peak_rss_mb()}
+
+    engine = case['engine']
+    if engine in ('tracing', 'findpoints'):
+        from core.tracing_pipelines import TracingPipelines
+
+        fids = sorted(pipelines.allFeatureIds())
+        pipelines.selectByIds([fids[s] for s in seeds_for(network, case['seeds'], case['seed'])])
+        start = time.perf_counter()
+        task = TracingPipelines(pipelines, valves)
+        metrics['prepare_s'] = time.perf_counter() - start
+        ok = task.run()
+        metrics['trace_s'] = time.perf_counter() - start - metrics['prepare_s']
+        if not ok:
+            raise RuntimeError('TracingPipelines não terminou')
+        profile = task.instrumentation.to_dict()
+        metrics.update(profile['counters'])
+        metrics.update({f'max_{name}': value for name, value in profile['maxima'].items()})
+        metrics['time_s'] = metrics['prepare_s'] + metrics['trace_s']
+
+        if engine == 'findpoints':
+            from core.feature_stream import iter_features
+            from core.find_points import FindPoints
+
+            reached = set()
+            for result in task.results.values():
+                reached |= result.pipelines
+            metrics['pipes_searched'] = len(reached)
+            start = time.perf_counter()
+            find = FindPoints(iter_features(pipelines, fids=sorted(reached)), hydrometers=hydrometers)
+            if not find.run():
+                raise RuntimeError('FindPoints não terminou')
+            metrics['time_s'] = time.perf_counter() - start
+            metrics['hydrometers_found'] = len(find.list_hds)
+
+    elif engine == 'ramal':
+        from core.lancamento_ramal import LancamentoRamal
+
+        start = time.perf_counter()
+        task = LancamentoRamal([pipelines], [hydrometers], workers=case['workers'])
+        if not task.run():
+            raise RuntimeError('LancamentoRamal não terminou')
+        metrics['time_s'] = time.perf_counter() - start
+        metrics['ramais'] = task.dist.featureCount()
+
+    QgsProject.instance().removeAllMapLayers()
+    app.exitQgis()
+    return metrics
+
+
+def run_case(case):
+    """Executa um caso no processo atual e retorna o resultado (dicionário)"""
+    start = time.perf_counter()
+    network = generate(case['topology'], case['segments'], seed=case['seed'])
+    result = dict(case, network=network.describe(), pipes=network.n_pipes, generate_s=time.perf_counter() - start)
+
+    if case['engine'] == 'engine':
+        result.update(run_engine(network, case))
+    else:
+        result.update(run_qgis_engine(network, case))
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_isolated(case):
+    """Executa o caso em um processo novo (pico de memória isolado)"""
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                               capture_output=True, text=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return dict(case, error=(completed.stderr.strip().splitlines() or ['sem saída'])[-1])
+    return json.loads(lines[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_result(result):
+    if 'error' in result:
+        print(f"{result['engine']:<11} {result['topology']:<7} {result['segments']:>9}  ERRO: {result['error']}")
+        return
+    extra = {k: v for k, v in result.items()
+             if k in ('iterations', 'max_frontier', 'isolation_segments', 'hydrometers_found', 'hydrometers_linked', 'ramais',
+                      'connectivity_errors', 'shutdowns')}
+    print(f"{result['engine']:<11} {result['topology']:<7} {result['pipes']:>9} redes  "
+          f"{result['time_s'] * 1000:>10.1f} ms  {result['peak_rss_mb']:>8.1f} MB  "
+          f"{' '.join(f'{k}={v}' for k, v in extra.items())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--topology', nargs='+', choices=TOPOLOGIES, default=list(TOPOLOGIES))
+    parser.add_argument('--segments', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=['engine'])
+    parser.add_argument('--seeds', type=int, default=1, help='redes selecionadas para o tracing')
+    parser.add_argument('--seed', type=int, default=0, help='semente do gerador aleatório')
+    parser.add_argument('--workers', type=int, default=1, help='processos do LancamentoRamal')
+    parser.add_argument('--geopackage-dir', help='grava/reaproveita as camadas em GeoPackage (padrão: memória)')
+    parser.add_argument('--output', help='arquivo JSON lines onde os resultados são acrescentados')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    commit = git_commit()
+    for topology in args.topology:
+        for segments in args.segments:
+            for engine in args.engines:
+                case = {'engine': engine, 'topology': topology, 'segments': segments, 'seeds': args.seeds,
+                        'seed': args.seed, 'workers': args.workers, 'geopackage_dir': args.geopackage_dir}
+                result = run_isolated(case)
+                result.update(commit=commit, timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'))
+                print_result(result)
+                if args.output:
+                    with open(args.output, 'a', encoding='utf-8') as file:
+                        file.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Compara a vazão (redes/segundo) do percurso em camadas (core.tracing_engine.trace)
+com o percurso antigo, que criava duas threads por rede visitada.
+
+Roda sem QGIS:  python benchmarks/bench_traversal.py --size 200
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from core.tracing_engine import (NO_VALVE, NetworkTopology, VALVE_NOT_VISIBLE, VALVE_OPEN,
+                                 is_downstream, trace)
+
+
+def grid_topology(size, valve_every=0):
+    """
+    Malha size x size de nós com redes horizontais e verticais ligando nós vizinhos.
+    Com valve_every > 0 um nó a cada valve_every recebe um registro.
+    """
+    n_nodes = size * size
+    node_xy = np.array([(x * 10.0, y * 10.0) for y in range(size) for x in range(size)], dtype=np.float64)
+
+    pipe_nodes = []
+    for y in range(size):
+        for x in range(size):
+            node = y * size + x
+            if x + 1 < size:
+                pipe_nodes.append((node, node + 1))
+            if y + 1 < size:
+                pipe_nodes.append((node, node + size))
+    pipe_nodes = np.array(pipe_nodes, dtype=np.int32)
+
+    incident = [[] for _ in range(n_nodes)]
+    for pipe, (a, b) in enumerate(pipe_nodes.tolist()):
+        incident[a].append(pipe)
+        incident[b].append(pipe)
+    node_pipe_ptr = np.cumsum([0] + [len(p) for p in incident]).astype(np.int32)
+    node_pipe_idx = np.array([p for pipes in incident for p in pipes], dtype=np.int32)
+
+    node_valve = np.full(n_nodes, NO_VALVE, dtype=np.int64)
+    if valve_every:
+        node_valve[::valve_every] = np.arange(len(node_valve[::valve_every]))
+
+    return NetworkTopology(pipe_ids=np.arange(len(pipe_nodes), dtype=np.int64),
+                           pipe_nodes=pipe_nodes,
+                           node_xy=node_xy,
+                           node_pipe_ptr=node_pipe_ptr,
+                           node_pipe_idx=node_pipe_idx,
+                           node_valve=node_valve)
+
+
+def trace_threaded(topology, seed_index, valve_state, diameter):
+    """Reprodução do laço antigo de TracingPipelines.run: duas threads criadas e aguardadas por rede"""
+    visited = set()
+    valves = set()
+    queue = deque([seed_index])
+
+    def find_neighbors(node, origin):
+        valve = topology.valve_at(node)
+        if valve is not None:
+            if valve_state(valve) != VALVE_NOT_VISIBLE:
+                valves.add(valve)
+                return
+        for pipe in topology.pipes_at(node):
+            pipe = int(pipe)
+            if is_downstream(diameter(origin), diameter(pipe)):
+                continue
+            if pipe not in visited:
+                queue.append(pipe)
+
+    while queue:
+        pipe = queue.pop()
+        if pipe in visited:
+            continue
+        visited.add(pipe)
+        n1, n2 = topology.pipe_nodes[pipe]
+        thread1 = threading.Thread(target=find_neighbors, args=(n1, pipe))
+        thread2 = threading.Thread(target=find_neighbors, args=(n2, pipe))
+        thread1.start()
+        thread2.start()
+        thread1.join()
+        thread2.join()
+    return visited
+
+
+def measure(name, function, repeat):
+    best = None
+    visited = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        visited = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f'{name:<12} {visited:>9} redes  {best * 1000:>10.1f} ms  {visited / best:>12.0f} redes/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100, help='lado da malha (redes ~ 2 * size^2)')
+    parser.add_argument('--valve-every', type=int, default=0, help='um registro a cada N nós (0 = sem registros)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    topology = grid_topology(args.size, args.valve_every)
+    topology.lists()
+    seed = topology.n_pipes // 2
+
+    def valve_state(valve_id):
+        return VALVE_OPEN
+
+    def diameter(pipe_index):
+        return 100
+
+    print(f'Malha {args.size}x{args.size}: {topology.n_pipes} redes, {topology.n_nodes} nós')
+    measure('threads', lambda: len(trace_threaded(topology, seed, valve_state, diameter)), args.repeat)
+    measure('frontier', lambda: len(trace(topology, seed, valve_state, diameter).pipelines), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Redes de água sintéticas para os benchmarks: malha (grid), árvore (tree) e ruas (street).
+A geração usa somente numpy; write_layers cria as camadas do QGIS (memória ou GeoPackage)
+com os mesmos nomes e campos usados pelo plugin.
+"""
+import os
+
+import numpy as np
+
+from core.tracing_engine import NO_VALVE, NetworkAttributes, NetworkTopology
+
+TOPOLOGIES = ('grid', 'tree', 'street')
+
+# Nomes das camadas esperados pelo plugin
+PIPELINES_LAYER = 'pipelines_tracing'
+VALVES_LAYER = 'valves_tracing'
+HYDROMETERS_LAYER = 'hds_tracing'
+
+
+class SyntheticNetwork:
+    """Rede gerada: nós, redes (ligando dois nós), registros sobre nós e hidrômetros próximos das redes"""
+
+    def __init__(self, name, node_xy, pipe_nodes, diameters, valve_nodes, valve_visivel, valve_status,
+                 hydrometer_xy):
+        self.name = name
+        self.node_xy = node_xy  # float64 (n_nodes, 2)
+        self.pipe_nodes = pipe_nodes  # int32 (n_pipes, 2)
+        self.diameters = diameters  # float64 (n_pipes,)
+        self.valve_nodes = valve_nodes  # int64 (n_valves,)
+        self.valve_visivel = valve_visivel  # 'SIM' / 'NÃO'
+        self.valve_status = valve_status  # 0 = aberto | 1 = fechado
+        self.hydrometer_xy = hydrometer_xy  # float64 (n_hydrometers, 2)
+
+    @property
+    def n_pipes(self):
+        return len(self.pipe_nodes)
+
+    def describe(self):
+        return (f'{self.name}: {self.n_pipes} redes, {len(self.node_xy)} nós, '
+                f'{len(self.valve_nodes)} registros, {len(self.hydrometer_xy)} hidrômetros')
+
+
+def generate(topology, segments, seed=0, valve_ratio=0.3, hydrometers_per_pipe=1.0):
+    """
+    :param topology: 'grid', 'tree' ou 'street'
+    :param segments: quantidade aproximada de redes
+    :param valve_ratio: fração dos nós com registro
+    """
+    rng = np.random.default_rng(seed)
+    if topology == 'grid':
+        node_xy, pipe_nodes, diameters = _grid(segments, rng)
+    elif topology == 'tree':
+        node_xy, pipe_nodes, diameters = _tree(segments, rng)
+    elif topology == 'street':
+        node_xy, pipe_nodes, diameters = _street(segments, rng)
+    else:
+        raise ValueError(f'Topologia desconhecida: {topology} (use {", ".join(TOPOLOGIES)})')
+
+    valve_nodes, valve_visivel, valve_status = _valves(len(node_xy), valve_ratio, rng)
+    hydrometer_xy = _hydrometers(node_xy, pipe_nodes, hydrometers_per_pipe, rng)
+    return SyntheticNetwork(f'{topology}-{len(pipe_nodes)}', node_xy, pipe_nodes, diameters,
+                            valve_nodes, valve_visivel, valve_status, hydrometer_xy)
+
+
+def _grid(segments, rng):
+    # Malha regular de side x side nós: 2 * side * (side - 1) redes
+    side = max(int(np.ceil((1 + np.sqrt(1 + 2 * segments)) / 2)), 2)
+    y, x = np.divmod(np.arange(side * side), side)
+    node_xy = np.column_stack([x * 50.0, y * 50.0])
+
+    node = np.arange(side * side).reshape(side, side)
+    horizontal = np.column_stack([node[:, :-1].ravel(), node[:, 1:].ravel()])
+    vertical = np.column_stack([node[:-1, :].ravel(), node[1:, :].ravel()])
+    pipe_nodes = np.vstack([horizontal, vertical]).astype(np.int32)
+
+    # Uma linha/coluna a cada 10 é adutora
+    row = y[pipe_nodes[:, 0]]
+    column = x[pipe_nodes[:, 0]]
+    trunk = (row % 10 == 0) & (pipe_nodes[:, 1] - pipe_nodes[:, 0] == 1)
+    trunk |= (column % 10 == 0) & (pipe_nodes[:, 1] - pipe_nodes[:, 0] == side)
+    diameters = np.where(trunk, 200.0, 100.0)
+    return node_xy, pipe_nodes, diameters
+
+
+def _tree(segments, rng):
+    # Árvore geradora aleatória sobre uma malha com deslocamento: cada nó liga-se ao vizinho da esquerda
+    # ou de baixo, então tudo converge para a fonte em (0, 0)
+    side = max(int(np.ceil(np.sqrt(segments + 1))), 2)
+    y, x = np.divmod(np.arange(side * side), side)
+    node_xy = np.column_stack([x * 50.0, y * 50.0]) + rng.normal(0.0, 5.0, (side * side, 2))
+
+    left = (x > 0) & ((y == 0) | (rng.random(side * side) < 0.5))
+    parent = np.where(left, np.arange(side * side) - 1, np.arange(side * side) - side)
+    children = np.arange(1, side * side)
+
+    # Nós abastecidos por cada rede (tamanho da subárvore), do nó mais distante para a fonte
+    supplied = np.ones(side * side, dtype=np.int64)
+    level = x + y
+    order = np.argsort(-level, kind='stable')
+    bounds = np.searchsorted(-level[order], np.arange(-level.max(), 1))
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        nodes = order[begin:end]
+        nodes = nodes[nodes > 0]
+        np.add.at(supplied, parent[nodes], supplied[nodes])
+
+    pipe_nodes = np.column_stack([parent[children], children]).astype(np.int32)
+    limits = np.array([5, 20, 100, 500, 2000])
+    steps = np.array([50.0, 75.0, 100.0, 150.0, 200.0, 300.0])
+    diameters = steps[np.searchsorted(limits, supplied[children])]
+    return node_xy, pipe_nodes, diameters
+
+
+def _street(segments, rng, split=3, drop=0.08):
+    # Quadras irregulares: cruzamentos com deslocamento aleatório, trechos de rua removidos
+    # (pontas de rede) e cada trecho dividido em 'split' redes
+    side = max(int(np.ceil((1 + np.sqrt(1 + 2 * segments / (split * (1 - drop)))) / 2)), 2)
+    y, x = np.divmod(np.arange(side * side), side)
+    corners = np.column_stack([x * 80.0, y * 80.0]) + rng.normal(0.0, 8.0, (side * side, 2))
+
+    node = np.arange(side * side).reshape(side, side)
+    edges = np.vstack([np.column_stack([node[:, :-1].ravel(), node[:, 1:].ravel()]),
+                       np.column_stack([node[:-1, :].ravel(), node[1:, :].ravel()])])
+    main = np.concatenate([y[node[:, :-1].ravel()] % 8 == 0, x[node[:-1, :].ravel()] % 8 == 0])
+    keep = (rng.random(len(edges)) >= drop) | main
+    edges, main = edges[keep], main[keep]
+
+    # Nós intermediários de cada trecho, com pequeno desvio lateral
+    t = np.arange(1, split) / split
+    a, b = corners[edges[:, 0]], corners[edges[:, 1]]
+    middle = a[:, None, :] + t[None, :, None] * (b - a)[:, None, :]
+    middle += rng.normal(0.0, 1.5, middle.shape)
+    middle_ids = len(corners) + np.arange(len(edges) * (split - 1)).reshape(len(edges), split - 1)
+
+    chain = np.column_stack([edges[:, 0], middle_ids, edges[:, 1]])
+    pipe_nodes = np.column_stack([chain[:, :-1].ravel(), chain[:, 1:].ravel()])
+    node_xy = np.vstack([corners, middle.reshape(-1, 2)])
+
+    # Remove cruzamentos que ficaram sem redes
+    used = np.unique(pipe_nodes)
+    renumber = np.full(len(node_xy), -1, dtype=np.int64)
+    renumber[used] = np.arange(len(used))
+    node_xy = node_xy[used]
+    pipe_nodes = renumber[pipe_nodes].astype(np.int32)
+
+    mains = np.repeat(main, split)
+    diameters = np.where(mains, rng.choice([150.0, 200.0, 250.0], len(mains)),
+                         rng.choice([50.0, 75.0, 100.0], len(mains), p=[0.3, 0.3, 0.4]))
+    return node_xy, pipe_nodes, diameters
+
+
+def _valves(n_nodes, valve_ratio, rng):
+    count = int(n_nodes * valve_ratio)
+    valve_nodes = np.sort(rng.choice(n_nodes, size=count, replace=False)).astype(np.int64)
+    kind = rng.random(count)
+    valve_visivel = np.where(kind < 0.05, 'NÃO', 'SIM')
+    valve_status = np.where(kind > 0.98, 1, 0)
+    return valve_nodes, valve_visivel, valve_status
+
+
+def _hydrometers(node_xy, pipe_nodes, per_pipe, rng):
+    # Hidrômetros ao lado das redes, a 3-20 m do eixo
+    count = int(len(pipe_nodes) * per_pipe)
+    pipe = rng.integers(0, len(pipe_nodes), count)
+    a, b = node_xy[pipe_nodes[pipe, 0]], node_xy[pipe_nodes[pipe, 1]]
+    direction = b - a
+    length = np.maximum(np.hypot(*direction.T), 1e-9)
+    normal = np.column_stack([-direction[:, 1], direction[:, 0]]) / length[:, None]
+    side = np.where(rng.random(count) < 0.5, -1.0, 1.0)
+    offset = rng.uniform(3.0, 20.0, count) * side
+    return a + rng.random(count)[:, None] * direction + normal * offset[:, None]
+
+
+def to_topology(network):
+    """NetworkTopology direto dos arrays (sem QGIS); os ids dos registros são as posições em valve_nodes"""
+    node_valve = np.full(len(network.node_xy), NO_VALVE, dtype=np.int64)
+    node_valve[network.valve_nodes] = np.arange(len(network.valve_nodes))
+    return NetworkTopology.from_edges(np.arange(network.n_pipes), network.pipe_nodes, network.node_xy, node_valve)
+
+
+def to_attributes(network):
+    """NetworkAttributes da rede, com os mesmos ids de registro de to_topology"""
+    return NetworkAttributes.from_valves(network.diameters, np.arange(len(network.valve_nodes)),
+                                         network.valve_visivel.tolist(), network.valve_status.tolist())
+
+
+def write_layers(network, path=None, crs='EPSG:31982'):
+    """
+    Camadas de redes, registros e hidrômetros da rede sintética.
+    :param path: GeoPackage de destino (reaproveitado se já existir); None = camadas em memória
+    :return: (pipelines, valves, hydrometers) QgsVectorLayer
+    """
+    from qgis.core import QgsVectorLayer
+
+    if path is not None and os.path.exists(path):
+        return tuple(QgsVectorLayer(f'{path}|layername={name}', name, 'ogr')
+                     for name in (PIPELINES_LAYER, VALVES_LAYER, HYDROMETERS_LAYER))
+
+    pipelines = QgsVectorLayer(f'LineString?crs={crs}&field=diametro_nominal:double', PIPELINES_LAYER, 'memory')
+    valves = QgsVectorLayer(f'Point?crs={crs}&field=codigo:string(20)&field=visivel:string(3)'
+                            f'&field=status_operacao:integer', VALVES_LAYER, 'memory')
+    hydrometers = QgsVectorLayer(f'Point?crs={crs}', HYDROMETERS_LAYER, 'memory')
+
+    node_xy = network.node_xy
+    _write(pipelines, (_line_wkt(node_xy[a], node_xy[b]) for a, b in network.pipe_nodes.tolist()),
+           ([d] for d in network.diameters.tolist()))
+    _write(valves, (_point_wkt(node_xy[n]) for n in network.valve_nodes.tolist()),
+           ([f'RG{i}', v, s] for i, (v, s) in enumerate(zip(network.valve_visivel.tolist(),
+                                                           network.valve_status.tolist()))))
+    _write(hydrometers, (_point_wkt(p) for p in network.hydrometer_xy), ([] for _ in network.hydrometer_xy))
+
+    if path is None:
+        return pipelines, valves, hydrometers
+    _save_geopackage([pipelines, valves, hydrometers], path)
+    return write_layers(network, path, crs)
+
+
+def _line_wkt(a, b):
+    return f'LineString({a[0]} {a[1]}, {b[0]} {b[1]})'
+
+
+def _point_wkt(p):
+    return f'Point({p[0]} {p[1]})'
+
+
+def _write(layer, geometries, attributes):
+    from qgis.core import QgsFeature, QgsGeometry
+
+    from core.feature_stream import WRITE_BATCH_SIZE
+
+    provider = layer.dataProvider()
+    batch = []
+    for wkt, values in zip(geometries, attributes):
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        feature.setAttributes(values)
+        batch.append(feature)
+        if len(batch) >= WRITE_BATCH_SIZE:
+            provider.addFeatures(batch)
+            batch = []
+    provider.addFeatures(batch)
+    layer.updateExtents()
+
+
+def _save_geopackage(layers, path):
+    from qgis.core import QgsCoordinateTransformContext, QgsVectorFileWriter
+
+    for layer in layers:
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = 'GPKG'
+        options.layerName = layer.name()
+        if os.path.exists(path):
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+        error = QgsVectorFileWriter.writeAsVectorFormatV2(layer, path, QgsCoordinateTransformContext(), options)
+        if error[0] != QgsVectorFileWriter.NoError:
+            raise IOError(f'Erro ao gravar {layer.name()} em {path}: {error}')
@@ -6,14 +6,25 @@ from qgis.core import (
     Qgis,
     QgsProject,
     QgsApplication,
-    QgsMessageLog
+    QgsMessageLog,
+    QgsRectangle,
+    QgsVectorLayer,
+    QgsWkbTypes
 )
 
 from view import ConfigDialog
+from core.flow_direction import TRACE_MODE_NAMES, TRACE_MODES
+from core.instrumentation import CRITICAL, DEBUG, INFO, WARNING
+from core.network_preparation import prepare_network
 from core.task_manager import TracingCAJ
 
 import global_vars
 
+# Itens da aba Opções: texto exibido e valor guardado nas configurações ('' = padrão)
+LOG_LEVEL_OPTIONS = (('Padrão', ''), ('Depuração', DEBUG), ('Informação', INFO), ('Aviso', WARNING),
+                     ('Crítico', CRITICAL))
+DIRECTION_OPTIONS = (('Normal', ''),) + tuple((TRACE_MODE_NAMES[mode].capitalize(), mode) for mode in TRACE_MODES)
+
 
 class ConfigController:
 
@@ -25,6 +36,8 @@ class ConfigController:
 
         self._ui.btn_iniciar_tracing.clicked.connect(self.start_tracing)
         self._ui.btn_salvar_configs.clicked.connect(self.save_configs)
+        self._ui.btn_salvar_opcoes.clicked.connect(self.save_options)
+        self.__load_options()
 
         # Task Manager
         self.__tm = QgsApplication.taskManager()
@@ -62,6 +75,28 @@ class ConfigController:
 
         self.set_status_msg('Não foi possível salvar as configurações')
 
+    def save_options(self):
+        Settings().save_options(log_level=self._ui.cmb_log_level.currentData(),
+                                profile_path=self._ui.txt_profile_path.text().strip(),
+                                customers_path=self._ui.txt_customers_path.text().strip(),
+                                direction=self._ui.cmb_direction.currentData(),
+                                highlight=self._ui.chk_highlight.isChecked())
+        self.set_status_msg('Opções salvas')
+
+    def __load_options(self):
+        # Preenche a aba Opções com as configurações salvas
+        settings = Settings()
+        for combo, options in ((self._ui.cmb_log_level, LOG_LEVEL_OPTIONS),
+                               (self._ui.cmb_direction, DIRECTION_OPTIONS)):
+            for text, value in options:
+                combo.addItem(text, value)
+        level = settings.get_log_level()
+        self._ui.cmb_log_level.setCurrentIndex(max(self._ui.cmb_log_level.findData('' if level is None else level), 0))
+        self._ui.cmb_direction.setCurrentIndex(max(self._ui.cmb_direction.findData(settings.get_direction() or ''), 0))
+        self._ui.txt_profile_path.setText(settings.get_profile_path() or '')
+        self._ui.txt_customers_path.setText(settings.get_customers_path() or '')
+        self._ui.chk_highlight.setChecked(settings.get_highlight())
+
     def show(self):
         # Exibe a tela de configurações
         # self._ui.exec_()
@@ -71,21 +106,25 @@ class ConfigController:
         self.set_status_msg("Iniciando...")
         try:
             if len(self._pipelines) > 0 and len(self._valves) > 0:
-                pipeline_select = self.iface.activeLayer().selectedFeatures()
+                pipeline_select = self.iface.activeLayer().selectedFeatureIds()
                 if pipeline_select:
-                    if len(pipeline_select) == 1:
-                        self.set_disable_button_inicial()
-                        tracing_caj = TracingCAJ(
-                            task_manager=self.__tm,
-                            pipelines=self._pipelines,
-                            valves=self._valves,
-                            parent=self)
-                        self.set_status_msg("Aguarde finalizar...")
-                        tracing_caj.start()
-                    else:
-                        self.set_status_msg("Selecione apenas uma rede para iniciar...")
-                        self.iface.messageBar().pushMessage("Info",
-                                                            "Select only ONE network to start", level=Qgis.Info)
+                    # Uma ou várias redes: cada rede selecionada é uma semente do tracing
+                    self.set_disable_button_inicial()
+                    settings = Settings()
+                    tracing_caj = TracingCAJ(
+                        task_manager=self.__tm,
+                        pipelines=self._pipelines,
+                        valves=self._valves,
+                        parent=self,
+                        log_level=settings.get_log_level(),
+                        profile_path=settings.get_profile_path(),
+                        highlight=settings.get_highlight(),
+                        hydrometers=self.__hydrometers_layer(),
+                        customers_path=settings.get_customers_path(),
+                        direction=settings.get_direction(),
+                        sources=self.__sources_layer())
+                    self.set_status_msg("Aguarde finalizar...")
+                    tracing_caj.start()
                 else:
                     self.set_status_msg("Selecione uma rede no mapa para iniciar!")
                     self.iface.messageBar().pushMessage("Info", 'Nenhuma rede selecionada!" '
@@ -95,7 +134,29 @@ class ConfigController:
                 self.iface.messageBar().pushMessage("Info", 'Referencia para as redes e registros não encontrada!" '
                                                     , level=Qgis.Info)
         except Exception as e:
-            print(e)
+            QgsMessageLog.logMessage(f'Erro ao iniciar o tracing: {e}', 'TracingCAJ', Qgis.Critical)
+            self.set_enable_button_iniciar()
+
+    def start_break(self, point, search_distance):
+        """Isolamento a partir do ponto de rompimento clicado no mapa (ponto e tolerância no SRC do mapa)"""
+        if not isinstance(self._pipelines, QgsVectorLayer) or not isinstance(self._valves, QgsVectorLayer):
+            self.set_status_msg("Referencia para as redes e registros não encontrada!")
+            self.iface.messageBar().pushMessage("Info", 'Escolha as camadas de redes e registros', level=Qgis.Info)
+            return
+        try:
+            settings = self.iface.mapCanvas().mapSettings()
+            layer_point = settings.mapToLayerCoordinates(self._pipelines, point)
+            # Tolerância convertida para as unidades da camada: retângulo em volta do clique transformado
+            box = settings.mapToLayerCoordinates(self._pipelines, QgsRectangle(
+                point.x() - search_distance, point.y() - search_distance,
+                point.x() + search_distance, point.y() + search_distance))
+            layer_distance = max(box.width(), box.height()) / 2
+            self.set_disable_button_inicial()
+            self.set_status_msg("Aguarde finalizar...")
+            TracingCAJ(task_manager=self.__tm, pipelines=self._pipelines, valves=self._valves,
+                       parent=self).start_break(layer_point, layer_distance)
+        except Exception as e:
+            QgsMessageLog.logMessage(f'Erro ao iniciar o isolamento: {e}', 'TracingCAJ', Qgis.Critical)
             self.set_enable_button_iniciar()
 
     def set_layers(self, layer):
@@ -169,6 +230,7 @@ class ConfigController:
 
         self._pipelines = _layer_pipelines_selected
         self._valves = QgsProject.instance().mapLayersByName('valves_tracing')
+        self.prewarm()
 
     def layerSelectionValves(self, index):  # finished
         """Runs after selecting layer from the list. Sets a new list of fields to choose from and deletes windows with already selected fields"""
@@ -177,6 +239,27 @@ class ConfigController:
         _layer_valves_selected = QgsProject.instance().mapLayer(idValves)  # .toString())
 
         self._valves = _layer_valves_selected
+        self.prewarm()
+
+    def prewarm(self):
+        """Prepara topologia e índices em segundo plano assim que as camadas de redes e registros são escolhidas"""
+        if not isinstance(self._pipelines, QgsVectorLayer) or not isinstance(self._valves, QgsVectorLayer):
+            return
+        if (self._pipelines.geometryType() == QgsWkbTypes.LineGeometry
+                and self._valves.geometryType() == QgsWkbTypes.PointGeometry):
+            prepare_network(self.__tm, self._pipelines, self._valves)
+
+    @staticmethod
+    def __hydrometers_layer():
+        # Mesma camada usada pelo FindPoints; sem ela o tracing não informa os clientes afetados
+        layers = QgsProject.instance().mapLayersByName('hds_tracing')
+        return layers[0] if layers else None
+
+    @staticmethod
+    def __sources_layer():
+        # Reservatórios, bombas e VRPs que definem o sentido do escoamento; sem ela o tracing não é dirigido
+        layers = QgsProject.instance().mapLayersByName('fontes_tracing')
+        return layers[0] if layers else None
 
     def set_status_msg(self, msg):
         self._ui.lbl_status.setText(msg)
@@ -205,4 +288,34 @@ class Settings:
         id_pipelines = self._settings.value(self.sections + '/id_pipeline')
         id_valves = self._settings.value(self.sections + '/id_valves')
 
-        return id_pipelines, id_valves
\ No newline at end of file
+        return id_pipelines, id_valves
+
+    def save_options(self, log_level, profile_path, customers_path, direction, highlight):
+        # Opções do tracing (aba Opções); valores vazios usam o padrão
+        self._settings.setValue(self.sections + '/log_level', log_level)
+        self._settings.setValue(self.sections + '/profile_path', profile_path)
+        self._settings.setValue(self.sections + '/customers_path', customers_path)
+        self._settings.setValue(self.sections + '/direction', direction)
+        self._settings.setValue(self.sections + '/highlight', 'true' if highlight else 'false')
+
+    def get_log_level(self):
+        # Nível das mensagens do tracing (0 = DEBUG ... 3 = CRITICAL); None usa o padrão
+        level = self._settings.value(self.sections + '/log_level')
+        return int(level) if level not in (None, '') else None
+
+    def get_profile_path(self):
+        # Arquivo JSON com os tempos por fase de cada tracing (vazio = não salva)
+        return self._settings.value(self.sections + '/profile_path') or None
+
+    def get_customers_path(self):
+        # Arquivo CSV com os hidrômetros afetados por cada tracing (vazio = não salva)
+        return self._settings.value(self.sections + '/customers_path') or None
+
+    def get_direction(self):
+        # Tracing dirigido: 'upstream', 'downstream' ou 'both' (vazio = tracing normal)
+        direction = self._settings.value(self.sections + '/direction')
+        return direction if direction in TRACE_MODES else None
+
+    def get_highlight(self):
+        # Destacar no mapa os registros fechados e não visíveis (além da seleção dos registros a operar)
+        return str(self._settings.value(self.sections + '/highlight', 'false')).lower() in ('true', '1')
\ No newline at end of file
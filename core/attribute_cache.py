@@ -0,0 +1,118 @@
+import threading
+
+from qgis.core import QgsFeatureRequest
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class AttributeTable:
+    """
+    Cópia em memória (fid -> tupla de valores) somente dos campos usados pelo tracing.
+    É carregada com uma única requisição sem geometria e atualizada aos poucos pelos sinais de edição da camada.
+    Os sinais são ligados na criação (na thread principal, ver watch_attribute_table) e a leitura fica para
+    ensure_loaded, que pode rodar em uma tarefa.
+    """
+
+    def __init__(self, layer, fields):
+        self.fields = tuple(fields)
+        self._layer = layer
+        self._positions = {name: i for i, name in enumerate(self.fields)}
+        self._records = None  # carregada em ensure_loaded
+        self._load_lock = threading.Lock()
+
+        layer.attributeValueChanged.connect(self.__on_attribute_changed)
+        layer.featureAdded.connect(lambda fid: self.refresh([fid]))
+        layer.featureDeleted.connect(lambda fid: self.__drop([fid]))
+        layer.committedFeaturesAdded.connect(lambda layer_id, features: self.refresh([f.id() for f in features]))
+        layer.committedFeaturesRemoved.connect(lambda layer_id, fids: self.__drop(fids))
+        layer.committedAttributeValuesChanges.connect(lambda layer_id, changes: self.refresh(list(changes.keys())))
+        layer.afterRollBack.connect(self.__on_rollback)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, fid):
+        return fid in self._records
+
+    def load(self):
+        self._records = dict(self.__fetch(QgsFeatureRequest()))
+
+    def ensure_loaded(self):
+        with self._load_lock:
+            if self._records is None:
+                self.load()
+
+    def refresh(self, fids):
+        """Recarrega somente as feições informadas (antes da carga não há o que atualizar)"""
+        if not fids or self._records is None:
+            return
+        self._records.update(self.__fetch(QgsFeatureRequest().setFilterFids(fids)))
+
+    def record(self, fid):
+        return self._records.get(fid)
+
+    def value(self, fid, field):
+        record = self._records.get(fid)
+        if record is None:
+            return None
+        return record[self._positions[field]]
+
+    def column(self, field):
+        """Dicionário fid -> valor de um campo"""
+        position = self._positions[field]
+        return {fid: record[position] for fid, record in self._records.items()}
+
+    def __fetch(self, request):
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(list(self.fields), self._layer.fields())
+        for feature in self._layer.getFeatures(request):
+            yield feature.id(), tuple(feature[name] for name in self.fields)
+
+    def __drop(self, fids):
+        if self._records is not None:
+            for fid in fids:
+                self._records.pop(fid, None)
+
+    def __on_rollback(self):
+        if self._records is not None:
+            self.load()
+
+    def __on_attribute_changed(self, fid, index, value):
+        if self._records is None:
+            return
+        name = self._layer.fields().at(index).name()
+        record = self._records.get(fid)
+        if name not in self._positions or record is None:
+            return
+        record = list(record)
+        record[self._positions[name]] = value
+        self._records[fid] = tuple(record)
+
+
+def get_attribute_table(layer, fields):
+    """Tabela de atributos compartilhada por camada e conjunto de campos"""
+    table = watch_attribute_table(layer, fields)
+    table.ensure_loaded()
+    return table
+
+
+def watch_attribute_table(layer, fields):
+    """
+    Cria (sem carregar) a tabela compartilhada e liga os sinais da camada. Deve ser chamada na thread principal:
+    um sinal ligado em uma tarefa fica preso à thread da tarefa, que não tem event loop, e nunca é entregue.
+    """
+    key = (layer.id(), tuple(fields))
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is None:
+            table = AttributeTable(layer, fields)
+            _tables[key] = table
+            layer.willBeDeleted.connect(lambda: _drop_tables(key[0]))
+    return table
+
+
+def _drop_tables(layer_id):
+    with _tables_lock:
+        for key in [k for k in _tables if k[0] == layer_id]:
+            del _tables[key]
@@ -0,0 +1,102 @@
+"""
+Isolamento a partir do ponto de rompimento, sem QGIS: os registros do resultado do tracing ordenados pela
+distância percorrida na rede desde o ponto (a rede do rompimento é dividida nele).
+
+A zona e os registros vêm do tracing normal (ou dos segmentos/resultados em cache); aqui só é feita uma
+busca de menor caminho (Dijkstra com heap) dentro da zona, a partir das duas extremidades da rede rompida,
+até alcançar todos os registros do contorno. O custo acompanha o tamanho da zona, não o da rede.
+"""
+import heapq
+import math
+
+from core.tracing_engine import NO_VALVE, VALVE_CLOSED, VALVE_OPEN
+
+
+class RankedValve:
+    """Registro do isolamento: distância na rede desde o rompimento e redes do caminho (ids das feições)"""
+
+    def __init__(self, valve, state, distance, path):
+        self.valve = valve
+        self.state = state  # VALVE_OPEN | VALVE_CLOSED | VALVE_NOT_VISIBLE
+        self.distance = distance  # math.inf quando o caminho não foi encontrado
+        self.path = path  # da rede rompida até a rede que chega no registro
+
+
+class BreakIsolation:
+    """Resultado do tracing da rede rompida e os registros ordenados pela distância"""
+
+    def __init__(self, result, pipe_index, along, valves):
+        self.result = result
+        self.pipe_index = pipe_index
+        self.along = along  # posição do rompimento ao longo da rede, a partir do primeiro vértice
+        self.valves = valves
+
+    def valves_to_close(self):
+        """Registros abertos e visíveis, do mais próximo ao mais distante"""
+        return [ranked for ranked in self.valves if ranked.state == VALVE_OPEN]
+
+
+def rank_valves(topology, result, pipe_index, along, length, valve_state, lengths, is_canceled=None):
+    """
+    :param result: TraceResult da rede pipe_index (trace, trace_many, IsolationSegments ou cache)
+    :param along: distância do rompimento ao primeiro vértice da rede, ao longo dela; length: comprimento da rede
+    :param valve_state: função id do registro -> VALVE_OPEN | VALVE_CLOSED | VALVE_NOT_VISIBLE
+    :param lengths: índice da rede -> comprimento (ao menos para as redes da zona)
+    :return: BreakIsolation ou None se cancelado
+    """
+    pipe_ids, pipe_nodes, node_pipes, node_valve = topology.lists()
+    zone = set(result.pipe_indices)
+    boundary = result.valves | result.valves_closed | result.valves_not_visible
+
+    # Rede rompida dividida no ponto: as duas partes partem do rompimento
+    first, last = pipe_nodes[pipe_index]
+    along = min(max(along, 0.0), length)
+    heap = [(along, first, -1, -1), (length - along, last, -1, -1)]
+    heapq.heapify(heap)
+    distance = {}
+    previous = {}  # nó -> (nó anterior, rede usada) no menor caminho
+    ranked = {}
+
+    settled = 0
+    while heap and len(ranked) < len(boundary):
+        d, node, origin, via = heapq.heappop(heap)
+        if node in distance:
+            continue
+        distance[node] = d
+        if via >= 0:
+            previous[node] = (origin, via)
+        settled += 1
+        if is_canceled is not None and settled % 1000 == 0 and is_canceled():
+            return None
+
+        valve = node_valve[node]
+        if valve != NO_VALVE:
+            state = valve_state(valve)
+            if valve in boundary and valve not in ranked:
+                ranked[valve] = RankedValve(valve, state, d, _path(previous, node, pipe_index, pipe_ids))
+            if state in (VALVE_OPEN, VALVE_CLOSED):
+                continue  # o isolamento termina no registro
+
+        for pipe in node_pipes[node]:
+            if pipe not in zone or pipe == pipe_index:
+                continue
+            for other in pipe_nodes[pipe]:
+                if other != node and other >= 0 and other not in distance:
+                    heapq.heappush(heap, (d + lengths[pipe], other, node, pipe))
+
+    # Registros do resultado sem caminho dentro da zona (ex.: rede que só passa pelo nó) ficam no fim
+    for valve in boundary - set(ranked):
+        ranked[valve] = RankedValve(valve, valve_state(valve), math.inf, [])
+
+    valves = sorted(ranked.values(), key=lambda r: (r.distance, r.valve))
+    return BreakIsolation(result, pipe_index, along, valves)
+
+
+def _path(previous, node, pipe_index, pipe_ids):
+    path = []
+    while node in previous:
+        node, pipe = previous[node]
+        path.append(pipe_ids[pipe])
+    path.append(pipe_ids[pipe_index])
+    path.reverse()
+    return path
@@ -0,0 +1,145 @@
+import math
+
+from qgis.core import Qgis, QgsApplication, QgsGeometry, QgsMessageLog, QgsTask
+
+from core.attribute_cache import get_attribute_table
+from core.break_isolation import rank_valves
+from core.feature_stream import iter_features
+from core.geometry_kernels import locate_on_parts
+from core.index_cache import get_spatial_index
+from core.isolation_segments import cached_isolation_segments
+from core.network_topology import VALVE_FIELDS, get_lookups, get_topology, polyline_arrays
+from core.result_cache import get_trace_results
+from core.tracing_engine import VALVE_CLOSED, VALVE_OPEN, trace
+
+# Redes candidatas consultadas no índice espacial em volta do clique
+BREAK_CANDIDATES = 4
+
+# Situação exibida para cada registro da lista
+STATE_NAMES = {VALVE_OPEN: 'fechar', VALVE_CLOSED: 'já fechado'}
+
+
+class BreakTracing(QgsTask):
+    """
+    Isolamento a partir do ponto de rompimento (clique no mapa): a rede mais próxima do ponto é dividida nele
+    e os registros do tracing são ordenados pela distância percorrida na rede até cada um (break_isolation).
+    A zona vem dos segmentos ou resultados em cache quando houver; só as redes da zona são lidas da camada.
+    """
+
+    def __init__(self, pipelines, valves, point, description='BreakTracingCAJ', user_distance=0.001,
+                 search_distance=1.0, parent=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.__pipelines = pipelines
+        self.__valves = valves
+        self.__point = point  # QgsPointXY no SRC da camada de redes
+        self.__user_distance = user_distance
+        self.__search_distance = search_distance
+        self._parent = parent
+        self.__exception = None
+        self.__valves_table = None
+        self.isolation = None
+
+        # Resultados anteriores das mesmas camadas; obtidos aqui para que os sinais sejam ligados na thread principal
+        self.__cache = get_trace_results(pipelines, valves, user_distance)
+        self.pipe_id = None
+
+    def run(self):
+        QgsMessageLog.logMessage(f'Started task {self.description()}', 'TracingCAJ', Qgis.Info)
+        try:
+            return self.__run()
+        except Exception as e:
+            self.__exception = e
+            return False
+
+    def __run(self):
+        self.pipe_id, parts = self.__locate()
+        if self.pipe_id is None:
+            return False
+
+        segments = cached_isolation_segments(self.__pipelines, self.__valves, self.__user_distance)
+        topology = segments.topology if segments is not None else get_topology(
+            self.__pipelines, self.__valves, self.__user_distance)
+        valve_state, diameter = get_lookups(self.__pipelines, self.__valves, topology)
+        self.__valves_table = get_attribute_table(self.__valves, VALVE_FIELDS)
+        seed_index = topology.pipe_index.get(self.pipe_id)
+        if seed_index is None:
+            return False
+
+        # Zona do tracing normal da rede rompida (reaproveitada dos caches sempre que possível)
+        result = self.__cache.get(self.pipe_id)
+        if result is None:
+            if segments is not None:
+                result = segments.result(seed_index)
+            if result is None:
+                # Sem segmento (descartado por uma atualização) ou sem segmentos calculados: tracing da rede
+                result = trace(topology, seed_index, valve_state, diameter, is_canceled=self.isCanceled)
+            if result is None:
+                return False
+            self.__cache.put(self.pipe_id, result)
+
+        # Comprimentos somente das redes da zona
+        lengths = {}
+        for feature in iter_features(self.__pipelines, fids=sorted(result.pipelines)):
+            index = topology.pipe_index.get(feature.id())
+            if index is not None and feature.hasGeometry():
+                lengths[index] = feature.geometry().length()
+
+        _, along, length = locate_on_parts(parts, (self.__point.x(), self.__point.y()))
+        self.isolation = rank_valves(topology, result, seed_index, along, length, valve_state, lengths,
+                                     is_canceled=self.isCanceled)
+        return self.isolation is not None
+
+    def __locate(self):
+        """Rede mais próxima do ponto (até search_distance) e os vértices de cada parte dela"""
+        index = get_spatial_index(self.__pipelines)
+        point = QgsGeometry.fromPointXY(self.__point)
+        best, best_distance = None, None
+        for fid in index.nearestNeighbor(self.__point, BREAK_CANDIDATES, self.__search_distance):
+            geometry = index.geometry(fid)
+            distance = geometry.distance(point)
+            if distance <= self.__search_distance and (best is None or distance < best_distance):
+                best, best_distance = (fid, geometry), distance
+        if best is None:
+            return None, None
+        fid, geometry = best
+        parts = polyline_arrays(geometry)
+        return (fid, parts) if parts else (None, None)
+
+    def finished(self, result):
+        if self._parent:
+            self._parent.set_enable_button_iniciar()
+
+        if not result:
+            if self.__exception is not None:
+                QgsMessageLog.logMessage(f"Task {self.description()}"
+                                         f"Exception: {self.__exception}", 'TracingCAJ', level=Qgis.Critical)
+                raise self.__exception
+            message = ('Nenhuma rede próxima do ponto clicado' if self.pipe_id is None
+                       else f"Task {self.description()} not successful "
+                            f"(probably the task was manually canceled by the user)")
+            QgsMessageLog.logMessage(message, 'TracingCAJ', level=Qgis.Warning)
+            if self._parent:
+                self._parent.set_status_msg(message)
+            return
+
+        # Seleção dos registros a fechar e das redes afetadas; a lista segue a ordem de distância
+        to_close = self.isolation.valves_to_close()
+        self.__valves.selectByIds([ranked.valve for ranked in to_close])
+        self.__pipelines.selectByIds(list(self.isolation.result.pipelines))
+        names = [self.__name(ranked.valve) for ranked in to_close]
+
+        lines = []
+        for ranked in self.isolation.valves:
+            distance = 'sem caminho' if math.isinf(ranked.distance) else f'{ranked.distance:.1f} m'
+            state = STATE_NAMES.get(ranked.state, 'não visível')
+            lines.append(f'{self.__name(ranked.valve)} ({state}): {distance}, {len(ranked.path)} redes')
+        msg = f"Rompimento na rede {self.pipe_id}\n" + '\n'.join(lines)
+        QgsMessageLog.logMessage(f"Task {self.description()} has been executed correctly\n{msg}",
+                                 'TracingCAJ', level=Qgis.Success)
+        QgsApplication.clipboard().setText(','.join(names))
+        if self._parent:
+            self._parent.set_status_msg('Finalizado! registros no CTRL+V (do mais próximo ao mais distante)')
+            self._parent.set_final_msg(msg)
+
+    def __name(self, valve_id):
+        return str(self.__valves_table.value(valve_id, 'codigo'))
@@ -0,0 +1,155 @@
+"""
+Validação da conectividade da rede (somente numpy, sem QGIS), para rodar antes do tracing.
+
+O tracing liga extremidades de redes e registros que estão a menos de user_distance: digitalização imprecisa
+faz o tracing vazar ou parar sem aviso. Todas as extremidades e registros são distribuídos em uma grade
+(SegmentGrid) de uma vez e os erros são encontrados com operações vetorizadas:
+    ponta_solta           extremidade sem outra rede até 'gap'
+    quase_conectada       extremidade com outra rede a mais de user_distance, mas a até 'gap'
+    registro_fora_do_no   registro a mais de user_distance de qualquer extremidade de rede (o tracing o ignora)
+    segmento_duplicado    segmento com as mesmas extremidades de outro (em qualquer sentido)
+"""
+import numpy as np
+
+from core.geometry_kernels import SegmentGrid
+
+ERROR_TYPES = ('ponta_solta', 'quase_conectada', 'registro_fora_do_no', 'segmento_duplicado')
+DANGLE, NEAR_MISS, ORPHAN_VALVE, DUPLICATE_SEGMENT = range(len(ERROR_TYPES))
+
+# Distância (unidades da camada) até a qual uma extremidade desconectada é considerada "quase conectada"
+DEFAULT_GAP = 0.5
+
+# Extremidades consultadas na grade de uma vez (limita a memória dos pares extremidade x segmento)
+CHUNK_POINTS = 200000
+
+_COLUMNS = ('kind', 'x', 'y', 'feature', 'other', 'distance')
+
+
+def pipe_endpoints(starts, ends, owners):
+    """
+    Primeira e última coordenada de cada rede a partir dos segmentos (na ordem de pipeline_segments)
+    :return: (ids das redes (n,), início (n, 2), fim (n, 2))
+    """
+    if len(owners) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2)), np.zeros((0, 2))
+    first = np.nonzero(np.r_[True, owners[1:] != owners[:-1]])[0]
+    last = np.r_[first[1:], len(owners)] - 1
+    return owners[first], starts[first], ends[last]
+
+
+def check_connectivity(starts, ends, owners, valve_ids, valve_xy, tolerance=0.001, gap=DEFAULT_GAP):
+    """
+    :param starts: início de cada segmento das redes (k, 2); ends: fim (k, 2); owners: id da rede (k,)
+    :param valve_ids: ids dos registros (m,); valve_xy: coordenadas (m, 2)
+    :param tolerance: user_distance do tracing
+    :return: dicionário coluna -> array, uma linha por erro: kind (índice em ERROR_TYPES), x, y,
+             feature (rede ou registro), other (outra rede/segmento envolvido ou -1), distance (NaN = sem vizinho)
+    """
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    owners = np.asarray(owners, dtype=np.int64)
+    valve_ids = np.asarray(valve_ids, dtype=np.int64)
+    valve_xy = np.asarray(valve_xy, dtype=np.float64).reshape(-1, 2)
+    gap = max(gap, tolerance)
+
+    parts = [_endpoint_errors(starts, ends, owners, tolerance, gap),
+             _valve_errors(starts, ends, owners, valve_ids, valve_xy, tolerance, gap),
+             _duplicate_segments(starts, ends, owners, tolerance)]
+    return {name: np.concatenate([part[name] for part in parts]) for name in _COLUMNS}
+
+
+def summary(errors):
+    """Quantidade de erros de cada tipo"""
+    counts = np.bincount(errors['kind'], minlength=len(ERROR_TYPES))
+    return dict(zip(ERROR_TYPES, counts.tolist()))
+
+
+def _endpoint_errors(starts, ends, owners, tolerance, gap):
+    pipe_ids, first, last = pipe_endpoints(starts, ends, owners)
+    points = np.vstack([first, last])
+    point_pipe = np.concatenate([pipe_ids, pipe_ids])
+
+    # Células do tamanho típico dos segmentos: com células de lado 'gap' cada segmento longo ocuparia
+    # centenas de células
+    lengths = np.hypot(*(ends - starts).T)
+    cell = max(gap, float(np.median(lengths))) if len(lengths) else gap
+    grid = SegmentGrid(starts, ends, owners, gap, cell_size=cell)
+
+    # Rede mais próxima de cada extremidade, sem contar a própria rede
+    distance = np.full(len(points), np.inf)
+    nearest = np.full(len(points), -1, dtype=np.int64)
+    for begin in range(0, len(points), CHUNK_POINTS):
+        point, segment, d2, _ = grid.candidates(points[begin:begin + CHUNK_POINTS])
+        point += begin
+        other = grid.owners[segment]
+        keep = (other != point_pipe[point]) & (d2 <= gap ** 2)
+        _nearest(distance, nearest, point[keep], d2[keep], other[keep])
+
+    dangle = np.isinf(distance)
+    near_miss = ~dangle & (distance > tolerance)
+    return _concat(_rows(DANGLE, points[dangle], point_pipe[dangle], -1, np.nan),
+                   _rows(NEAR_MISS, points[near_miss], point_pipe[near_miss], nearest[near_miss],
+                         distance[near_miss]))
+
+
+def _valve_errors(starts, ends, owners, valve_ids, valve_xy, tolerance, gap):
+    # Registros como segmentos de comprimento zero (há menos registros que extremidades); células de lado
+    # 2 * gap: cada registro ocupa no máximo 2 x 2 células
+    _, first, last = pipe_endpoints(starts, ends, owners)
+    grid = SegmentGrid(valve_xy, valve_xy, valve_ids, gap, cell_size=2 * gap)
+    d2 = np.full(len(valve_xy), np.inf)
+    nodes = np.vstack([first, last])
+    for begin in range(0, len(nodes), CHUNK_POINTS):
+        _, valve, candidate_d2, _ = grid.candidates(nodes[begin:begin + CHUNK_POINTS])
+        np.minimum.at(d2, valve, candidate_d2)
+
+    # Extremidade mais próxima de cada registro
+    distance = np.sqrt(d2)
+    distance[distance > gap] = np.inf
+    orphan = distance > tolerance
+    return _rows(ORPHAN_VALVE, valve_xy[orphan], valve_ids[orphan], -1,
+                 np.where(np.isinf(distance[orphan]), np.nan, distance[orphan]))
+
+
+def _duplicate_segments(starts, ends, owners, tolerance):
+    if len(owners) == 0:
+        return _rows(DUPLICATE_SEGMENT, np.zeros((0, 2)), np.zeros(0, dtype=np.int64), -1, np.nan)
+
+    # Extremidades arredondadas para a tolerância, em ordem canônica (o sentido do segmento não importa)
+    a = np.round(starts / tolerance).astype(np.int64)
+    b = np.round(ends / tolerance).astype(np.int64)
+    swap = (a[:, 0] > b[:, 0]) | ((a[:, 0] == b[:, 0]) & (a[:, 1] > b[:, 1]))
+    a[swap], b[swap] = b[swap], a[swap].copy()
+    keys = np.hstack([a, b])
+
+    # Ordenação estável: em cada grupo de segmentos iguais o primeiro é o de menor índice
+    order = np.lexsort(keys.T[::-1])
+    ordered = keys[order]
+    new = np.r_[True, (ordered[1:] != ordered[:-1]).any(axis=1)]
+    first = order[new][np.cumsum(new) - 1]
+    repeated, first = order[~new], first[~new]
+    middle = (starts[repeated] + ends[repeated]) / 2
+    return _rows(DUPLICATE_SEGMENT, middle, owners[repeated], owners[first], 0.0)
+
+
+def _nearest(distance, nearest, point, d2, other):
+    """Grava em distance/nearest a menor distância de cada ponto e o dono do candidato mais próximo"""
+    if len(point):
+        order = np.lexsort((d2, point))
+        first = order[np.r_[True, point[order][1:] != point[order][:-1]]]
+        distance[point[first]] = np.sqrt(d2[first])
+        nearest[point[first]] = other[first]
+
+
+def _rows(kind, xy, feature, other, distance):
+    n = len(xy)
+    return {'kind': np.full(n, kind, dtype=np.int8),
+            'x': xy[:, 0].astype(np.float64),
+            'y': xy[:, 1].astype(np.float64),
+            'feature': np.asarray(feature, dtype=np.int64),
+            'other': np.broadcast_to(np.asarray(other, dtype=np.int64), (n,)).copy(),
+            'distance': np.broadcast_to(np.asarray(distance, dtype=np.float64), (n,)).copy()}
+
+
+def _concat(*parts):
+    return {name: np.concatenate([part[name] for part in parts]) for name in _COLUMNS}
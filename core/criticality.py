@@ -0,0 +1,222 @@
+"""
+Criticidade de toda a rede (sem QGIS): para cada rede, o que uma falha nela exige e afeta —
+registros a operar, comprimento de rede e hidrômetros afetados.
+
+As redes são divididas em lotes (shards) espacialmente próximos e cada lote é particionado em zonas
+como em build_segments, então redes da mesma zona de isolamento são calculadas uma única vez.
+Os lotes rodam em processos paralelos que abrem os arrays da rede gravados em disco como memória
+mapeada (somente leitura). Cada lote concluído é gravado no diretório de trabalho: uma execução
+interrompida continua dos lotes que faltam.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from core.process_pool import create_process_pool
+from core.tracing_engine import NetworkAttributes, NetworkTopology, partition_pipes
+
+# Redes por lote
+DEFAULT_SHARD_SIZE = 20000
+
+# Colunas do resultado (uma linha por rede)
+CRITICALITY_FIELDS = ('valves', 'valves_closed', 'valves_not_visible', 'pipes', 'length', 'hydrometers', 'zone')
+
+_TOPOLOGY_ARRAYS = ('pipe_ids', 'pipe_nodes', 'node_xy', 'node_pipe_ptr', 'node_pipe_idx', 'node_valve')
+_ATTRIBUTE_ARRAYS = ('diameters', 'valve_ids', 'valve_states')
+_INPUT_ARRAYS = ('lengths', 'hydrometers')
+
+
+def criticality(topology, attributes, lengths, hydrometers, pipes, is_canceled=None):
+    """
+    Criticidade das redes 'pipes' (índices na topologia).
+    :param lengths: comprimento de cada rede (n_pipes,)
+    :param hydrometers: hidrômetros ligados a cada rede (n_pipes,)
+    :return: dicionário coluna -> array na ordem de 'pipes' (mais 'pipe') ou None se cancelado
+    """
+    pipes = np.asarray(pipes, dtype=np.int64)
+    partition = partition_pipes(topology, pipes.tolist(), attributes.valve_state, attributes.diameter, is_canceled)
+    if partition is None:
+        return None
+    pipe_segment, segments = partition
+
+    # Métricas de cada zona calculadas uma vez e repetidas para as redes da zona
+    per_segment = np.zeros((len(segments), len(CRITICALITY_FIELDS)), dtype=np.float64)
+    for segment, result in enumerate(segments):
+        reached = np.asarray(result.pipe_indices, dtype=np.int64)
+        per_segment[segment] = (len(result.valves), len(result.valves_closed), len(result.valves_not_visible),
+                                len(reached), lengths[reached].sum(), hydrometers[reached].sum(),
+                                reached.min() if result.reversible else -1)
+
+    rows = per_segment[pipe_segment[pipes]]
+    columns = {'pipe': pipes}
+    for position, field in enumerate(CRITICALITY_FIELDS):
+        columns[field] = rows[:, position] if field == 'length' else rows[:, position].astype(np.int64)
+    return columns
+
+
+def shard_pipes(topology, shard_size=DEFAULT_SHARD_SIZE):
+    """Redes vivas em ordem de curva Z (vizinhas no mapa ficam no mesmo lote), divididas em lotes"""
+    alive = np.nonzero(topology.pipe_nodes[:, 0] >= 0)[0]
+    if len(alive) == 0:
+        return []
+    xy = topology.node_xy[topology.pipe_nodes[alive, 0]]
+    order = alive[np.argsort(_z_order(xy), kind='stable')]
+    return [order[begin:begin + shard_size] for begin in range(0, len(order), shard_size)]
+
+
+def _z_order(xy):
+    low = xy.min(axis=0)
+    span = np.maximum(xy.max(axis=0) - low, 1e-9)
+    q = ((xy - low) / span * 65535).astype(np.uint64)
+    code = np.zeros(len(xy), dtype=np.uint64)
+    for bit in range(16):
+        code |= ((q[:, 0] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        code |= ((q[:, 1] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+    return code
+
+
+class CriticalityRun:
+    """
+    Execução retomável da criticidade em 'directory':
+        manifest.json       identificação da rede (hash dos arrays) e tamanho dos lotes
+        network/*.npy       arrays da rede, abertos pelos processos como memória mapeada
+        shard_00000.npz     resultado de cada lote concluído
+    Se a rede ou o tamanho dos lotes mudar, os lotes antigos são descartados.
+    """
+
+    def __init__(self, directory, topology, attributes, lengths, hydrometers, shard_size=DEFAULT_SHARD_SIZE):
+        self.directory = directory
+        self.network_dir = os.path.join(directory, 'network')
+        self.shards = shard_pipes(topology, shard_size)
+
+        arrays = {name: getattr(topology, name) for name in _TOPOLOGY_ARRAYS}
+        arrays.update({name: getattr(attributes, name) for name in _ATTRIBUTE_ARRAYS})
+        arrays['lengths'] = np.asarray(lengths, dtype=np.float64)
+        arrays['hydrometers'] = np.asarray(hydrometers, dtype=np.int64)
+        fingerprint = _fingerprint(arrays, shard_size)
+
+        os.makedirs(self.network_dir, exist_ok=True)
+        manifest_path = os.path.join(directory, 'manifest.json')
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as file:
+                manifest = json.load(file)
+
+        if manifest is None or manifest.get('fingerprint') != fingerprint:
+            for shard in range(len(self.shards) if manifest is None else manifest.get('shards', 0)):
+                path = self.__shard_path(shard)
+                if os.path.exists(path):
+                    os.remove(path)
+            # Sem manifest os arquivos não são usados; cada arquivo é gravado em um temporário e renomeado,
+            # então uma gravação interrompida (ou um processo que ainda mapeia o arquivo antigo) não lê pela metade
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            for name, array in arrays.items():
+                path = os.path.join(self.network_dir, name + '.npy')
+                temporary = path + '.tmp.npy'
+                np.save(temporary, np.ascontiguousarray(array))
+                os.replace(temporary, path)
+            temporary = manifest_path + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as file:
+                json.dump({'fingerprint': fingerprint, 'shard_size': shard_size, 'shards': len(self.shards),
+                           'pipes': int(topology.n_pipes)}, file)
+            os.replace(temporary, manifest_path)
+
+    def __shard_path(self, shard):
+        return os.path.join(self.directory, f'shard_{shard:05d}.npz')
+
+    def pending(self):
+        """Lotes ainda sem resultado"""
+        return [shard for shard in range(len(self.shards)) if not os.path.exists(self.__shard_path(shard))]
+
+    def run(self, workers=1, is_canceled=None, progress=None):
+        """
+        Calcula os lotes pendentes, gravando cada um assim que termina.
+        :param progress: função chamada com o percentual (0-100) de lotes concluídos
+        :return: False se cancelado
+        """
+        pending = self.pending()
+        done = len(self.shards) - len(pending)
+        if progress is not None:
+            progress(100 * done // max(len(self.shards), 1))
+
+        if workers <= 1:
+            init_criticality_worker(self.network_dir)
+            for shard in pending:
+                if is_canceled is not None and is_canceled():
+                    return False
+                self.__save(shard, criticality_in_worker(self.shards[shard]))
+                done += 1
+                if progress is not None:
+                    progress(100 * done // len(self.shards))
+            return True
+
+        with create_process_pool(workers, init_criticality_worker, (self.network_dir,)) as pool:
+            futures = {pool.submit(criticality_in_worker, self.shards[shard]): shard for shard in pending}
+            for future in as_completed(futures):
+                if is_canceled is not None and is_canceled():
+                    for other in futures:
+                        other.cancel()
+                    return False
+                self.__save(futures[future], future.result())
+                done += 1
+                if progress is not None:
+                    progress(100 * done // len(self.shards))
+        return True
+
+    def __save(self, shard, columns):
+        # Grava em arquivo temporário e renomeia: um lote interrompido no meio não conta como concluído
+        path = self.__shard_path(shard)
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, **columns)
+        os.replace(temporary, path)
+
+    def results(self):
+        """Colunas de todos os lotes concluídos, ordenadas pelo índice da rede, mais 'fid' (id da feição)"""
+        parts = []
+        for shard in range(len(self.shards)):
+            path = self.__shard_path(shard)
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    parts.append({name: data[name] for name in data.files})
+        if not parts:
+            return {'fid': np.zeros(0, dtype=np.int64), 'pipe': np.zeros(0, dtype=np.int64),
+                    **{field: np.zeros(0) for field in CRITICALITY_FIELDS}}
+
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+        order = np.argsort(columns['pipe'], kind='stable')
+        columns = {name: values[order] for name, values in columns.items()}
+        pipe_ids = np.load(os.path.join(self.network_dir, 'pipe_ids.npy'), mmap_mode='r')
+        columns['fid'] = np.asarray(pipe_ids[columns['pipe']])
+        return columns
+
+
+def _fingerprint(arrays, shard_size):
+    digest = hashlib.sha1(str(shard_size).encode())
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        digest.update(name.encode())
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+# Rede aberta por cada processo filho (ver init_criticality_worker)
+_worker_network = None
+
+
+def init_criticality_worker(network_dir):
+    global _worker_network
+    arrays = {name: np.load(os.path.join(network_dir, name + '.npy'), mmap_mode='r')
+              for name in _TOPOLOGY_ARRAYS + _ATTRIBUTE_ARRAYS + _INPUT_ARRAYS}
+    topology = NetworkTopology(**{name: arrays[name] for name in _TOPOLOGY_ARRAYS})
+    attributes = NetworkAttributes(**{name: arrays[name] for name in _ATTRIBUTE_ARRAYS})
+    _worker_network = (topology, attributes, arrays['lengths'], arrays['hydrometers'])
+
+
+def criticality_in_worker(pipes):
+    topology, attributes, lengths, hydrometers = _worker_network
+    return criticality(topology, attributes, lengths, hydrometers, pipes)
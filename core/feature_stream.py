@@ -0,0 +1,54 @@
+"""
+Leitura de feições sob demanda (geradores), pedindo ao provider somente os campos e a geometria necessários.
+A memória usada fica limitada ao tamanho do bloco (chunk_size), e não ao tamanho da camada.
+"""
+from itertools import islice
+
+from qgis.core import QgsFeatureRequest
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# Feições gravadas por vez no provider ou no sink (addFeatures)
+WRITE_BATCH_SIZE = 50000
+
+
+def feature_request(layer, fields=(), geometry=True):
+    request = QgsFeatureRequest()
+    if fields:
+        request.setSubsetOfAttributes(list(fields), layer.fields())
+    else:
+        request.setNoAttributes()
+    if not geometry:
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+    return request
+
+
+def iter_features(layer, fids=None, fields=(), geometry=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Feições da camada (ou somente das fids informadas, consultadas em blocos de chunk_size)
+    :param fields: nomes dos campos lidos; vazio = nenhum atributo
+    :param geometry: False para não ler a geometria
+    """
+    if fids is None:
+        yield from layer.getFeatures(feature_request(layer, fields, geometry))
+        return
+
+    for chunk in iter_chunks(fids, chunk_size):
+        request = feature_request(layer, fields, geometry).setFilterFids(chunk)
+        yield from layer.getFeatures(request)
+
+
+def iter_chunks(iterable, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Listas de até chunk_size itens"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_values(layer, fids, field, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Pares (fid, valor do campo) sem geometria"""
+    for feature in iter_features(layer, fids, fields=(field,), geometry=False, chunk_size=chunk_size):
+        yield feature.id(), feature[field]
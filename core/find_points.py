@@ -1,81 +1,74 @@
-from qgis._core import QgsGeometry, QgsDistanceArea
-from qgis.core import QgsTask, QgsProject, QgsSpatialIndex, QgsPointXY, QgsMessageLog, QgsRectangle, QgsVectorLayer, \
-    QgsApplication, QgsPoint, Qgis, QgsWkbTypes
-from qgis.utils import iface
+import numpy as np
+
+from qgis.core import QgsTask, QgsProject, QgsMessageLog, QgsVectorLayer, Qgis
+
+from core.geometry_kernels import points_near_polyline
+from core.index_cache import get_spatial_index
+from core.network_topology import polyline_arrays
+
+
+# Distância máxima (unidades da camada) entre a rede e o hidrômetro
+HD_MAX_DISTANCE = 25
+
+
+def points_near_pipeline(idx_points, pipeline, max_distance=HD_MAX_DISTANCE, exclude=()):
+    """
+    Pontos (ids) a até max_distance da rede: candidatos pelo retângulo envolvente no índice espacial
+    e distância exata ponto-segmento calculada de uma vez para todos os candidatos
+    :param idx_points: QgsSpatialIndex da camada de pontos (com geometrias armazenadas)
+    """
+    box = pipeline.boundingBox().buffered(max_distance)
+    candidates = [fid for fid in idx_points.intersects(box) if fid not in exclude]
+    if not candidates:
+        return []
+
+    points = np.array([(p.x(), p.y()) for p in (idx_points.geometry(fid).vertexAt(0) for fid in candidates)],
+                      dtype=np.float64)
+    candidates = np.array(candidates, dtype=np.int64)
+    found = set()
+    for part in polyline_arrays(pipeline):
+        found.update(candidates[points_near_polyline(points, part, max_distance)].tolist())
+    return sorted(found)
 
 
 class FindPoints(QgsTask):
 
-    def __init__(self, qpipelines, description='FindHds', debug=False):
+    def __init__(self, qpipelines, description='FindHds', debug=False, hydrometers=None):
         super().__init__(description, QgsTask.CanCancel)
 
         self.debug = debug
 
-        if self.debug:
+        if hydrometers is not None:
+            self.hds_feature = hydrometers
+        elif self.debug:
             self.hds_feature = QgsVectorLayer('C:/Users/jeferson.machado/Desktop/QGIS/shapes/hds_tracing.shp',
                                               "hds_tracing", "ogr")
         else:
             self.hds_feature = QgsProject.instance().mapLayersByName('hds_tracing')[0]
-        self.idx_hds = QgsSpatialIndex(self.hds_feature.getFeatures(),
-                                       flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
+        # Índice criado em run (fora da interface), ou já pronto se a tarefa PrepareNetwork rodou antes
+        self.idx_hds = None
 
         self.__exception = None
         self.q_list_pipelines = qpipelines
-        self.list_hds = []
-
-    def find_hds_by_nearest_neighbor(self, points_vertex):
-        hds_nearest = self.idx_hds.nearestNeighbor(point=QgsPointXY(points_vertex), neighbors=10,
-                                                   maxDistance=25)
-
-        if len(hds_nearest) > 0:
-            for hd in hds_nearest:
-                if hd not in self.list_hds:
-                    self.list_hds.append(hd)
-
-    def split_line(self, p1, p2, pos, pipeline):
-        geo = QgsGeometry.fromPolyline([p1, p2])
-        center = geo.centroid()
-        pipeline.insert(pos, center.asPoint())
-
-    def get_points(self, pipeline):
-        pipe = [QgsPointXY(pipeline.vertexAt(i)) for i in range(pipeline.get().childCount())]
-        distances = []
-        breakForce = 0
-        while True:
-            if breakForce == 1000:
-                break
-            # check isCanceled() to handle cancellation
-            if self.isCanceled():
-                return False
-            increment = 0
-            pipeline = QgsGeometry.fromMultiPointXY(pipe)
-
-            for i in range(len(pipe) -1):
-                p1 = pipeline.vertexAt(i)
-                p2 = pipeline.vertexAt(i + 1)
-                d = QgsDistanceArea()
-                distance = d.measureLine(QgsPointXY(p1), QgsPointXY(p2))
-                distances.append(distance)
-                if distance > 10:
-                    self.split_line(p1, p2, i+1+increment, pipe)
-                    increment += 1
-
-            breakForce += 1
-            if distances:
-                if max(distances) <= 10:
-                    break
-            distances.clear()
-        return pipeline
+        self.list_hds = set()
+
+    def find_hds_near_pipeline(self, pipeline):
+        """Hidrômetros a até HD_MAX_DISTANCE da rede"""
+        self.list_hds.update(points_near_pipeline(self.idx_hds, pipeline, HD_MAX_DISTANCE, self.list_hds))
 
     def run(self):
 
         try:
-            while len(self.q_list_pipelines) > 0:
-                pipeline = self.q_list_pipelines.pop(0)
-                pipeline_geo = self.get_points(pipeline.geometry())
+            self.idx_hds = get_spatial_index(self.hds_feature)
+
+            # q_list_pipelines pode ser uma lista ou um gerador de feições (ex.: feature_stream.iter_features)
+            for pipeline in self.q_list_pipelines:
+                # check isCanceled() to handle cancellation
+                if self.isCanceled():
+                    return False
 
-                for i in range(0, len(pipeline_geo.get()) - 1):
-                    self.find_hds_by_nearest_neighbor(pipeline_geo.vertexAt(i))
+                if pipeline.hasGeometry():
+                    self.find_hds_near_pipeline(pipeline.geometry())
 
         except Exception as e:
             self.__exception = e
@@ -85,7 +78,7 @@ class FindPoints(QgsTask):
 
     def finished(self, result):
         if result:
-            self.hds_feature.selectByIds(self.list_hds)
+            self.hds_feature.selectByIds(list(self.list_hds))
 
             QgsMessageLog.logMessage(f"Task {self.description()} has been executed correctly\n"
                                      f"HDS: {self.list_hds}",
@@ -0,0 +1,266 @@
+"""
+Sentido do escoamento calculado uma vez a partir das fontes (reservatórios, bombas, VRPs), sem QGIS.
+
+Cada rede é orientada do nó mais próximo das fontes (Dijkstra pelo comprimento das redes) para o mais
+distante; em caminhos de mesmo comprimento chega primeiro quem vem pela rede de maior diâmetro, e uma rede
+com as duas extremidades à mesma distância fica com o lado alcançado pela rede de maior diâmetro a montante.
+Registros já fechados não deixam a água passar. Redes sem sentido definido (sem fonte que as alcance ou
+empate total) ficam nos dois sentidos.
+
+O resultado é um grafo dirigido (redes que saem e que chegam em cada nó) e o tracing a montante/jusante é
+um percurso simples nesse grafo, sem consultar diâmetros nem a situação dos registros a cada passo.
+"""
+import heapq
+import math
+
+import numpy as np
+
+from core.geometry_kernels import SegmentGrid
+from core.tracing_engine import NO_VALVE, VALVE_CLOSED, VALVE_NOT_VISIBLE, VALVE_OPEN, TraceResult
+
+# Modos do tracing dirigido
+UPSTREAM = 'upstream'  # redes que abastecem a semente (a montante)
+DOWNSTREAM = 'downstream'  # redes abastecidas pela semente (a jusante)
+BOTH = 'both'  # montante e jusante
+TRACE_MODES = (UPSTREAM, DOWNSTREAM, BOTH)
+TRACE_MODE_NAMES = {UPSTREAM: 'montante', DOWNSTREAM: 'jusante', BOTH: 'montante e jusante'}
+
+# Situação de um nó sem registro em node_state
+NO_STATE = -1
+
+# Distância máxima (unidades da camada) entre uma fonte e a extremidade de rede onde ela abastece
+SOURCE_MAX_DISTANCE = 1.0
+
+
+def source_nodes(topology, points, tolerance=SOURCE_MAX_DISTANCE):
+    """Nós da topologia a até 'tolerance' de cada fonte (fontes longe da rede são ignoradas)"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0 or topology.n_nodes == 0:
+        return np.zeros(0, dtype=np.int64)
+    grid = SegmentGrid(topology.node_xy, topology.node_xy, np.arange(topology.n_nodes), tolerance,
+                       cell_size=2 * tolerance)
+    nodes, _, _ = grid.nearest(points)
+    return np.unique(nodes[nodes >= 0])
+
+
+class FlowDirection:
+    """
+    Rede orientada: pipe_from/pipe_to são os nós de montante e jusante de cada rede (-1 = sem sentido
+    definido); out_ptr/out_idx e in_ptr/in_idx (CSR) são as redes que saem e que chegam em cada nó.
+    Redes sem sentido e redes que passam pelo nó sem terminar nele aparecem nas duas listas.
+    Pode ser enviada para outros processos (pickle).
+    """
+
+    def __init__(self, topology, pipe_from, pipe_to, node_distance, node_state):
+        self.topology = topology
+        self.pipe_from = pipe_from  # int32 (n_pipes,)
+        self.pipe_to = pipe_to  # int32 (n_pipes,)
+        self.node_distance = node_distance  # float64 (n_nodes,) -> distância até a fonte mais próxima
+        self.node_state = node_state  # int8 (n_nodes,) -> situação do registro do nó ou NO_STATE
+        self.out_ptr, self.out_idx = self.__adjacency(pipe_from)
+        self.in_ptr, self.in_idx = self.__adjacency(pipe_to)
+        self._lists = None
+
+    def __adjacency(self, pipe_end):
+        topology = self.topology
+        node = np.repeat(np.arange(topology.n_nodes), np.diff(topology.node_pipe_ptr))
+        pipe = topology.node_pipe_idx
+        ends_here = (topology.pipe_nodes[pipe, 0] == node) | (topology.pipe_nodes[pipe, 1] == node)
+        keep = (pipe_end[pipe] == node) | (pipe_end[pipe] < 0) | ~ends_here
+        counts = np.bincount(node[keep], minlength=topology.n_nodes)
+        return np.concatenate([[0], np.cumsum(counts)]).astype(np.int32), pipe[keep].astype(np.int32)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_lists'] = None
+        return state
+
+    @property
+    def n_unoriented(self):
+        """Redes existentes sem sentido definido"""
+        return int(((self.pipe_from < 0) & (self.topology.pipe_nodes[:, 0] >= 0)).sum())
+
+    def lists(self):
+        """Listas Python usadas no percurso (criadas uma vez)"""
+        if self._lists is None:
+            pipe_nodes = self.topology.pipe_nodes.tolist()
+            pipe_from = self.pipe_from.tolist()
+            pipe_to = self.pipe_to.tolist()
+            # Nós por onde o percurso sai de cada rede: o de jusante (ou montante); os dois sem sentido
+            exits_down = [(to,) if to >= 0 else tuple(nodes) for to, nodes in zip(pipe_to, pipe_nodes)]
+            exits_up = [(fr,) if fr >= 0 else tuple(nodes) for fr, nodes in zip(pipe_from, pipe_nodes)]
+            self._lists = {DOWNSTREAM: (exits_down, _csr_lists(self.out_ptr, self.out_idx)),
+                           UPSTREAM: (exits_up, _csr_lists(self.in_ptr, self.in_idx)),
+                           'nodes': (self.topology.pipe_ids.tolist(), self.topology.node_valve.tolist(),
+                                     self.node_state.tolist())}
+        return self._lists
+
+
+def _csr_lists(ptr, idx):
+    ptr = ptr.tolist()
+    idx = idx.tolist()
+    return [idx[ptr[node]:ptr[node + 1]] for node in range(len(ptr) - 1)]
+
+
+def orient_network(topology, sources, valve_state, diameter, lengths=None, is_canceled=None):
+    """
+    :param sources: índices dos nós de abastecimento (source_nodes)
+    :param valve_state: função id do registro -> VALVE_OPEN | VALVE_CLOSED | VALVE_NOT_VISIBLE
+    :param diameter: função índice da rede -> diâmetro nominal (None/NaN quando desconhecido)
+    :param lengths: comprimento de cada rede (n_pipes,); None = distância entre as extremidades
+    :return: FlowDirection ou None se cancelado
+    """
+    pipe_nodes = topology.pipe_nodes
+    _, pipe_nodes_list, node_pipes, node_valve = topology.lists()
+
+    # Situação dos registros e diâmetros lidos uma única vez
+    node_state = np.full(topology.n_nodes, NO_STATE, dtype=np.int8)
+    for node in np.nonzero(topology.node_valve != NO_VALVE)[0].tolist():
+        node_state[node] = valve_state(node_valve[node])
+    diameters = [_diameter(diameter(pipe)) for pipe in range(topology.n_pipes)]
+    if lengths is None:
+        alive = pipe_nodes[:, 0] >= 0
+        lengths = np.zeros(topology.n_pipes)
+        delta = topology.node_xy[pipe_nodes[alive, 1]] - topology.node_xy[pipe_nodes[alive, 0]]
+        lengths[alive] = np.hypot(delta[:, 0], delta[:, 1])
+    lengths = np.asarray(lengths, dtype=np.float64).tolist()
+
+    # Dijkstra a partir de todas as fontes; em empate chega primeiro quem vem pela rede de maior diâmetro
+    distance = [math.inf] * topology.n_nodes
+    arrival = [math.inf] * topology.n_nodes  # diâmetro (negativo) da rede por onde o nó foi alcançado
+    sources = set(int(node) for node in sources)
+    heap = []
+    for node in sources:
+        distance[node] = 0.0
+        arrival[node] = -math.inf
+        heap.append((0.0, -math.inf, node))
+    heapq.heapify(heap)
+    closed = set(np.nonzero(node_state == VALVE_CLOSED)[0].tolist()) - sources
+
+    settled = 0
+    while heap:
+        d, rank, node = heapq.heappop(heap)
+        if d > distance[node] or rank > arrival[node]:
+            continue
+        settled += 1
+        if is_canceled is not None and settled % 10000 == 0 and is_canceled():
+            return None
+        if node in closed:
+            continue  # a água chega ao registro fechado, mas não passa
+        for pipe in node_pipes[node]:
+            step = d + lengths[pipe]
+            step_rank = -diameters[pipe]
+            for other in pipe_nodes_list[pipe]:
+                if other == node or other < 0:
+                    continue
+                if step < distance[other] or (step == distance[other] and step_rank < arrival[other]):
+                    distance[other] = step
+                    arrival[other] = step_rank
+                    heapq.heappush(heap, (step, step_rank, other))
+
+    # Montante: o lado que pode abastecer a rede (registros fechados não abastecem)
+    supply = np.array(distance, dtype=np.float64)
+    supply[list(closed)] = np.inf
+    rank = np.array(arrival, dtype=np.float64)
+    a, b = pipe_nodes[:, 0], pipe_nodes[:, 1]
+    alive = (a >= 0) & (a != b)
+    da, db = np.where(alive, supply[np.maximum(a, 0)], np.inf), np.where(alive, supply[np.maximum(b, 0)], np.inf)
+    ra, rb = rank[np.maximum(a, 0)], rank[np.maximum(b, 0)]
+    forward = (da < db) | ((da == db) & np.isfinite(da) & (ra < rb))
+    backward = (db < da) | ((da == db) & np.isfinite(db) & (rb < ra))
+
+    pipe_from = np.full(topology.n_pipes, -1, dtype=np.int32)
+    pipe_to = np.full(topology.n_pipes, -1, dtype=np.int32)
+    pipe_from[forward], pipe_to[forward] = a[forward], b[forward]
+    pipe_from[backward], pipe_to[backward] = b[backward], a[backward]
+    return FlowDirection(topology, pipe_from, pipe_to, np.array(distance, dtype=np.float64), node_state)
+
+
+def _diameter(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 0.0
+    return float(value)
+
+
+def trace_directed(flow, seed_index, mode=BOTH, is_canceled=None):
+    """
+    Tracing a montante, a jusante ou nos dois sentidos a partir da rede seed_index. As regras dos registros
+    são as do tracing normal (registro aberto e visível ou já fechado interrompe o percurso no nó).
+    :return: TraceResult (não reversível) ou None se cancelado
+    """
+    if mode == BOTH:
+        down = _trace_directed(flow, seed_index, DOWNSTREAM, is_canceled)
+        up = _trace_directed(flow, seed_index, UPSTREAM, is_canceled) if down is not None else None
+        if up is None:
+            return None
+        return _union(down, up)
+    if mode not in (UPSTREAM, DOWNSTREAM):
+        raise ValueError(f'Modo de tracing desconhecido: {mode}')
+    return _trace_directed(flow, seed_index, mode, is_canceled)
+
+
+def trace_directed_many(flow, seed_indices, mode=BOTH, is_canceled=None):
+    """:return: dicionário índice da semente -> TraceResult ou None se cancelado"""
+    results = {}
+    for seed in seed_indices:
+        result = trace_directed(flow, seed, mode, is_canceled)
+        if result is None:
+            return None
+        results[seed] = result
+    return results
+
+
+def _trace_directed(flow, seed_index, mode, is_canceled):
+    exits, next_pipes = flow.lists()[mode]
+    pipe_ids, node_valve, node_state = flow.lists()['nodes']
+    result = TraceResult()
+    result.reversible = False
+    visited = {seed_index}
+    reached = [seed_index]
+    frontier = [seed_index]
+
+    while frontier:
+        if is_canceled is not None and is_canceled():
+            return None
+
+        result.layers += 1
+        if len(frontier) > result.max_frontier:
+            result.max_frontier = len(frontier)
+        next_frontier = []
+        for pipe in frontier:
+            result.iterations += 1
+            for node in exits[pipe]:
+                state = node_state[node]
+                if state == VALVE_OPEN:
+                    result.valves.add(node_valve[node])
+                    continue
+                elif state == VALVE_CLOSED:
+                    result.valves_closed.add(node_valve[node])
+                    continue
+                elif state == VALVE_NOT_VISIBLE:
+                    result.valves_not_visible.add(node_valve[node])
+
+                for neighbor in next_pipes[node]:
+                    if neighbor not in visited:
+                        visited.add(neighbor)
+                        next_frontier.append(neighbor)
+                        reached.append(neighbor)
+        frontier = next_frontier
+
+    result.pipe_indices = reached
+    result.pipelines = {pipe_ids[i] for i in reached}
+    return result
+
+
+def _union(first, second):
+    result = TraceResult()
+    result.reversible = False
+    result.pipe_indices = list(dict.fromkeys(first.pipe_indices + second.pipe_indices))
+    result.pipelines = first.pipelines | second.pipelines
+    result.valves = first.valves | second.valves
+    result.valves_closed = first.valves_closed | second.valves_closed
+    result.valves_not_visible = first.valves_not_visible | second.valves_not_visible
+    result.iterations = first.iterations + second.iterations
+    result.layers = max(first.layers, second.layers)
+    result.max_frontier = max(first.max_frontier, second.max_frontier)
+    return result
@@ -0,0 +1,189 @@
+"""
+Cálculos geométricos vetorizados (numpy) sobre coordenadas simples, sem objetos do QGIS.
+Linhas são arrays (n, 2) de vértices e pontos são arrays (m, 2).
+"""
+import numpy as np
+
+# Quantidade máxima de pares ponto x segmento calculados de uma vez
+CHUNK_PAIRS = 4000000
+
+
+def closest_on_polyline(points, line):
+    """
+    Distância de cada ponto até a linha, o ponto mais próximo sobre a linha e o índice do segmento.
+    :return: (distances (m,), closest (m, 2), segments (m,))
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    line = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+    if len(line) == 1:
+        line = np.vstack([line, line])
+
+    start = line[:-1]
+    direction = line[1:] - start
+    length2 = np.einsum('ij,ij->i', direction, direction)
+    length2[length2 == 0] = 1.0
+
+    distances = np.empty(len(points))
+    closest = np.empty((len(points), 2))
+    segments = np.empty(len(points), dtype=np.int64)
+
+    step = max(CHUNK_PAIRS // len(start), 1)
+    for begin in range(0, len(points), step):
+        chunk = points[begin:begin + step]
+        relative = chunk[:, None, :] - start[None, :, :]
+        t = np.clip(np.einsum('mkj,kj->mk', relative, direction) / length2, 0.0, 1.0)
+        projection = start[None, :, :] + t[:, :, None] * direction[None, :, :]
+        d2 = ((chunk[:, None, :] - projection) ** 2).sum(axis=2)
+
+        best = d2.argmin(axis=1)
+        rows = np.arange(len(chunk))
+        distances[begin:begin + step] = np.sqrt(d2[rows, best])
+        closest[begin:begin + step] = projection[rows, best]
+        segments[begin:begin + step] = best
+    return distances, closest, segments
+
+
+def locate_on_polyline(line, point):
+    """
+    Posição do ponto mais próximo sobre a linha, medida a partir do primeiro vértice.
+    :return: (distância do ponto até a linha, distância ao longo da linha, comprimento da linha)
+    """
+    line = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+    distances, closest, segments = closest_on_polyline(point, line)
+    lengths = np.hypot(*(line[1:] - line[:-1]).T) if len(line) > 1 else np.zeros(1)
+    segment = int(segments[0])
+    along = lengths[:segment].sum() + np.hypot(*(closest[0] - line[segment]))
+    return float(distances[0]), float(along), float(lengths.sum())
+
+
+def locate_on_parts(parts, point):
+    """
+    locate_on_polyline para uma linha em várias partes (MultiLineString): o ponto é localizado na parte mais
+    próxima e as partes são medidas uma após a outra, sem contar o espaço entre elas.
+    :return: (distância do ponto até a linha, distância ao longo da linha, comprimento da linha)
+    """
+    located = [locate_on_polyline(part, point) for part in parts]
+    nearest = min(range(len(located)), key=lambda i: located[i][0])
+    before = sum(length for _, _, length in located[:nearest])
+    return located[nearest][0], before + located[nearest][1], sum(length for _, _, length in located)
+
+
+def points_near_polyline(points, line, max_distance):
+    """Máscara dos pontos a até max_distance da linha"""
+    if len(points) == 0:
+        return np.zeros(0, dtype=bool)
+    distances, _, _ = closest_on_polyline(points, line)
+    return distances <= max_distance
+
+
+class SegmentGrid:
+    """
+    Grade regular sobre segmentos de linha para buscar, de uma vez para muitos pontos, o segmento mais próximo
+    até max_distance. Cada segmento é registrado em todas as células que o seu retângulo envolvente
+    (aumentado de max_distance) cobre, então basta olhar a célula do ponto.
+    A célula tem lado max_distance; com segmentos muito maiores que max_distance, cell_size maior
+    (ex.: o comprimento típico dos segmentos) evita registrar cada segmento em centenas de células.
+    Pode ser enviada para outros processos (pickle) com os arrays.
+    """
+
+    def __init__(self, starts, ends, owners, max_distance, cell_size=None):
+        self.starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        self.ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        self.owners = np.asarray(owners, dtype=np.int64)  # id da feição dona de cada segmento
+        self.max_distance = float(max_distance)
+        self.cell = float(cell_size or self.max_distance) or 1.0
+
+        low = np.minimum(self.starts, self.ends) - self.max_distance
+        high = np.maximum(self.starts, self.ends) + self.max_distance
+        c0 = np.floor(low / self.cell).astype(np.int64)
+        c1 = np.floor(high / self.cell).astype(np.int64)
+        self.origin = c0.min(axis=0) if len(c0) else np.zeros(2, dtype=np.int64)
+        self.width = int((c1[:, 1].max() - self.origin[1] + 1)) if len(c1) else 1
+
+        nx = c1[:, 0] - c0[:, 0] + 1
+        ny = c1[:, 1] - c0[:, 1] + 1
+        counts = nx * ny
+        segment = np.repeat(np.arange(len(counts)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = c0[segment, 0] + local // ny[segment]
+        cy = c0[segment, 1] + local % ny[segment]
+
+        keys = self.__keys(cx, cy)
+        order = np.argsort(keys, kind='stable')
+        self.cell_keys, self.cell_start = np.unique(keys[order], return_index=True)
+        self.cell_end = np.append(self.cell_start[1:], len(order))
+        self.cell_segments = segment[order]
+
+    def __keys(self, cx, cy):
+        return (cx - self.origin[0]) * self.width + (cy - self.origin[1])
+
+    def candidates(self, points):
+        """
+        Pares (ponto, segmento) das células dos pontos, com a distância ao quadrado e o ponto mais próximo
+        sobre o segmento. Inclui todos os segmentos das células (filtre por max_distance ** 2 se necessário).
+        :return: (índice do ponto (k,), índice do segmento (k,), distância ao quadrado (k,), projeção (k, 2))
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        m = len(points)
+        if m == 0 or len(self.cell_keys) == 0:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros((0, 2)))
+
+        cells = np.floor(points / self.cell).astype(np.int64)
+        keys = self.__keys(cells[:, 0], cells[:, 1])
+        position = np.clip(np.searchsorted(self.cell_keys, keys), 0, len(self.cell_keys) - 1)
+        row = cells[:, 1] - self.origin[1]
+        found = (self.cell_keys[position] == keys) & (row >= 0) & (row < self.width) & (cells[:, 0] >= self.origin[0])
+        start = np.where(found, self.cell_start[position], 0)
+        counts = np.where(found, self.cell_end[position] - self.cell_start[position], 0)
+
+        # Pares (ponto, segmento candidato)
+        point = np.repeat(np.arange(m), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        segment = self.cell_segments[np.repeat(start, counts) + offset]
+
+        a = self.starts[segment]
+        direction = self.ends[segment] - a
+        length2 = np.einsum('ij,ij->i', direction, direction)
+        length2[length2 == 0] = 1.0
+        t = np.clip(np.einsum('ij,ij->i', points[point] - a, direction) / length2, 0.0, 1.0)
+        projection = a + t[:, None] * direction
+        d2 = ((points[point] - projection) ** 2).sum(axis=1)
+        return point, segment, d2, projection
+
+    def nearest(self, points):
+        """
+        Segmento mais próximo de cada ponto, até max_distance.
+        :return: (owners (m,) com -1 quando não há segmento, distâncias (m,), pontos mais próximos (m, 2))
+        """
+        m = len(np.asarray(points).reshape(-1, 2))
+        owners = np.full(m, -1, dtype=np.int64)
+        distances = np.full(m, np.inf)
+        closest = np.full((m, 2), np.nan)
+        point, segment, d2, projection = self.candidates(points)
+        if len(point) == 0:
+            return owners, distances, closest
+
+        # Menor distância de cada ponto: ordena por (ponto, distância) e pega o primeiro de cada ponto
+        order = np.lexsort((d2, point))
+        first = order[np.r_[True, point[order][1:] != point[order][:-1]]]
+        within = d2[first] <= self.max_distance ** 2
+        first = first[within]
+        rows = point[first]
+
+        owners[rows] = self.owners[segment[first]]
+        distances[rows] = np.sqrt(d2[first])
+        closest[rows] = projection[first]
+        return owners, distances, closest
+
+
+# Grade usada pelos processos filhos (ver init_grid_worker)
+_worker_grid = None
+
+
+def init_grid_worker(grid):
+    global _worker_grid
+    _worker_grid = grid
+
+
+def nearest_in_worker(points):
+    return _worker_grid.nearest(points)
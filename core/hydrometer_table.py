@@ -0,0 +1,190 @@
+"""
+Tabela rede -> hidrômetros: cada hidrômetro é ligado somente à rede mais próxima (SegmentGrid), até
+max_distance. Os clientes afetados por um tracing são a união das listas das redes alcançadas.
+
+A tabela é montada em segundo plano (BuildHydrometerTable), fica em cache enquanto as camadas não
+mudam e é gravada ao lado do projeto, como a cópia da rede (network_snapshot), para as próximas sessões.
+"""
+import csv
+
+import numpy as np
+
+from qgis.core import Qgis, QgsMessageLog, QgsTask
+
+from core.feature_stream import DEFAULT_CHUNK_SIZE, iter_features
+from core.find_points import HD_MAX_DISTANCE
+from core.geometry_kernels import SegmentGrid
+from core.layer_cache import GEOMETRY_SIGNALS, LayerCache
+from core.network_snapshot import layer_fingerprint, load_arrays, project_directory, save_arrays
+from core.network_topology import pipeline_segments, point_chunks
+
+# Muda quando o formato dos arquivos muda (tabelas antigas são refeitas)
+TABLE_VERSION = 1
+
+_TABLE_ARRAYS = ('pipes', 'pipe_ptr', 'hydrometers')
+
+_table_cache = LayerCache(signals=GEOMETRY_SIGNALS)
+
+
+class HydrometerTable:
+    """
+    Hidrômetros de cada rede em formato CSR: pipes (ids das redes, ordenados), pipe_ptr e hydrometers
+    (ids dos hidrômetros da rede pipes[i] em hydrometers[pipe_ptr[i]:pipe_ptr[i + 1]])
+    """
+
+    def __init__(self, pipes, pipe_ptr, hydrometers):
+        self.pipes = pipes
+        self.pipe_ptr = pipe_ptr
+        self.hydrometers = hydrometers
+
+    @classmethod
+    def from_pairs(cls, hydrometer_ids, pipe_ids):
+        """Tabela a partir da rede mais próxima de cada hidrômetro (-1 = nenhuma rede)"""
+        hydrometer_ids = np.asarray(hydrometer_ids, dtype=np.int64)
+        pipe_ids = np.asarray(pipe_ids, dtype=np.int64)
+        linked = pipe_ids >= 0
+        order = np.lexsort((hydrometer_ids[linked], pipe_ids[linked]))
+        pipe_ids = pipe_ids[linked][order]
+        pipes, starts = np.unique(pipe_ids, return_index=True)
+        return cls(pipes, np.append(starts, len(pipe_ids)).astype(np.int64), hydrometer_ids[linked][order])
+
+    def __len__(self):
+        return len(self.hydrometers)
+
+    def __positions(self, pipe_ids):
+        pipe_ids = np.fromiter(pipe_ids, dtype=np.int64)
+        if len(self.pipes) == 0 or len(pipe_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        positions = np.clip(np.searchsorted(self.pipes, pipe_ids), 0, len(self.pipes) - 1)
+        return positions[self.pipes[positions] == pipe_ids]
+
+    def hydrometers_of(self, pipe_ids):
+        """Ids dos hidrômetros ligados às redes (ids das feições)"""
+        positions = self.__positions(pipe_ids)
+        if len(positions) == 0:
+            return set()
+        return set(np.concatenate([self.hydrometers[self.pipe_ptr[p]:self.pipe_ptr[p + 1]]
+                                   for p in positions.tolist()]).tolist())
+
+    def count(self, pipe_ids):
+        """Quantidade de hidrômetros ligados às redes (cada hidrômetro está em uma única rede)"""
+        positions = self.__positions(pipe_ids)
+        return int((self.pipe_ptr[positions + 1] - self.pipe_ptr[positions]).sum())
+
+    def counts(self, topology):
+        """Hidrômetros de cada rede na ordem da topologia (n_pipes,)"""
+        counts = np.zeros(topology.n_pipes, dtype=np.int64)
+        alive = np.nonzero(topology.pipe_nodes[:, 0] >= 0)[0]
+        positions = self.__positions(topology.pipe_ids[alive].tolist())
+        found = np.isin(topology.pipe_ids[alive], self.pipes)
+        counts[alive[found]] = self.pipe_ptr[positions + 1] - self.pipe_ptr[positions]
+        return counts
+
+
+def build_hydrometer_table(pipelines, hydrometers, max_distance=HD_MAX_DISTANCE, is_canceled=None):
+    """
+    Liga cada hidrômetro à rede mais próxima até max_distance (camadas ou qualquer QgsFeatureSource)
+    :return: HydrometerTable ou None se cancelado
+    """
+    starts, ends, owners = pipeline_segments(pipelines)
+    grid = SegmentGrid(starts, ends, owners, max_distance)
+    hydrometer_ids, pipe_ids = [], []
+    for ids, points in point_chunks(hydrometers):
+        if is_canceled is not None and is_canceled():
+            return None
+        hydrometer_ids.append(ids)
+        pipe_ids.append(grid.nearest(points)[0])
+    if not hydrometer_ids:
+        return HydrometerTable.from_pairs([], [])
+    return HydrometerTable.from_pairs(np.concatenate(hydrometer_ids), np.concatenate(pipe_ids))
+
+
+def _manifest(pipelines, hydrometers, max_distance):
+    pipelines_fingerprint = layer_fingerprint(pipelines)
+    hydrometers_fingerprint = layer_fingerprint(hydrometers)
+    if pipelines_fingerprint is None or hydrometers_fingerprint is None:
+        return None
+    return {'version': TABLE_VERSION,
+            'max_distance': max_distance,
+            'pipelines': pipelines_fingerprint,
+            'hydrometers': hydrometers_fingerprint}
+
+
+def cached_hydrometer_table(pipelines, hydrometers, max_distance=HD_MAX_DISTANCE):
+    """Tabela já carregada para as camadas ou None"""
+    return _table_cache.peek([pipelines, hydrometers], max_distance)
+
+
+def watch_hydrometer_table(pipelines, hydrometers):
+    """Liga os sinais de edição das camadas à tabela em cache (na thread principal)"""
+    _table_cache.watch([pipelines, hydrometers])
+
+
+def get_hydrometer_table(pipelines, hydrometers, max_distance=HD_MAX_DISTANCE, is_canceled=None):
+    """Tabela em cache, lida do disco (camadas sem alterações) ou montada agora e gravada (None se cancelado)"""
+    def factory():
+        manifest = _manifest(pipelines, hydrometers, max_distance)
+        directory = project_directory('hydrometers', pipelines.id(), hydrometers.id(), max_distance)
+        if manifest is not None:
+            arrays = load_arrays(directory, manifest, _TABLE_ARRAYS)
+            if arrays is not None:
+                return HydrometerTable(**arrays)
+
+        table = build_hydrometer_table(pipelines, hydrometers, max_distance, is_canceled)
+        if table is not None and manifest is not None:
+            save_arrays(directory, manifest, {name: getattr(table, name) for name in _TABLE_ARRAYS})
+        return table
+
+    return _table_cache.get([pipelines, hydrometers], max_distance, factory)
+
+
+def export_hydrometers(hydrometers, fids, path, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Lista de clientes (CSV) com os campos informados dos hidrômetros, lida em blocos sem geometria
+    :return: quantidade de linhas gravadas
+    """
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(['fid'] + list(fields))
+        for feature in iter_features(hydrometers, fids=sorted(fids), fields=fields, geometry=False,
+                                     chunk_size=chunk_size):
+            writer.writerow([feature.id()] + [feature[field] for field in fields])
+            count += 1
+    return count
+
+
+class BuildHydrometerTable(QgsTask):
+    """Monta (ou lê do disco) a tabela rede -> hidrômetros em segundo plano"""
+
+    def __init__(self, pipelines, hydrometers, description='HydrometerTableCAJ', max_distance=HD_MAX_DISTANCE):
+        super().__init__(description, QgsTask.CanCancel)
+        self.__pipelines = pipelines
+        self.__hydrometers = hydrometers
+        self.__max_distance = max_distance
+        self.__exception = None
+        self.table = None
+
+    def run(self):
+        QgsMessageLog.logMessage(f'Started task {self.description()}', 'TracingCAJ', Qgis.Info)
+        try:
+            self.table = get_hydrometer_table(self.__pipelines, self.__hydrometers, self.__max_distance,
+                                              is_canceled=self.isCanceled)
+        except Exception as e:
+            self.__exception = e
+            return False
+        return self.table is not None
+
+    def finished(self, result):
+        if result:
+            QgsMessageLog.logMessage(f"Task {self.description()} has been executed correctly\n"
+                                     f"Hidrômetros ligados: {len(self.table)}",
+                                     'TracingCAJ', level=Qgis.Success)
+        elif self.__exception is None:
+            QgsMessageLog.logMessage(f"Task {self.description()} not successful "
+                                     f"(probably the task was manually canceled by the user)",
+                                     'TracingCAJ', level=Qgis.Warning)
+        else:
+            QgsMessageLog.logMessage(f"Task {self.description()}"
+                                     f"Exception: {self.__exception}", 'TracingCAJ', level=Qgis.Critical)
+            raise self.__exception
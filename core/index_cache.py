@@ -0,0 +1,149 @@
+import threading
+
+from qgis.core import QgsFeature, QgsFeatureRequest, QgsGeometry, QgsSpatialIndex
+
+from core.layer_cache import ROLLBACK_SIGNALS, LayerCache
+
+# Limite de feições somadas entre todos os índices guardados
+MAX_INDEXED_FEATURES = 5000000
+
+# Acima desta quantidade de feições editadas o índice é refeito a partir da camada
+MAX_EDITED_FEATURES = 1000
+
+_index_cache = LayerCache(signals=ROLLBACK_SIGNALS, max_cost=MAX_INDEXED_FEATURES)
+_watched = set()
+_temporary_fids = {}
+
+# Edições desde a montagem do índice: id da camada -> {fid: QgsGeometry ou None (removida)} e versão
+_edits = {}
+_versions = {}
+_lock = threading.Lock()
+
+
+class EditedIndex:
+    """
+    Índice da camada com as edições: o índice montado nunca é alterado (tarefas podem estar consultando),
+    as feições editadas saem dele e ficam em um índice pequeno. Cada lote de edições gera um novo EditedIndex.
+    Mesma interface de consulta do QgsSpatialIndex usada pelo plugin.
+    """
+
+    def __init__(self, base, geometries, version):
+        self.base = base
+        self.version = version
+        self.__hidden = frozenset(geometries)  # todas as feições editadas, inclusive as removidas
+        self.__geometries = {fid: geometry for fid, geometry in geometries.items() if geometry is not None}
+        self.__overlay = QgsSpatialIndex(flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
+        for fid, geometry in self.__geometries.items():
+            feature = QgsFeature(fid)
+            feature.setGeometry(geometry)
+            self.__overlay.addFeature(feature)
+
+    def intersects(self, rectangle):
+        return ([fid for fid in self.base.intersects(rectangle) if fid not in self.__hidden]
+                + self.__overlay.intersects(rectangle))
+
+    def geometry(self, fid):
+        if fid in self.__hidden:
+            return QgsGeometry(self.__geometries.get(fid, QgsGeometry()))
+        return self.base.geometry(fid)
+
+    def nearestNeighbor(self, point, neighbors=1, maxDistance=0):
+        # Mais vizinhos do índice montado enquanto houver feições editadas entre eles
+        count = neighbors
+        while True:
+            found = self.base.nearestNeighbor(point, count, maxDistance)
+            fids = [fid for fid in found if fid not in self.__hidden]
+            if len(fids) >= neighbors or len(found) < count:
+                break
+            count += len(found) - len(fids)
+
+        fids += self.__overlay.nearestNeighbor(point, neighbors, maxDistance)
+        if len(fids) <= neighbors:
+            return fids
+        target = QgsGeometry.fromPointXY(point)
+        distances = {fid: self.geometry(fid).distance(target) for fid in fids}
+        fids.sort(key=distances.get)
+        limit = distances[fids[neighbors - 1]]
+        return [fid for fid in fids if distances[fid] <= limit]
+
+
+def get_spatial_index(layer, feedback=None):
+    """
+    Índice espacial (com geometrias) da camada, compartilhado entre todas as tarefas.
+    As edições na camada entram em um novo EditedIndex; só é refeito quando a edição é desfeita
+    ou quando há muitas feições editadas.
+    :param feedback: QgsFeedback opcional; se cancelado o índice incompleto não é guardado e retorna None
+    """
+    def factory():
+        index = QgsSpatialIndex(layer.getFeatures(QgsFeatureRequest().setNoAttributes()), feedback,
+                                flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
+        return None if feedback is not None and feedback.isCanceled() else index
+
+    watch_spatial_index(layer)
+    index = _index_cache.get([layer], 'spatial_index', factory, cost=max(layer.featureCount(), 1))
+    if index is None:
+        return None
+
+    with _lock:
+        version = _versions.get(layer.id(), 0)
+        if version == getattr(index, 'version', 0):
+            return index
+        geometries = dict(_edits[layer.id()])
+    edited = EditedIndex(getattr(index, 'base', index), geometries, version)
+    _index_cache.put([layer], 'spatial_index', edited)
+    return edited
+
+
+def clear_spatial_indexes():
+    _index_cache.clear()
+
+
+def watch_spatial_index(layer):
+    """Liga os sinais de edição da camada ao índice (na thread principal, antes de agendar as tarefas)"""
+    if layer.id() in _watched:
+        return
+    _watched.add(layer.id())
+    _temporary_fids[layer.id()] = set()
+    _edits[layer.id()] = {}
+
+    layer.featureAdded.connect(lambda fid: _add_feature(layer, fid))
+    layer.featureDeleted.connect(lambda fid: _record(layer, fid, None))
+    layer.geometryChanged.connect(lambda fid, geometry: _record(layer, fid, QgsGeometry(geometry)))
+    layer.committedFeaturesAdded.connect(lambda layer_id, features: _commit_features(layer, features))
+    layer.afterRollBack.connect(lambda: _clear_edits(layer))
+    layer.willBeDeleted.connect(lambda: _watched.discard(layer.id()))
+
+
+def _record(layer, fid, geometry):
+    """Guarda a edição; o índice em uso não é alterado (o próximo get_spatial_index gera um EditedIndex)"""
+    with _lock:
+        edits = _edits[layer.id()]
+        edits[fid] = geometry
+        _versions[layer.id()] = _versions.get(layer.id(), 0) + 1
+        too_many = len(edits) > MAX_EDITED_FEATURES
+    if too_many:
+        _index_cache.invalidate(layer.id())
+        _clear_edits(layer)
+
+
+def _clear_edits(layer):
+    with _lock:
+        _edits[layer.id()] = {}
+        _versions[layer.id()] = _versions.get(layer.id(), 0) + 1
+
+
+def _add_feature(layer, fid):
+    feature = layer.getFeature(fid)
+    _record(layer, fid, QgsGeometry(feature.geometry()) if feature.isValid() and feature.hasGeometry() else None)
+    if fid < 0:
+        _temporary_fids[layer.id()].add(fid)
+
+
+def _commit_features(layer, features):
+    # Ao salvar, as feições novas trocam o id temporário (negativo) pelo id definitivo
+    for fid in _temporary_fids[layer.id()]:
+        _record(layer, fid, None)
+    _temporary_fids[layer.id()].clear()
+
+    for feature in features:
+        _record(layer, feature.id(), QgsGeometry(feature.geometry()) if feature.hasGeometry() else None)
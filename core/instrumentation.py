@@ -0,0 +1,75 @@
+"""
+Instrumentação leve das tarefas: contadores, máximos e tempo por fase, resumidos uma única vez no fim.
+As mensagens de log abaixo do nível configurado não são nem formatadas (use uma função/lambda como mensagem).
+"""
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+DEBUG = 0
+INFO = 1
+WARNING = 2
+CRITICAL = 3
+
+# Nível padrão das tarefas; DEBUG volta a registrar os detalhes de cada etapa
+LOG_LEVEL = INFO
+
+_QGIS_LEVELS = {DEBUG: 'Info', INFO: 'Info', WARNING: 'Warning', CRITICAL: 'Critical'}
+
+
+class Instrumentation:
+
+    def __init__(self, name, level=None, tag='TracingCAJ'):
+        self.name = name
+        self.level = LOG_LEVEL if level is None else level
+        self.tag = tag
+        self.counters = Counter()
+        self.maxima = {}
+        self.timings = {}
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message):
+        """
+        :param message: texto ou função sem argumentos que retorna o texto (só é chamada se o nível estiver ativo)
+        """
+        if level < self.level:
+            return
+        if callable(message):
+            message = message()
+        from qgis.core import Qgis, QgsMessageLog
+        QgsMessageLog.logMessage(message, self.tag, getattr(Qgis, _QGIS_LEVELS[level]))
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def maximum(self, name, value):
+        if value > self.maxima.get(name, value - 1):
+            self.maxima[name] = value
+
+    @contextmanager
+    def phase(self, name):
+        """Soma o tempo (segundos) gasto dentro do bloco na fase 'name'"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def to_dict(self):
+        return {'task': self.name,
+                'counters': dict(self.counters),
+                'maxima': dict(self.maxima),
+                'timings': {name: round(seconds, 6) for name, seconds in self.timings.items()}}
+
+    def summary(self):
+        parts = [f'{name}={value}' for name, value in sorted(self.counters.items())]
+        parts += [f'max_{name}={value}' for name, value in sorted(self.maxima.items())]
+        parts += [f'{name}={seconds * 1000:.1f}ms' for name, seconds in self.timings.items()]
+        return f"{self.name}: {' '.join(parts)}"
+
+    def export_json(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, indent=2)
@@ -0,0 +1,120 @@
+import numpy as np
+
+from qgis.core import QgsTask, QgsMessageLog, Qgis
+
+from core.flow_direction import orient_network, source_nodes
+from core.layer_cache import ATTRIBUTE_SIGNALS, GEOMETRY_SIGNALS, ROLLBACK_SIGNALS, LayerCache
+from core.network_topology import get_lookups, get_topology, pipe_lengths, point_chunks
+from core.tracing_engine import build_segments
+from core.valve_failure import ValveFailureAnalysis
+
+# Edições nas camadas são aplicadas aos segmentos pelo NetworkUpdater
+_segments_cache = LayerCache(signals=ROLLBACK_SIGNALS)
+
+# As zonas guardadas pela análise de falhas não são atualizadas: qualquer edição descarta a análise
+_failure_cache = LayerCache(signals=GEOMETRY_SIGNALS + ATTRIBUTE_SIGNALS)
+
+# O sentido do escoamento depende da rede inteira: qualquer edição (também nas fontes) descarta a orientação
+_flow_cache = LayerCache(signals=GEOMETRY_SIGNALS + ATTRIBUTE_SIGNALS)
+
+
+def cached_isolation_segments(pipelines, valves, user_distance=0.001):
+    """Segmentos já calculados para as camadas ou None"""
+    return _segments_cache.peek([pipelines, valves], user_distance)
+
+
+def watch_isolation_segments(pipelines, valves, sources=None):
+    """Liga os sinais de edição aos segmentos, à análise de falhas e ao sentido do escoamento (na thread principal)"""
+    _segments_cache.watch([pipelines, valves])
+    _failure_cache.watch([pipelines, valves])
+    if sources is not None:
+        _flow_cache.watch([pipelines, valves, sources])
+
+
+def get_isolation_segments(pipelines, valves, user_distance=0.001, is_canceled=None, progress=None):
+    """Segmentos em cache ou calculados agora (None se cancelado)"""
+    def factory():
+        topology = get_topology(pipelines, valves, user_distance)
+        valve_state, diameter = get_lookups(pipelines, valves, topology)
+        return build_segments(topology, valve_state, diameter, is_canceled=is_canceled, progress=progress)
+
+    return _segments_cache.get([pipelines, valves], user_distance, factory)
+
+
+def put_isolation_segments(pipelines, valves, user_distance, segments):
+    _segments_cache.put([pipelines, valves], user_distance, segments)
+
+
+def get_valve_failure_analysis(pipelines, valves, user_distance=0.001):
+    """
+    ValveFailureAnalysis das camadas (zonas dos segmentos em cache, se houver), mantida entre consultas
+    para que perguntas encadeadas reaproveitem as zonas já percorridas
+    """
+    segments = cached_isolation_segments(pipelines, valves, user_distance)
+    topology = segments.topology if segments is not None else get_topology(pipelines, valves, user_distance)
+
+    analysis = _failure_cache.peek([pipelines, valves], user_distance)
+    if analysis is None or analysis.topology is not topology or analysis.segments is not segments:
+        valve_state, diameter = get_lookups(pipelines, valves, topology)
+        analysis = ValveFailureAnalysis(topology, valve_state, diameter, segments)
+        _failure_cache.put([pipelines, valves], user_distance, analysis)
+    return analysis
+
+
+def get_flow_direction(pipelines, valves, sources, user_distance=0.001, is_canceled=None):
+    """
+    FlowDirection das camadas a partir das fontes (camada de pontos: reservatórios, bombas, VRPs),
+    calculada uma vez e mantida até a próxima edição (None se cancelado)
+    """
+    topology = get_topology(pipelines, valves, user_distance)
+    flow = _flow_cache.peek([pipelines, valves, sources], user_distance)
+    if flow is not None and flow.topology is topology:
+        return flow
+
+    valve_state, diameter = get_lookups(pipelines, valves, topology)
+    points = [xy for _, xy in point_chunks(sources)]
+    nodes = source_nodes(topology, np.vstack(points) if points else np.zeros((0, 2)))
+    flow = orient_network(topology, nodes, valve_state, diameter, lengths=pipe_lengths(pipelines, topology),
+                          is_canceled=is_canceled)
+    if flow is not None:
+        _flow_cache.put([pipelines, valves, sources], user_distance, flow)
+    return flow
+
+
+class BuildIsolationSegments(QgsTask):
+    """
+    Particiona toda a rede em segmentos de isolamento (trechos delimitados por registros operáveis)
+    em segundo plano. Depois disso o tracing de qualquer rede é uma consulta à tabela.
+    """
+
+    def __init__(self, pipelines, valves, description='IsolationSegmentsCAJ', user_distance=0.001):
+        super().__init__(description, QgsTask.CanCancel)
+        self.__pipelines = pipelines
+        self.__valves = valves
+        self.__user_distance = user_distance
+        self.__exception = None
+        self.segments = None
+
+    def run(self):
+        QgsMessageLog.logMessage(f'Started task {self.description()}', 'TracingCAJ', Qgis.Info)
+        try:
+            self.segments = get_isolation_segments(self.__pipelines, self.__valves, self.__user_distance,
+                                                   is_canceled=self.isCanceled, progress=self.setProgress)
+        except Exception as e:
+            self.__exception = e
+            return False
+        return self.segments is not None
+
+    def finished(self, result):
+        if result:
+            QgsMessageLog.logMessage(f"Task {self.description()} has been executed correctly\n"
+                                     f"Segmentos: {len(self.segments)}",
+                                     'TracingCAJ', level=Qgis.Success)
+        elif self.__exception is None:
+            QgsMessageLog.logMessage(f"Task {self.description()} not successful "
+                                     f"(probably the task was manually canceled by the user)",
+                                     'TracingCAJ', level=Qgis.Warning)
+        else:
+            QgsMessageLog.logMessage(f"Task {self.description()}"
+                                     f"Exception: {self.__exception}", 'TracingCAJ', level=Qgis.Critical)
+            raise self.__exception
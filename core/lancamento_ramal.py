@@ -1,72 +1,130 @@
+from collections import deque
+
+import numpy as np
+
 from qgis._core import QgsVectorLayer, QgsFeature, QgsGeometry
 from qgis.core import (QgsTask,
                               QgsMessageLog,
                               Qgis,
-                              QgsSpatialIndex,
                               QgsPointXY,
-                              QgsProject, QgsApplication)
+                              QgsProject)
+
+from core.feature_stream import DEFAULT_CHUNK_SIZE, WRITE_BATCH_SIZE, iter_chunks, iter_features
+from core.geometry_kernels import SegmentGrid, init_grid_worker, nearest_in_worker
+from core.network_topology import pipeline_segments
+from core.process_pool import create_process_pool
+
+
+def hydrometer_chunks(hidrometers, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Blocos de coordenadas (k, 2) dos hidrômetros, lidos sem atributos"""
+    features = iter_features(hidrometers, chunk_size=chunk_size)
+    for chunk in iter_chunks((f for f in features if f.hasGeometry()), chunk_size):
+        yield np.array([(p.x(), p.y()) for p in (f.geometry().vertexAt(0) for f in chunk)], dtype=np.float64)
+
+
+def nearest_by_chunk(grid, chunks, workers=1, is_canceled=None):
+    """(pontos, resultado de SegmentGrid.nearest) por bloco, na ordem de leitura"""
+    if workers <= 1:
+        for points in chunks:
+            yield points, grid.nearest(points)
+        return
+
+    # No máximo 2 blocos por processo em andamento, para não carregar a camada inteira na memória
+    with create_process_pool(workers, init_grid_worker, (grid,)) as pool:
+        pending = deque()
+        for points in chunks:
+            pending.append((points, pool.submit(nearest_in_worker, points)))
+            if len(pending) >= 2 * workers:
+                points, future = pending.popleft()
+                yield points, future.result()
+            if is_canceled is not None and is_canceled():
+                return
+        while pending:
+            points, future = pending.popleft()
+            yield points, future.result()
+
+
+def ramal_features(points, nearest, first_id, fields=None):
+    """
+    Ramais (linha hidrômetro -> ponto mais próximo da rede) de um bloco.
+    Atributos: id sequencial, distância e id da rede
+    """
+    owner, distance, closest = nearest
+    features = []
+    for i in np.nonzero(owner >= 0)[0].tolist():
+        feat = QgsFeature(fields) if fields is not None else QgsFeature()
+        feat.setGeometry(QgsGeometry.fromPolylineXY([QgsPointXY(*points[i]), QgsPointXY(*closest[i])]))
+        feat.setAttributes([first_id + i, float(distance[i]), int(owner[i])])
+        features.append(feat)
+    return features
 
 
 class LancamentoRamal(QgsTask):
     """
     Adiciona 'ramais' como links entre redes e hidrômetros
+    Os hidrômetros são lidos em blocos (somente geometria); para cada bloco a rede mais próxima e o ponto
+    de ligação são calculados de forma vetorizada, opcionalmente em processos paralelos, e os ramais
+    são gravados em lotes na camada 'dist'.
     """
 
-    def __init__(self, pipelines, hidrometers, description='CreateRamalCAJ', user_distance=30):
+    def __init__(self, pipelines, hidrometers, description='CreateRamalCAJ', user_distance=30, workers=1,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
         super().__init__(description, QgsTask.CanCancel)
         self.__user_distance = user_distance
+        self.__workers = workers
+        self.__chunk_size = chunk_size
+        self.__exception = None
+        self.__count = 0
 
         self.__pipelines = pipelines[0]
         self.__hidrometers = hidrometers[0]
-
-        # Cria os índices espaciais
-        self.__idx_pipelines = None
-        if self.__idx_pipelines is None:
-            self.__create_spatial_index()
+        self.dist = None
 
     def run(self):
         QgsMessageLog.logMessage(f'Started task {self.description()}',
                                  'TracingCAJ', Qgis.Info)
 
-        epsg = self.__hidrometers.crs().postgisSrid()
-        uri = "LineString?crs=epsg:" + str(epsg) + "&field=id:integer""&field=distance:double(20,2)&index=yes"
-        dist = QgsVectorLayer(uri, 'dist', 'memory')
-
-        QgsProject.instance().addMapLayer(dist)
-        prov = dist.dataProvider()
-        points_features = [point_feature for point_feature in self.__hidrometers.getFeatures()]
-
-        feats = []
-        if len(points_features) > 0:
-            for p in points_features:
-                nearest_pipe = self.find_nearest_pipelines(p.geometry())
-                try:
-                    minDistPoint = nearest_pipe.closestSegmentWithContext(p.geometry().asPoint())[1]
-                    feat = QgsFeature()
-                    feat.setGeometry(QgsGeometry.fromPolylineXY([p.geometry().asPoint(), minDistPoint]))
-                    feat.setAttributes([points_features.index(p), feat.geometry().length()])
-                    feats.append(feat)
-                except Exception as e:
-                    print(p.id())
-
-        prov.addFeatures(feats)
-
-    def find_nearest_pipelines(self, point):
-        pipelines = self.idx_pipelines.nearestNeighbor(point, 1, self.__user_distance)
-
-        if len(pipelines) > 0:
-            for pipe in pipelines:
-                return self.idx_pipelines.geometry(pipe)
+        try:
+            epsg = self.__hidrometers.crs().postgisSrid()
+            uri = ("LineString?crs=epsg:" + str(epsg) + "&field=id:integer""&field=distance:double(20,2)"
+                   "&field=pipeline:long&index=yes")
+            self.dist = QgsVectorLayer(uri, 'dist', 'memory')
+            prov = self.dist.dataProvider()
+
+            starts, ends, owners = pipeline_segments(self.__pipelines)
+            grid = SegmentGrid(starts, ends, owners, self.__user_distance)
+
+            total = max(self.__hidrometers.featureCount(), 1)
+            read = 0
+            feats = []
+            chunks = hydrometer_chunks(self.__hidrometers, self.__chunk_size)
+            for points, nearest in nearest_by_chunk(grid, chunks, self.__workers, self.isCanceled):
+                if self.isCanceled():
+                    return False
+
+                feats.extend(ramal_features(points, nearest, read))
+
+                if len(feats) >= WRITE_BATCH_SIZE:
+                    prov.addFeatures(feats)
+                    self.__count += len(feats)
+                    feats = []
+
+                read += len(points)
+                self.setProgress(100.0 * read / total)
+
+            prov.addFeatures(feats)
+            self.__count += len(feats)
+        except Exception as e:
+            self.__exception = e
+            return False
+        return True
 
     def finished(self, result):
         if result:
-            self.__hidrometers.selectByIds(self.__list_valves)
-            self.__pipelines.selectByIds(self.__list_visited_pipelines_ids)
+            QgsProject.instance().addMapLayer(self.dist)
 
-            QgsMessageLog.logMessage(f"Task {self.description()} has been executed correctly"
-                                     f"Iterations: {self.__iterations}"
-                                     f"Pipelines: {self.__list_visited_pipelines_ids}"
-                                     f"Valves: {self.__list_valves}",
+            QgsMessageLog.logMessage(f"Task {self.description()} has been executed correctly\n"
+                                     f"Ramais: {self.__count}",
                                      level=Qgis.Success)
         else:
             if self.__exception is None:
@@ -83,7 +141,3 @@ class LancamentoRamal(QgsTask):
         QgsMessageLog.logMessage(
             f'TracingTrask {self.description()} was canceled', level=Qgis.Info)
         super().cancel()
-
-    def __create_spatial_index(self):
-        self.__idx_pipelines = QgsSpatialIndex(self.__pipelines.getFeatures(),
-                                               flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Sinais de QgsVectorLayer que alteram as geometrias ou o conjunto de feições da camada
+GEOMETRY_SIGNALS = ('featureAdded',
+                    'featureDeleted',
+                    'geometryChanged',
+                    'committedFeaturesAdded',
+                    'committedFeaturesRemoved',
+                    'committedGeometriesChanges')
+
+# Para objetos atualizados incrementalmente (ver network_updater) basta descartar quando a edição é desfeita
+ROLLBACK_SIGNALS = ('afterRollBack',)
+
+# Sinais que alteram atributos (ex.: situação de registros); zonas calculadas deixam de valer
+ATTRIBUTE_SIGNALS = ('attributeValueChanged',
+                     'committedAttributeValuesChanges',
+                     'afterRollBack')
+
+# Abaixo desta quantidade de memória livre (bytes) as entradas mais antigas são descartadas
+MIN_AVAILABLE_MEMORY = 512 * 1024 * 1024
+
+
+def low_memory():
+    if psutil is None:
+        return False
+    return psutil.virtual_memory().available < MIN_AVAILABLE_MEMORY
+
+
+class LayerCache:
+    """
+    Cache de objetos calculados a partir de uma ou mais camadas (índices, topologia...).
+    Cada entrada é descartada quando uma das camadas envolvidas emite um dos sinais de edição.
+    Com max_cost definido as entradas menos usadas são descartadas quando a soma dos custos
+    passa do limite ou quando a memória livre do sistema fica baixa.
+    """
+
+    def __init__(self, signals=GEOMETRY_SIGNALS, max_cost=None):
+        self._signals = signals
+        self._max_cost = max_cost
+        self._entries = OrderedDict()
+        self._costs = {}
+        self._watched = set()
+        self._generation = {}
+        self._lock = threading.RLock()
+
+    def get(self, layers, key, factory, cost=1):
+        """
+        Retorna o objeto guardado para (camadas, key) ou cria com factory()
+        :param layers: lista de QgsVectorLayer das quais o objeto depende
+        :param key: parâmetros extras que diferenciam a entrada (ex.: user_distance)
+        :param factory: função sem argumentos que cria o objeto (None não é guardado)
+        :param cost: peso da entrada para o limite max_cost (ex.: quantidade de feições)
+        """
+        layer_ids = tuple(layer.id() for layer in layers)
+        cache_key = (layer_ids, key)
+
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return self._entries[cache_key]
+            generation = tuple(self._generation.get(layer_id, 0) for layer_id in layer_ids)
+            for layer in layers:
+                self._watch(layer)
+
+        value = factory()
+        if value is None:
+            return None
+
+        with self._lock:
+            # Se alguma camada foi editada durante a criação o objeto já nasce desatualizado
+            if generation == tuple(self._generation.get(layer_id, 0) for layer_id in layer_ids):
+                self._entries[cache_key] = value
+                self._costs[cache_key] = cost
+                self._evict()
+        return value
+
+    def peek(self, layers, key):
+        """Objeto guardado para (camadas, key) ou None, sem criar"""
+        with self._lock:
+            return self._entries.get((tuple(layer.id() for layer in layers), key))
+
+    def put(self, layers, key, value):
+        """Substitui o objeto guardado (ex.: versão atualizada incrementalmente)"""
+        with self._lock:
+            for layer in layers:
+                self._watch(layer)
+            cache_key = (tuple(layer.id() for layer in layers), key)
+            self._entries[cache_key] = value
+            self._entries.move_to_end(cache_key)
+            self._costs.setdefault(cache_key, 1)
+
+    def watch(self, layers):
+        """
+        Liga os sinais de edição das camadas. Deve ser chamada na thread principal: um sinal ligado
+        em uma tarefa fica preso à thread da tarefa, que não tem event loop, e nunca é entregue.
+        """
+        with self._lock:
+            for layer in layers:
+                self._watch(layer)
+
+    def invalidate(self, layer_id):
+        with self._lock:
+            self._generation[layer_id] = self._generation.get(layer_id, 0) + 1
+            for cache_key in [k for k in self._entries if layer_id in k[0]]:
+                del self._entries[cache_key]
+                del self._costs[cache_key]
+
+    def clear(self):
+        with self._lock:
+            for layer_id in {layer_id for k in self._entries for layer_id in k[0]}:
+                self._generation[layer_id] = self._generation.get(layer_id, 0) + 1
+            self._entries.clear()
+            self._costs.clear()
+
+    def _evict(self):
+        # Mantém sempre a entrada mais recente
+        while len(self._entries) > 1:
+            over_budget = self._max_cost is not None and sum(self._costs.values()) > self._max_cost
+            if not over_budget and not low_memory():
+                break
+            cache_key, _ = self._entries.popitem(last=False)
+            del self._costs[cache_key]
+
+    def _watch(self, layer):
+        layer_id = layer.id()
+        if layer_id in self._watched:
+            return
+        self._watched.add(layer_id)
+
+        for signal_name in self._signals:
+            getattr(layer, signal_name).connect(lambda *args, lid=layer_id: self.invalidate(lid))
+        layer.willBeDeleted.connect(lambda lid=layer_id: self._forget(lid))
+
+    def _forget(self, layer_id):
+        with self._lock:
+            self._watched.discard(layer_id)
+        self.invalidate(layer_id)
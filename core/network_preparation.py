@@ -0,0 +1,116 @@
+from qgis.core import Qgis, QgsFeedback, QgsMessageLog, QgsTask, QgsTaskManager
+
+from core.attribute_cache import get_attribute_table, watch_attribute_table
+from core.hydrometer_table import watch_hydrometer_table
+from core.index_cache import get_spatial_index, watch_spatial_index
+from core.isolation_segments import watch_isolation_segments
+from core.network_topology import PIPELINE_FIELDS, VALVE_FIELDS, cached_topology, get_topology, watch_topology
+
+# Tarefas de preparação em andamento: (id das redes, id dos registros, user_distance) -> PrepareNetwork
+_running = {}
+
+
+def prepare_network(task_manager, pipelines, valves, user_distance=0.001, hydrometers=None):
+    """
+    Agenda a preparação das camadas (se ainda não estiverem prontas) e retorna a tarefa em andamento,
+    que pode ser usada como dependência de outras tarefas; None se não há nada a preparar
+    """
+    watch_layers(pipelines, valves, user_distance, hydrometers)
+    key = (pipelines.id(), valves.id(), user_distance)
+    task = _running.get(key)
+    if task is not None:
+        return task
+    if cached_topology(pipelines, valves, user_distance) is not None and hydrometers is None:
+        return None
+
+    task = PrepareNetwork(pipelines, valves, user_distance=user_distance, hydrometers=hydrometers)
+    _running[key] = task
+    task.taskCompleted.connect(lambda: _running.pop(key, None))
+    task.taskTerminated.connect(lambda: _running.pop(key, None))
+    task_manager.addTask(task)
+    return task
+
+
+def watch_layers(pipelines, valves, user_distance=0.001, hydrometers=None, sources=None):
+    """
+    Liga os sinais de edição das camadas a todos os caches usados pelas tarefas. Chamada na thread principal
+    antes de agendar as tarefas: em run() os caches só são preenchidos.
+    """
+    watch_topology(pipelines, valves, user_distance)
+    watch_isolation_segments(pipelines, valves, sources)
+    watch_attribute_table(pipelines, PIPELINE_FIELDS)
+    watch_attribute_table(valves, VALVE_FIELDS)
+    for layer in (pipelines, valves, hydrometers):
+        if layer is not None:
+            watch_spatial_index(layer)
+    if hydrometers is not None:
+        watch_hydrometer_table(pipelines, hydrometers)
+
+
+def add_after_preparation(task_manager, task, preparation, *dependencies):
+    """
+    Agenda 'task' para depois da preparação e das outras tarefas informadas (None é ignorado);
+    cancelar uma delas também cancela 'task'
+    """
+    dependencies = [dependency for dependency in (preparation,) + dependencies if dependency is not None]
+    if not dependencies:
+        task_manager.addTask(task)
+    else:
+        task_manager.addTask(QgsTaskManager.TaskDefinition(task, dependencies))
+
+
+class PrepareNetwork(QgsTask):
+    """
+    Carrega em segundo plano tudo o que o tracing lê das camadas: topologia (da cópia em disco ou montada
+    com os índices espaciais) e tabelas de atributos; opcionalmente o índice dos hidrômetros.
+    Os objetos ficam nos caches compartilhados, então as tarefas seguintes não bloqueiam a interface.
+    """
+
+    def __init__(self, pipelines, valves, description='PrepareNetworkCAJ', user_distance=0.001, hydrometers=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.__pipelines = pipelines
+        self.__valves = valves
+        self.__hydrometers = hydrometers
+        self.__user_distance = user_distance
+        self.__exception = None
+
+        # Repassa o cancelamento e o progresso para a montagem da topologia e dos índices
+        self.__feedback = QgsFeedback()
+        self.__feedback.progressChanged.connect(lambda progress: self.setProgress(0.8 * progress))
+
+    def run(self):
+        QgsMessageLog.logMessage(f'Started task {self.description()}', 'TracingCAJ', Qgis.Info)
+        try:
+            topology = get_topology(self.__pipelines, self.__valves, self.__user_distance,
+                                    feedback=self.__feedback)
+            if topology is None or self.isCanceled():
+                return False
+            self.setProgress(80)
+
+            get_attribute_table(self.__pipelines, PIPELINE_FIELDS)
+            get_attribute_table(self.__valves, VALVE_FIELDS)
+            self.setProgress(90)
+
+            if self.__hydrometers is not None and get_spatial_index(self.__hydrometers, self.__feedback) is None:
+                return False
+        except Exception as e:
+            self.__exception = e
+            return False
+        return not self.isCanceled()
+
+    def cancel(self):
+        self.__feedback.cancel()
+        super().cancel()
+
+    def finished(self, result):
+        if result:
+            QgsMessageLog.logMessage(f'Task {self.description()} has been executed correctly',
+                                     'TracingCAJ', level=Qgis.Success)
+        elif self.__exception is None:
+            QgsMessageLog.logMessage(f"Task {self.description()} not successful "
+                                     f"(probably the task was manually canceled by the user)",
+                                     'TracingCAJ', level=Qgis.Warning)
+        else:
+            QgsMessageLog.logMessage(f"Task {self.description()}"
+                                     f"Exception: {self.__exception}", 'TracingCAJ', level=Qgis.Critical)
+            raise self.__exception
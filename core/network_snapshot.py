@@ -0,0 +1,149 @@
+"""
+Cópia da rede em disco, ao lado do projeto, para não reler todas as feições a cada sessão.
+
+A topologia (coordenadas dos nós, extremidades das redes, redes de cada nó, registro de cada nó) e os
+atributos do tracing (diâmetros e situação dos registros) são gravados como arrays .npy e abertos como
+memória mapeada: carregar a rede passa a ser só mapear os arquivos. Cada cópia guarda a identificação
+das camadas (arquivo de origem, tamanho, data de modificação, quantidade de feições...) e é refeita
+quando ela muda. Camadas sem arquivo (memória, banco de dados) ou com edições não salvas não usam cópia.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from qgis.core import Qgis, QgsMessageLog, QgsProject, QgsProviderRegistry
+
+from core.tracing_engine import NetworkAttributes, NetworkTopology
+
+# Muda quando o formato dos arquivos muda (cópias antigas são refeitas)
+SNAPSHOT_VERSION = 1
+
+_TOPOLOGY_ARRAYS = ('pipe_ids', 'pipe_nodes', 'node_xy', 'node_pipe_ptr', 'node_pipe_idx', 'node_valve')
+_ATTRIBUTE_ARRAYS = ('diameters', 'valve_ids', 'valve_states')
+
+# Arquivos que acompanham o arquivo principal da camada (WAL do GeoPackage/SQLite, atributos do shapefile)
+_SIDECAR_FILES = ('{path}-wal', '{stem}.dbf', '{stem}.shx')
+
+
+def layer_fingerprint(layer):
+    """Identificação do conteúdo da camada sem ler as feições, ou None se a camada não pode ter cópia"""
+    if layer.isModified():
+        return None  # Edições ainda não gravadas no arquivo
+    path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get('path')
+    if not path or not os.path.isfile(path):
+        return None
+
+    digest = hashlib.sha1()
+    for value in (layer.providerType(), layer.source(), layer.subsetString(), layer.featureCount(),
+                  layer.extent().toString(), layer.crs().authid(), ','.join(layer.fields().names())):
+        digest.update(str(value).encode())
+        digest.update(b'\0')
+
+    stem = os.path.splitext(path)[0]
+    for file in [path] + [name.format(path=path, stem=stem) for name in _SIDECAR_FILES]:
+        if os.path.isfile(file):
+            stat = os.stat(file)
+            digest.update(f'{os.path.basename(file)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()
+
+
+def project_directory(*key):
+    """Diretório <projeto>_tracing/<hash da chave> para arquivos do plugin ou None se o projeto não foi salvo"""
+    project = QgsProject.instance()
+    if not project.fileName():
+        return None
+    digest = hashlib.sha1('|'.join(repr(part) for part in key).encode()).hexdigest()[:16]
+    return os.path.join(project.absolutePath(), project.baseName() + '_tracing', digest)
+
+
+def snapshot_directory(pipelines, valves, user_distance):
+    """Diretório da cópia do par de camadas ou None se o projeto não foi salvo"""
+    return project_directory(pipelines.id(), valves.id(), user_distance)
+
+
+def _manifest(pipelines, valves, user_distance):
+    pipelines_fingerprint = layer_fingerprint(pipelines)
+    valves_fingerprint = layer_fingerprint(valves)
+    if pipelines_fingerprint is None or valves_fingerprint is None:
+        return None
+    return {'version': SNAPSHOT_VERSION,
+            'user_distance': user_distance,
+            'pipelines': pipelines_fingerprint,
+            'valves': valves_fingerprint}
+
+
+def load_snapshot(pipelines, valves, user_distance=0.001):
+    """(NetworkTopology, NetworkAttributes) com arrays em memória mapeada (somente leitura) ou None"""
+    expected = _manifest(pipelines, valves, user_distance)
+    if expected is None:
+        return None
+    arrays = load_arrays(snapshot_directory(pipelines, valves, user_distance), expected,
+                         _TOPOLOGY_ARRAYS + _ATTRIBUTE_ARRAYS)
+    if arrays is None:
+        return None
+
+    topology = NetworkTopology(**{name: arrays[name] for name in _TOPOLOGY_ARRAYS})
+    attributes = NetworkAttributes(**{name: arrays[name] for name in _ATTRIBUTE_ARRAYS})
+    return topology, attributes
+
+
+def save_snapshot(pipelines, valves, user_distance, topology, attributes):
+    """Grava a cópia da rede; retorna False se as camadas não permitem cópia ou a gravação falhou"""
+    manifest = _manifest(pipelines, valves, user_distance)
+    if manifest is None:
+        return False
+    arrays = {name: getattr(topology, name) for name in _TOPOLOGY_ARRAYS}
+    arrays.update({name: getattr(attributes, name) for name in _ATTRIBUTE_ARRAYS})
+    manifest.update(pipes=int(topology.n_pipes), nodes=int(topology.n_nodes))
+    return save_arrays(snapshot_directory(pipelines, valves, user_distance), manifest, arrays)
+
+
+def load_arrays(directory, expected, names):
+    """
+    Arrays gravados por save_arrays, em memória mapeada, se o manifest do diretório tem os valores de 'expected'
+    :return: dicionário nome -> array ou None
+    """
+    manifest_path = os.path.join(directory, 'manifest.json') if directory else None
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, encoding='utf-8') as file:
+            manifest = json.load(file)
+        if any(manifest.get(key) != value for key, value in expected.items()):
+            return None
+        return {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in names}
+    except (OSError, ValueError) as e:
+        QgsMessageLog.logMessage(f'Arquivos em {directory} ignorados: {e}', 'TracingCAJ', Qgis.Warning)
+        return None
+
+
+def save_arrays(directory, manifest, arrays):
+    """Grava os arrays (.npy) e o manifest em 'directory'; False se a gravação falhou"""
+    if directory is None:
+        return False
+
+    manifest_path = os.path.join(directory, 'manifest.json')
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Sem manifest os arquivos não são usados: uma gravação interrompida nunca é lida pela metade
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        # Cada array vai para um arquivo temporário e substitui o anterior: topologias já abertas continuam
+        # mapeando o arquivo antigo em vez de ler um arquivo truncado
+        for name, array in arrays.items():
+            path = os.path.join(directory, name + '.npy')
+            temporary = path + '.tmp.npy'
+            np.save(temporary, np.ascontiguousarray(array))
+            os.replace(temporary, path)
+
+        temporary = manifest_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(temporary, manifest_path)
+    except OSError as e:
+        # Ex.: arquivo antigo ainda mapeado por uma topologia em uso (Windows) ou diretório sem permissão
+        QgsMessageLog.logMessage(f'Não foi possível gravar em {directory}: {e}', 'TracingCAJ', Qgis.Warning)
+        return False
+    return True
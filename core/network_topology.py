@@ -0,0 +1,233 @@
+import numpy as np
+
+from qgis.core import QgsFeatureRequest, QgsPointXY
+
+from core.attribute_cache import get_attribute_table
+from core.feature_stream import DEFAULT_CHUNK_SIZE, iter_chunks, iter_features
+from core.index_cache import get_spatial_index
+from core.layer_cache import ATTRIBUTE_SIGNALS, GEOMETRY_SIGNALS, ROLLBACK_SIGNALS, LayerCache
+from core.network_snapshot import load_snapshot, save_snapshot
+from core.tracing_engine import NO_VALVE, NetworkAttributes, NetworkTopology, NodeSnapper, classify_valve
+
+# Quantidade de redes procuradas em cada nó (mesmo limite do tracing por índice espacial)
+MAX_PIPES_PER_NODE = 4
+
+# Feições/nós entre verificações de cancelamento e atualizações de progresso
+PROGRESS_INTERVAL = 5000
+
+# Campos lidos pelo tracing em cada camada
+PIPELINE_FIELDS = ('diametro_nominal',)
+VALVE_FIELDS = ('codigo', 'visivel', 'status_operacao')
+
+# Edições nas camadas são aplicadas à topologia pelo NetworkUpdater
+_topology_cache = LayerCache(signals=ROLLBACK_SIGNALS)
+
+# Atributos em arrays junto da topologia a que correspondem: (topologia, NetworkAttributes)
+_attributes_cache = LayerCache(signals=GEOMETRY_SIGNALS + ATTRIBUTE_SIGNALS)
+
+
+def pipeline_endpoints(geometry):
+    """Primeiro e último vértice da rede (LineString ou MultiLineString)"""
+    last = geometry.constGet().nCoordinates() - 1
+    return QgsPointXY(geometry.vertexAt(0)), QgsPointXY(geometry.vertexAt(last))
+
+
+def polyline_arrays(geometry):
+    """Vértices de cada parte da rede como arrays (n, 2)"""
+    parts = geometry.asMultiPolyline() if geometry.isMultipart() else [geometry.asPolyline()]
+    return [np.array([(p.x(), p.y()) for p in part], dtype=np.float64).reshape(-1, 2) for part in parts if part]
+
+
+def pipeline_segments(pipelines):
+    """Todos os segmentos das redes: (início (k, 2), fim (k, 2), id da rede de cada segmento)"""
+    starts, ends, owners = [], [], []
+    for feature in pipelines.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        if not feature.hasGeometry():
+            continue
+        for part in polyline_arrays(feature.geometry()):
+            if len(part) < 2:
+                continue
+            starts.append(part[:-1])
+            ends.append(part[1:])
+            owners.append(np.full(len(part) - 1, feature.id(), dtype=np.int64))
+    if not starts:
+        return np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+    return np.vstack(starts), np.vstack(ends), np.concatenate(owners)
+
+
+def point_chunks(layer, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Blocos (ids (k,), coordenadas (k, 2)) das feições de uma camada de pontos, lidos sem atributos"""
+    features = iter_features(layer, chunk_size=chunk_size)
+    for chunk in iter_chunks((f for f in features if f.hasGeometry()), chunk_size):
+        ids = np.array([f.id() for f in chunk], dtype=np.int64)
+        points = np.array([(p.x(), p.y()) for p in (f.geometry().vertexAt(0) for f in chunk)], dtype=np.float64)
+        yield ids, points
+
+
+def build_topology(pipelines, valves, user_distance=0.001, instrumentation=None, feedback=None):
+    """
+    Monta a topologia consultando os índices espaciais uma única vez por nó.
+    As regras são as mesmas do tracing original: as redes a menos de user_distance
+    da extremidade são vizinhas e o registro mais próximo dentro de user_distance fica no nó.
+    :param instrumentation: Instrumentation opcional (contadores de feições lidas e consultas aos índices)
+    :param feedback: QgsFeedback opcional (cancelamento e progresso, também na criação dos índices espaciais)
+    :return: NetworkTopology ou None se cancelado
+    """
+    idx_pipelines = get_spatial_index(pipelines, feedback)
+    idx_valves = get_spatial_index(valves, feedback) if idx_pipelines is not None else None
+    if idx_pipelines is None or idx_valves is None:
+        return None
+
+    snapper = NodeSnapper(user_distance)
+    pipe_ids = []
+    pipe_nodes = []
+    total = max(pipelines.featureCount(), 1)
+    for current, feature in enumerate(pipelines.getFeatures(QgsFeatureRequest().setNoAttributes())):
+        if feedback is not None and current % PROGRESS_INTERVAL == 0:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(50.0 * current / total)
+
+        geometry = feature.geometry()
+        if geometry.isNull() or geometry.isEmpty():
+            continue
+
+        first, last = pipeline_endpoints(geometry)
+        pipe_ids.append(feature.id())
+        pipe_nodes.append((snapper.snap(first.x(), first.y()), snapper.snap(last.x(), last.y())))
+
+    pipe_index = {fid: i for i, fid in enumerate(pipe_ids)}
+    node_pipe_ptr = [0]
+    node_pipe_idx = []
+    node_valve = []
+    for current, (x, y) in enumerate(snapper.points):
+        if feedback is not None and current % PROGRESS_INTERVAL == 0:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(50 + 50.0 * current / max(len(snapper.points), 1))
+
+        point = QgsPointXY(x, y)
+        nearest = idx_pipelines.nearestNeighbor(point=point, neighbors=MAX_PIPES_PER_NODE,
+                                                maxDistance=user_distance)
+        node_pipe_idx.extend(pipe_index[fid] for fid in nearest if fid in pipe_index)
+        node_pipe_ptr.append(len(node_pipe_idx))
+
+        valve_nearest = idx_valves.nearestNeighbor(point=point, neighbors=1, maxDistance=user_distance)
+        node_valve.append(valve_nearest[0] if valve_nearest else NO_VALVE)
+
+    if instrumentation is not None:
+        instrumentation.count('provider_features', len(pipe_ids))
+        instrumentation.count('index_queries', 2 * len(snapper.points))
+
+    return NetworkTopology(pipe_ids=np.array(pipe_ids, dtype=np.int64),
+                           pipe_nodes=np.array(pipe_nodes, dtype=np.int32).reshape(-1, 2),
+                           node_xy=np.array(snapper.points, dtype=np.float64).reshape(-1, 2),
+                           node_pipe_ptr=np.array(node_pipe_ptr, dtype=np.int32),
+                           node_pipe_idx=np.array(node_pipe_idx, dtype=np.int32),
+                           node_valve=np.array(node_valve, dtype=np.int64),
+                           snapper=snapper)
+
+
+def get_topology(pipelines, valves, user_distance=0.001, instrumentation=None, feedback=None):
+    """
+    Topologia em cache, mantida atualizada pelas edições nas camadas de redes e registros.
+    Na primeira vez da sessão é lida da cópia em disco (network_snapshot) quando as camadas não mudaram;
+    senão é montada e a cópia é gravada. Retorna None se cancelado durante a montagem.
+    """
+    from core.network_updater import watch_network
+    watch_network(pipelines, valves, user_distance)
+
+    def factory():
+        snapshot = load_snapshot(pipelines, valves, user_distance)
+        if snapshot is not None:
+            if instrumentation is not None:
+                instrumentation.count('snapshot_loaded')
+            _attributes_cache.put([pipelines, valves], user_distance, snapshot)
+            return snapshot[0]
+        topology = build_topology(pipelines, valves, user_distance, instrumentation, feedback)
+        if topology is None:
+            return None
+        attributes = load_attributes(pipelines, valves, topology)
+        _attributes_cache.put([pipelines, valves], user_distance, (topology, attributes))
+        save_snapshot(pipelines, valves, user_distance, topology, attributes)
+        return topology
+
+    return _topology_cache.get([pipelines, valves], user_distance, factory)
+
+
+def watch_topology(pipelines, valves, user_distance=0.001):
+    """Liga os sinais de edição à topologia e aos atributos em cache (na thread principal)"""
+    from core.network_updater import watch_network
+    watch_network(pipelines, valves, user_distance)
+    _topology_cache.watch([pipelines, valves])
+    _attributes_cache.watch([pipelines, valves])
+
+
+def cached_topology(pipelines, valves, user_distance=0.001):
+    return _topology_cache.peek([pipelines, valves], user_distance)
+
+
+def put_topology(pipelines, valves, user_distance, topology):
+    _topology_cache.put([pipelines, valves], user_distance, topology)
+
+
+def get_lookups(pipelines, valves, topology):
+    """
+    Funções de consulta usadas pelo tracing_engine, lidas das tabelas de atributos em cache:
+    situação do registro (id do registro) e diâmetro nominal (índice da rede na topologia)
+    """
+    pipelines_table = get_attribute_table(pipelines, PIPELINE_FIELDS)
+    valves_table = get_attribute_table(valves, VALVE_FIELDS)
+    pipe_ids = topology.lists()[0]
+
+    def valve_state(valve_id):
+        return classify_valve(valves_table.value(valve_id, 'visivel'),
+                              valves_table.value(valve_id, 'status_operacao'))
+
+    def diameter(pipeline_index):
+        return pipelines_table.value(pipe_ids[pipeline_index], 'diametro_nominal')
+
+    return valve_state, diameter
+
+
+def load_attributes(pipelines, valves, topology):
+    """
+    Atributos do tracing em arrays (NetworkAttributes), lidos das tabelas em cache.
+    Ao contrário de get_lookups é uma cópia: pode ir para outros processos, mas não acompanha edições.
+    """
+    pipelines_table = get_attribute_table(pipelines, PIPELINE_FIELDS)
+    valves_table = get_attribute_table(valves, VALVE_FIELDS)
+
+    diameters = [_number(pipelines_table.value(fid, 'diametro_nominal')) for fid in topology.lists()[0]]
+    valve_ids = np.unique(topology.node_valve[topology.node_valve != NO_VALVE]).tolist()
+    return NetworkAttributes.from_valves(diameters, valve_ids,
+                                         [valves_table.value(fid, 'visivel') for fid in valve_ids],
+                                         [valves_table.value(fid, 'status_operacao') for fid in valve_ids])
+
+
+def pipe_lengths(pipelines, topology):
+    """Comprimento de cada rede na ordem da topologia (0 para redes removidas)"""
+    lengths = np.zeros(topology.n_pipes, dtype=np.float64)
+    for feature in pipelines.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        index = topology.pipe_index.get(feature.id())
+        if index is not None and feature.hasGeometry():
+            lengths[index] = feature.geometry().length()
+    return lengths
+
+
+def load_network(pipelines, valves, user_distance=0.001):
+    """Topologia (em cache) e atributos em arrays: tudo o que o tracing_engine precisa, sem objetos do QGIS"""
+    topology = get_topology(pipelines, valves, user_distance)
+
+    # Atributos lidos (ou vindos da cópia em disco) para esta mesma topologia; edições descartam a entrada
+    cached = _attributes_cache.peek([pipelines, valves], user_distance)
+    if cached is not None and cached[0] is topology:
+        return cached
+    attributes = load_attributes(pipelines, valves, topology)
+    _attributes_cache.put([pipelines, valves], user_distance, (topology, attributes))
+    return topology, attributes
+
+
+def _number(value):
+    # NULL do QGIS, texto ou vazio -> diâmetro desconhecido
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else float('nan')
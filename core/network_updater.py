@@ -0,0 +1,186 @@
+from qgis.PyQt.QtCore import QTimer
+from qgis.core import QgsPointXY
+
+from core.index_cache import get_spatial_index
+from core.isolation_segments import cached_isolation_segments, put_isolation_segments
+from core.network_topology import (MAX_PIPES_PER_NODE, cached_topology, get_lookups, pipeline_endpoints,
+                                   put_topology)
+from core.tracing_engine import NodeSnapper
+
+_updaters = {}
+
+
+def watch_network(pipelines, valves, user_distance=0.001):
+    """Garante um NetworkUpdater para o par de camadas (um por processo)"""
+    key = (pipelines.id(), valves.id(), user_distance)
+    if key not in _updaters:
+        _updaters[key] = NetworkUpdater(pipelines, valves, user_distance)
+        pipelines.willBeDeleted.connect(lambda: _updaters.pop(key, None))
+        valves.willBeDeleted.connect(lambda: _updaters.pop(key, None))
+    return _updaters[key]
+
+
+class NetworkUpdater:
+    """
+    Aplica as edições das camadas de redes e registros na topologia e nos segmentos de isolamento em cache,
+    recalculando somente os nós e segmentos afetados (ex.: rede dividida, registro movido ou status alterado).
+    As edições são acumuladas e aplicadas juntas na próxima volta do event loop; os objetos em cache são
+    substituídos por cópias atualizadas, então tracings em andamento continuam com a versão anterior.
+    """
+
+    def __init__(self, pipelines, valves, user_distance=0.001):
+        self.__pipelines = pipelines
+        self.__valves = valves
+        self.__user_distance = user_distance
+
+        self.__pipes = set()  # redes criadas, removidas ou com geometria alterada
+        self.__diameters = set()  # redes com diâmetro alterado
+        self.__valves_moved = set()  # registros criados, removidos ou com geometria alterada
+        self.__valves_status = set()  # registros com visivel/status_operacao alterado
+        self.__temporary_pipes = set()
+        self.__temporary_valves = set()
+        self.__scheduled = False
+
+        pipelines.featureAdded.connect(lambda fid: self.__pipe_changed(fid))
+        pipelines.featureDeleted.connect(lambda fid: self.__pipe_changed(fid))
+        pipelines.geometryChanged.connect(lambda fid, geometry: self.__pipe_changed(fid))
+        pipelines.attributeValueChanged.connect(self.__pipe_attribute_changed)
+        pipelines.committedFeaturesAdded.connect(lambda layer_id, features: self.__pipes_committed(features))
+
+        valves.featureAdded.connect(lambda fid: self.__valve_changed(fid))
+        valves.featureDeleted.connect(lambda fid: self.__valve_changed(fid))
+        valves.geometryChanged.connect(lambda fid, geometry: self.__valve_changed(fid))
+        valves.attributeValueChanged.connect(self.__valve_attribute_changed)
+        valves.committedFeaturesAdded.connect(lambda layer_id, features: self.__valves_committed(features))
+
+    def __pipe_changed(self, fid):
+        self.__pipes.add(fid)
+        if fid < 0:
+            self.__temporary_pipes.add(fid)
+        self.__schedule()
+
+    def __pipe_attribute_changed(self, fid, index, value):
+        if self.__pipelines.fields().at(index).name() == 'diametro_nominal':
+            self.__diameters.add(fid)
+            self.__schedule()
+
+    def __pipes_committed(self, features):
+        # Ids temporários (negativos) são trocados pelos definitivos ao salvar
+        self.__pipes |= self.__temporary_pipes
+        self.__pipes.update(feature.id() for feature in features)
+        self.__temporary_pipes.clear()
+        self.__schedule()
+
+    def __valve_changed(self, fid):
+        self.__valves_moved.add(fid)
+        if fid < 0:
+            self.__temporary_valves.add(fid)
+        self.__schedule()
+
+    def __valve_attribute_changed(self, fid, index, value):
+        if self.__valves.fields().at(index).name() in ('visivel', 'status_operacao'):
+            self.__valves_status.add(fid)
+            self.__schedule()
+
+    def __valves_committed(self, features):
+        self.__valves_moved |= self.__temporary_valves
+        self.__valves_moved.update(feature.id() for feature in features)
+        self.__temporary_valves.clear()
+        self.__schedule()
+
+    def __schedule(self):
+        if not self.__scheduled:
+            self.__scheduled = True
+            # Depois dos demais slots (índices espaciais e tabelas de atributos já atualizados)
+            QTimer.singleShot(0, self.apply)
+
+    def apply(self):
+        self.__scheduled = False
+        pipes, diameters = self.__pipes, self.__diameters
+        valves_moved, valves_status = self.__valves_moved, self.__valves_status
+        self.__pipes, self.__diameters, self.__valves_moved, self.__valves_status = set(), set(), set(), set()
+
+        topology = cached_topology(self.__pipelines, self.__valves, self.__user_distance)
+        if topology is None:
+            return  # Nada calculado ainda: a próxima montagem já lê as camadas editadas
+
+        nodes = set()
+        changed_pipes = set()
+        if pipes or valves_moved:
+            topology = self.__patch_topology(topology, pipes, valves_moved, nodes, changed_pipes)
+            put_topology(self.__pipelines, self.__valves, self.__user_distance, topology)
+
+        for fid in diameters:
+            index = topology.pipe_index.get(fid)
+            if index is not None:
+                changed_pipes.add(index)
+                nodes |= topology.nodes_touching(index)
+        for fid in valves_status:
+            nodes |= topology.nodes_with_valve(fid)
+
+        segments = cached_isolation_segments(self.__pipelines, self.__valves, self.__user_distance)
+        if segments is not None and (nodes or changed_pipes):
+            valve_state, diameter = get_lookups(self.__pipelines, self.__valves, topology)
+            segments = segments.update(topology, valve_state, diameter, nodes=nodes, pipes=changed_pipes)
+            put_isolation_segments(self.__pipelines, self.__valves, self.__user_distance, segments)
+
+    def __patch_topology(self, topology, pipes, valves_moved, nodes, changed_pipes):
+        distance = self.__user_distance
+        if topology.snapper is None:
+            # Topologia lida da cópia em disco: o snapper é refeito a partir dos nós na primeira edição
+            topology.snapper = NodeSnapper.from_points(distance, topology.node_xy.tolist())
+        patched = topology.copy()
+
+        # Redes: novas extremidades e nós próximos da nova geometria passam a ter outra lista de redes
+        pipe_nodes = set()
+        valve_nodes = set()
+        for fid in pipes:
+            old_index = topology.pipe_index.get(fid)
+            if old_index is not None:
+                changed_pipes.add(old_index)
+                pipe_nodes |= topology.nodes_touching(old_index)
+
+            feature = self.__pipelines.getFeature(fid)
+            geometry = feature.geometry() if feature.isValid() else None
+            if geometry is None or geometry.isNull() or geometry.isEmpty():
+                patched.remove_pipe(fid)
+                continue
+
+            first, last = pipeline_endpoints(geometry)
+            index, ends = patched.set_pipe(fid, (first.x(), first.y()), (last.x(), last.y()))
+            changed_pipes.add(index)
+            pipe_nodes.update(ends)
+            valve_nodes.update(ends)
+
+        patched.commit()
+        for fid in pipes:
+            feature = self.__pipelines.getFeature(fid)
+            if feature.isValid() and feature.hasGeometry():
+                box = feature.geometry().boundingBox().buffered(distance)
+                pipe_nodes |= patched.nodes_in_box(box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum())
+
+        if pipe_nodes:
+            idx_pipelines = get_spatial_index(self.__pipelines)
+            for node in pipe_nodes:
+                nearest = idx_pipelines.nearestNeighbor(point=QgsPointXY(*patched.snapper.points[node]),
+                                                        neighbors=MAX_PIPES_PER_NODE, maxDistance=distance)
+                patched.set_node_pipes(node, [patched.pipe_index[f] for f in nearest if f in patched.pipe_index])
+
+        # Registros: nós onde o registro estava e nós próximos da nova posição
+        for fid in valves_moved:
+            valve_nodes |= topology.nodes_with_valve(fid)
+            feature = self.__valves.getFeature(fid)
+            if feature.isValid() and feature.hasGeometry():
+                point = feature.geometry().vertexAt(0)
+                valve_nodes.update(patched.snapper.near(point.x(), point.y()))
+
+        if valve_nodes:
+            idx_valves = get_spatial_index(self.__valves)
+            for node in valve_nodes:
+                nearest = idx_valves.nearestNeighbor(point=QgsPointXY(*patched.snapper.points[node]),
+                                                     neighbors=1, maxDistance=distance)
+                patched.set_node_valve(node, nearest[0] if nearest else None)
+
+        patched.commit()
+        nodes |= pipe_nodes | valve_nodes
+        return patched
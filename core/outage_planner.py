@@ -0,0 +1,253 @@
+"""
+Planejamento de desligamentos para vários locais de obra, sem QGIS.
+
+Cada local (rede) começa com o seu próprio desligamento: a zona do tracing normal e os registros a fechar.
+Locais dentro da zona de outro local já compartilham o desligamento. Depois os desligamentos são agrupados
+de forma gulosa, sempre pela junção que mais reduz o custo total:
+    custo = valve_cost * registros distintos a operar + impacto (comprimento ou clientes das redes afetadas)
+Juntar dois desligamentos é deixar aberto o registro entre eles: diretamente, quando compartilham um registro
+do contorno, ou atravessando uma zona intermediária sem obra. As zonas ampliadas vêm de
+ValveFailureAnalysis.expand, que guarda as zonas já percorridas, então cada avaliação só percorre o anel novo
+e centenas de locais são avaliados sem refazer o tracing.
+"""
+import heapq
+import math
+from collections import Counter
+
+import numpy as np
+
+
+class Shutdown:
+    """Desligamento: locais atendidos (índices das redes), registros deixados abertos e a zona resultante"""
+
+    def __init__(self, sites, base, failed, result, cost, impact):
+        self.sites = sites  # frozenset de índices das redes de obra
+        self.base = base  # zona de partida das ampliações (zona de uma das redes de obra)
+        self.failed = failed  # frozenset de registros do contorno que ficam abertos (zonas juntadas)
+        self.result = result  # TraceResult/ExpandedResult: redes afetadas e registros a fechar
+        self.cost = cost
+        self.impact = impact
+
+
+class OutagePlan:
+    """Desligamentos escolhidos e os totais do plano"""
+
+    def __init__(self, shutdowns, unplaced):
+        self.shutdowns = shutdowns
+        self.unplaced = unplaced  # redes de obra sem zona (removidas ou sem geometria)
+
+    @property
+    def operations(self):
+        """Registros distintos a operar no plano (um registro no contorno de dois desligamentos conta uma vez)"""
+        return len(self.valves)
+
+    @property
+    def valves(self):
+        """Registros distintos usados pelo plano"""
+        return set().union(*(shutdown.result.valves for shutdown in self.shutdowns))
+
+    @property
+    def impact(self):
+        return sum(shutdown.impact for shutdown in self.shutdowns)
+
+
+def plan_outages(analysis, sites, pipe_weight, valve_cost=1.0, max_impact=None, bridges=True, is_canceled=None):
+    """
+    :param analysis: ValveFailureAnalysis da rede (zonas em cache e ampliações incrementais)
+    :param sites: índices das redes de obra na topologia
+    :param pipe_weight: impacto de cada rede (n_pipes,): comprimento, clientes...
+    :param valve_cost: custo de operar um registro, nas unidades de pipe_weight
+    :param max_impact: impacto máximo de um desligamento (None = sem limite)
+    :param bridges: também juntar desligamentos separados por uma zona sem obra
+    :return: OutagePlan ou None se cancelado
+    """
+    return _Planner(analysis, pipe_weight, valve_cost, max_impact, bridges, is_canceled).plan(sites)
+
+
+class _Planner:
+
+    def __init__(self, analysis, pipe_weight, valve_cost, max_impact, bridges, is_canceled):
+        self.analysis = analysis
+        self.pipe_weight = np.asarray(pipe_weight, dtype=np.float64)
+        self.valve_cost = valve_cost
+        self.max_impact = max_impact
+        self.bridges = bridges
+        self.is_canceled = is_canceled
+        self.site_group = {}  # rede de obra -> desligamento atual
+        self.site_ids = {}  # rede de obra -> id da feição (consultado em result.pipelines)
+        self.valve_uses = Counter()  # registro -> desligamentos que o fecham
+        self.used_valves = set()  # registros fechados por algum desligamento
+
+    def plan(self, sites):
+        pipe_ids = self.analysis.topology.pipe_ids
+        groups = []
+        unplaced = []
+        for site in dict.fromkeys(int(site) for site in sites):
+            if not self.analysis.topology.is_alive(site):
+                unplaced.append(site)
+                continue
+            # Local dentro da zona de um desligamento já criado (a zona não reversível é um objeto novo
+            # a cada consulta, então a comparação é pelas redes)
+            fid = int(pipe_ids[site])
+            position = next((i for i, group in enumerate(groups) if fid in group.result.pipelines), None)
+            if position is not None:
+                group = groups[position]
+                groups[position] = self.__shutdown(group.sites | {site}, group.base, frozenset(), group.result)
+                continue
+            # Locais anteriores dentro da nova zona passam para ela (desligamentos sem local são descartados)
+            zone = self.analysis.zone(site)
+            moved = frozenset(other for group in groups for other in group.sites
+                              if int(pipe_ids[other]) in zone.pipelines)
+            if moved:
+                groups = [self.__shutdown(group.sites - moved, group.base, frozenset(), group.result)
+                          if group.sites & moved else group for group in groups if group.sites - moved]
+            groups.append(self.__shutdown(moved | {site}, zone, frozenset(), zone))
+        for group in groups:
+            self.valve_uses.update(group.result.valves)
+            for site in group.sites:
+                self.site_group[site] = group
+                self.site_ids[site] = int(pipe_ids[site])
+        self.used_valves = set(self.valve_uses)
+
+        # Junções candidatas em um heap pela redução de custo; entradas com desligamentos já juntados são ignoradas.
+        # Só os registros abertos ficam no heap: a zona da junção escolhida é refeita (em cache na análise)
+        alive = {id(group) for group in groups}
+        heap = []
+        counter = 0
+        dependents = {}  # desligamento -> desligamentos com junções candidatas que o envolvem
+        pending = list(groups)
+        while True:
+            by_valve = self.__groups_with_valve()
+            for group in pending:
+                for candidate in self.__candidates(group, by_valve):
+                    if candidate is None:
+                        return None
+                    delta, absorbed, owner, failed = candidate
+                    for other in absorbed:
+                        dependents.setdefault(id(other), {})[id(group)] = group
+                    if delta < 0:
+                        counter += 1
+                        heapq.heappush(heap, (delta, counter, absorbed, owner, failed))
+
+            # A variação guardada pode ter mudado com as junções seguintes (registros compartilhados com outros
+            # desligamentos): a junção só é aplicada se ainda reduz o custo total
+            while heap:
+                _, _, absorbed, owner, failed = heapq.heappop(heap)
+                if not all(id(other) in alive for other in absorbed):
+                    continue
+                merged, absorbed = self.__evaluate(owner, failed)
+                if merged is None:
+                    return None
+                if absorbed is not None and self.__delta(merged, absorbed) < 0:
+                    break
+            else:
+                break
+
+            for group in absorbed:
+                alive.discard(id(group))
+                self.valve_uses.subtract(group.result.valves)
+            alive.add(id(merged))
+            self.valve_uses.update(merged.result.valves)
+            self.used_valves = {valve for valve, uses in self.valve_uses.items() if uses > 0}
+            for site in merged.sites:
+                self.site_group[site] = merged
+            # A junção pode ser avaliada a partir de qualquer um dos lados (as regras de diâmetro não são
+            # simétricas): os vizinhos que dependiam dos desligamentos juntados são reavaliados
+            pending = {id(merged): merged}
+            for group in absorbed:
+                for other in dependents.pop(id(group), {}).values():
+                    if id(other) in alive:
+                        pending[id(other)] = other
+            pending = list(pending.values())
+
+        shutdowns = list({id(group): group for group in self.site_group.values()}.values())
+        shutdowns.sort(key=lambda shutdown: min(shutdown.sites))
+        return OutagePlan(shutdowns, unplaced)
+
+    def __shutdown(self, sites, base, failed, result):
+        impact = float(self.pipe_weight[result.pipe_indices].sum()) if len(result.pipe_indices) else 0.0
+        return Shutdown(sites, base, failed, result, self.valve_cost * len(result.valves) + impact, impact)
+
+    def __groups_with_valve(self):
+        by_valve = {}
+        for group in {id(group): group for group in self.site_group.values()}.values():
+            for valve in group.result.valves:
+                by_valve.setdefault(valve, []).append(group)
+        return by_valve
+
+    def __candidates(self, group, by_valve):
+        """Junções de 'group' com os desligamentos vizinhos (avaliadas por __merge)"""
+        tried = set()
+        own = None  # redes do próprio desligamento
+        for valve in group.result.valves:
+            neighbors = [other for other in by_valve.get(valve, ()) if other is not group]
+            for other in neighbors:
+                shared = group.result.valves & other.result.valves
+                key = (id(other), frozenset(shared))
+                if key not in tried:
+                    tried.add(key)
+                    yield self.__merge(group, other, group.failed | other.failed | shared)
+
+            if neighbors or not self.bridges or not self.analysis.is_failable(valve):
+                continue
+            # Zona intermediária sem obra: as zonas do outro lado do registro (em cache na análise) indicam os
+            # desligamentos alcançáveis; a junção em si é conferida pela ampliação com as regras do tracing
+            if own is None:
+                own = set(group.result.pipe_indices)
+            for zone in self.analysis.zones_at(valve):
+                if not zone.pipe_indices or zone.pipe_indices[0] in own:
+                    continue
+                for other in {id(g): g for v in zone.valves for g in by_valve.get(v, ()) if g is not group}.values():
+                    key = (id(other), id(zone))
+                    if key not in tried:
+                        tried.add(key)
+                        opened = zone.valves & (group.result.valves | other.result.valves)
+                        yield self.__merge(group, other, group.failed | other.failed | opened)
+
+    def __expand(self, group, failed):
+        failed = frozenset(valve for valve in failed if self.analysis.is_failable(valve))
+        if not failed:
+            return group.base, failed
+        return self.analysis.expand(group.base, failed, self.is_canceled), failed
+
+    def __merge(self, group, other, failed):
+        """(variação do custo, desligamentos juntados, desligamento de partida, registros abertos) ou None"""
+        # A ampliação parte do maior desligamento: a análise reaproveita a ampliação dele já calculada
+        # e só percorre o anel novo
+        owner = group if len(group.result.pipe_indices) >= len(other.result.pipe_indices) else other
+        merged, absorbed = self.__evaluate(owner, failed)
+        if merged is None:
+            return None
+        if absorbed is None:
+            return math.inf, (), owner, merged.failed  # junção inválida: nunca aplicada
+        return self.__delta(merged, absorbed), absorbed, owner, merged.failed
+
+    def __delta(self, merged, absorbed):
+        """Variação do custo total do plano: registros distintos a operar e impacto"""
+        # Registros novos no plano menos os que deixam de ser fechados por algum desligamento
+        added = len(merged.result.valves - self.used_valves)
+        gone = frozenset().union(*(shutdown.result.valves for shutdown in absorbed)) - merged.result.valves
+        freed = sum(1 for valve in gone
+                    if self.valve_uses[valve] == sum(valve in shutdown.result.valves for shutdown in absorbed))
+        impact = merged.impact - sum(shutdown.impact for shutdown in absorbed)
+        return self.valve_cost * (added - freed) + impact
+
+    def __evaluate(self, group, failed):
+        # Desligamentos alcançados pela zona ampliada são juntados inteiros (com os seus registros abertos)
+        while True:
+            result, failed = self.__expand(group, failed)
+            if result is None:
+                return None, None
+            reached = [site for site, fid in self.site_ids.items() if fid in result.pipelines]
+            absorbed = {id(self.site_group[site]): self.site_group[site] for site in reached}
+            absorbed[id(group)] = group
+            extra = frozenset().union(*(other.failed for other in absorbed.values())) - failed
+            if not extra:
+                break
+            failed |= extra
+
+        sites = frozenset().union(*(other.sites for other in absorbed.values()))
+        merged = self.__shutdown(sites, group.base, failed, result)
+        if len(sites) != len(reached) or (self.max_impact is not None and merged.impact > self.max_impact):
+            return merged, None
+        return merged, tuple(absorbed.values())
@@ -0,0 +1,34 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+def python_executable():
+    """
+    Executável Python para os processos filhos. Dentro do QGIS sys.executable é o próprio QGIS
+    (ex.: qgis-bin.exe no Windows), que não pode ser usado para iniciar os processos.
+    """
+    name = os.path.basename(sys.executable).lower()
+    if name.startswith('python'):
+        return sys.executable
+    for candidate in ('python.exe', 'pythonw.exe', os.path.join('bin', 'python3'), os.path.join('bin', 'python')):
+        path = os.path.join(sys.exec_prefix, candidate)
+        if os.path.exists(path):
+            return path
+    return sys.executable
+
+
+def create_process_pool(workers, initializer=None, initargs=()):
+    """
+    ProcessPoolExecutor com processos 'spawn' (não herdam o estado do QGIS/Qt do processo principal).
+    As funções enviadas devem estar em módulos sem dependência do QGIS.
+    """
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(python_executable())
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                               initializer=initializer, initargs=initargs)
+
+
+def default_workers():
+    return max((os.cpu_count() or 2) - 1, 1)
@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+
+from core.layer_cache import ATTRIBUTE_SIGNALS, GEOMETRY_SIGNALS, LayerCache, low_memory
+
+# Limite de redes somadas entre todos os resultados guardados de um par de camadas
+MAX_CACHED_PIPES = 2000000
+
+# Qualquer edição (geometria ou atributo) em redes ou registros descarta os resultados das camadas
+_results_cache = LayerCache(signals=GEOMETRY_SIGNALS + ATTRIBUTE_SIGNALS)
+
+
+def get_trace_results(pipelines, valves, user_distance=0.001):
+    """TraceResults do par de camadas; um novo objeto (vazio) depois de cada edição"""
+    return _results_cache.get([pipelines, valves], user_distance, TraceResults)
+
+
+class TraceResults:
+    """
+    Resultados de tracing já calculados por id da rede de partida, do mais antigo ao mais recente.
+    Um resultado reversível vale para todas as redes da zona, então redes vizinhas na mesma zona também
+    encontram o resultado. Os mais antigos são descartados quando a soma das redes passa de max_pipes
+    ou quando a memória livre do sistema fica baixa.
+    """
+
+    def __init__(self, max_pipes=MAX_CACHED_PIPES):
+        self._max_pipes = max_pipes
+        self._results = OrderedDict()  # id(resultado) -> (resultado, ids das redes que apontam para ele)
+        self._by_pipe = {}  # id da rede -> id(resultado)
+        self._cost = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, fid):
+        """Resultado para a rede de partida fid ou None"""
+        with self._lock:
+            key = self._by_pipe.get(fid)
+            if key is None:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key][0]
+
+    def put(self, fid, result):
+        with self._lock:
+            key = id(result)
+            if key in self._results:
+                self._results[key][1].add(fid)
+                self._by_pipe[fid] = key
+                self._results.move_to_end(key)
+                return
+
+            fids = set(result.pipelines) if result.reversible else set()
+            fids.add(fid)
+            self._results[key] = (result, fids)
+            self._cost += len(result.pipelines)
+            for pipe in fids:
+                self._by_pipe[pipe] = key
+            self.__evict()
+
+    def __evict(self):
+        # Mantém sempre o resultado mais recente
+        while len(self._results) > 1 and (self._cost > self._max_pipes or low_memory()):
+            key, (result, fids) = self._results.popitem(last=False)
+            self._cost -= len(result.pipelines)
+            for pipe in fids:
+                if self._by_pipe.get(pipe) == key:
+                    del self._by_pipe[pipe]
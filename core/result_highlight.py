@@ -0,0 +1,47 @@
+"""
+Destaque temporário (rubber bands no mapa) dos registros fechados e não visíveis de um tracing.
+A seleção da camada de registros fica só com os registros a operar; o destaque não altera camadas
+e é removido no próximo tracing ou com clear_highlight.
+"""
+from qgis.PyQt.QtGui import QColor
+from qgis.core import QgsWkbTypes
+from qgis.gui import QgsRubberBand
+
+from core.feature_stream import iter_features
+
+# Cor de cada situação destacada
+HIGHLIGHT_COLORS = {'valves_closed': QColor(220, 30, 30),
+                    'valves_not_visible': QColor(255, 140, 0)}
+HIGHLIGHT_SIZE = 14
+
+_bands = []
+
+
+def clear_highlight():
+    for band in _bands:
+        band.reset(QgsWkbTypes.PointGeometry)
+        band.canvas().scene().removeItem(band)
+    _bands.clear()
+
+
+def highlight_valves(canvas, valves, valves_by_situation):
+    """
+    :param valves: camada de registros
+    :param valves_by_situation: {'valves_closed': ids, 'valves_not_visible': ids}
+    """
+    clear_highlight()
+    for situation, fids in valves_by_situation.items():
+        if not fids:
+            continue
+        band = QgsRubberBand(canvas, QgsWkbTypes.PointGeometry)
+        band.setColor(HIGHLIGHT_COLORS[situation])
+        band.setIcon(QgsRubberBand.ICON_CIRCLE)
+        band.setIconSize(HIGHLIGHT_SIZE)
+        band.setWidth(3)
+        # Somente a geometria dos registros destacados, sem atributos
+        for feature in iter_features(valves, fids=sorted(fids)):
+            if feature.hasGeometry():
+                band.addGeometry(feature.geometry(), valves, False)
+        band.updatePosition()
+        band.update()
+        _bands.append(band)
@@ -1,20 +1,109 @@
-from core.find_points import FindPoints
+from core.break_tracing import BreakTracing
+from core.feature_stream import iter_features
+from core.find_points import HD_MAX_DISTANCE, FindPoints
+from core.hydrometer_table import BuildHydrometerTable, cached_hydrometer_table
+from core.isolation_segments import BuildIsolationSegments, cached_isolation_segments
+from core.network_preparation import add_after_preparation, prepare_network, watch_layers
 from core.tracing_pipelines import TracingPipelines
 
+# Tarefas de segundo plano em andamento: (tarefa, ids das camadas, parâmetro) -> QgsTask
+_running = {}
+
+
+def _track(key, task):
+    _running[key] = task
+    task.taskCompleted.connect(lambda: _running.pop(key, None))
+    task.taskTerminated.connect(lambda: _running.pop(key, None))
+
 
 class TracingCAJ:
-    def __init__(self, task_manager, pipelines, valves, parent=None):
+    def __init__(self, task_manager, pipelines, valves, parent=None, log_level=None, profile_path=None,
+                 highlight=False, hydrometers=None, customers_path=None, direction=None, sources=None):
         self.__pipelines = pipelines
         self.__valves = valves
         self.__tm = task_manager
         self._parent = parent
+        self.__log_level = log_level
+        self.__profile_path = profile_path
+        self.__highlight = highlight
+        self.__hydrometers = hydrometers
+        self.__customers_path = customers_path
+        self.__direction = direction
+        self.__sources = sources
 
     def start(self):
+        # Sinais de edição ligados aqui, na thread principal (as tarefas só preenchem os caches)
+        watch_layers(self.__pipelines, self.__valves, hydrometers=self.__hydrometers, sources=self.__sources)
+
         #tracing_task = TracingPipelines(self.__pipelines, self.__valves, onfinish=self.select_hidrometers)
-        tracing_task = TracingPipelines(self.__pipelines, self.__valves, parent=self._parent)
-        self.__tm.addTask(tracing_task)
+        tracing_task = TracingPipelines(self.__pipelines, self.__valves, parent=self._parent,
+                                        log_level=self.__log_level, profile_path=self.__profile_path,
+                                        highlight=self.__highlight, hydrometers=self.__hydrometers,
+                                        customers_path=self.__customers_path, direction=self.__direction,
+                                        sources=self.__sources)
+
+        # Mesmas redes (ou redes da mesma zona) já traçadas desde a última edição: resultado imediato
+        if tracing_task.run_cached():
+            tracing_task.finished(True)
+            return
+
+        # Topologia e índices são preparados em uma tarefa própria (ou já estão prontos): a interface não trava
+        preparation = prepare_network(self.__tm, self.__pipelines, self.__valves)
+        if preparation is not None and self._parent is not None:
+            preparation.progressChanged.connect(
+                lambda progress: self._parent.set_status_msg(f'Preparando a rede... {progress:.0f}%'))
+
+        # Clientes afetados: o tracing espera a tabela rede -> hidrômetros (montada em paralelo com a preparação)
+        add_after_preparation(self.__tm, tracing_task, preparation, self.build_hydrometer_table())
+
+        # Calcula os segmentos de isolamento em segundo plano para os próximos tracings
+        self.build_isolation_segments()
+
+    def start_break(self, point, search_distance):
+        """Isolamento a partir do ponto de rompimento (QgsPointXY no SRC da camada de redes)"""
+        break_task = BreakTracing(self.__pipelines, self.__valves, point, search_distance=search_distance,
+                                  parent=self._parent)
+        preparation = prepare_network(self.__tm, self.__pipelines, self.__valves)
+        if preparation is not None and self._parent is not None:
+            preparation.progressChanged.connect(
+                lambda progress: self._parent.set_status_msg(f'Preparando a rede... {progress:.0f}%'))
+        add_after_preparation(self.__tm, break_task, preparation)
+
+    def build_isolation_segments(self, user_distance=0.001):
+        """Segmentos em segundo plano: a tarefa já em andamento para as camadas ou uma nova (None se prontos)"""
+        key = ('segments', self.__pipelines.id(), self.__valves.id(), user_distance)
+        segments_task = _running.get(key)
+        if segments_task is not None:
+            return segments_task
+        if cached_isolation_segments(self.__pipelines, self.__valves, user_distance) is not None:
+            return None
+
+        segments_task = BuildIsolationSegments(self.__pipelines, self.__valves, user_distance=user_distance)
+        _track(key, segments_task)
+        add_after_preparation(self.__tm, segments_task,
+                              prepare_network(self.__tm, self.__pipelines, self.__valves, user_distance))
+        return segments_task
+
+    def build_hydrometer_table(self):
+        """Tabela rede -> hidrômetros em segundo plano: a tarefa já em andamento ou uma nova (None se pronta)"""
+        if self.__hydrometers is None:
+            return None
+        key = ('hydrometers', self.__pipelines.id(), self.__hydrometers.id(), HD_MAX_DISTANCE)
+        table_task = _running.get(key)
+        if table_task is not None:
+            return table_task
+        if cached_hydrometer_table(self.__pipelines, self.__hydrometers) is not None:
+            return None
+
+        table_task = BuildHydrometerTable(self.__pipelines, self.__hydrometers)
+        _track(key, table_task)
+        self.__tm.addTask(table_task)
+        return table_task
 
     def select_hidrometers(self):
-        pipes_selecteds = [x for x in self.__pipelines[0].getSelectedFeatures()]
+        # Somente a geometria das redes selecionadas, lida aos poucos dentro da tarefa
+        pipes_selecteds = iter_features(self.__pipelines, fids=self.__pipelines.selectedFeatureIds())
         find_hidrometers = FindPoints(pipes_selecteds)
-        self.__tm.addTask(find_hidrometers)
+        preparation = prepare_network(self.__tm, self.__pipelines, self.__valves,
+                                      hydrometers=find_hidrometers.hds_feature)
+        add_after_preparation(self.__tm, find_hidrometers, preparation)
@@ -0,0 +1,593 @@
+"""
+Núcleo do tracing sem dependência do QGIS: a rede é representada por arrays numpy
+e o percurso é feito em memória, em uma única thread.
+As camadas do QGIS só são lidas pelos adaptadores (core.network_topology: load_network/load_attributes);
+NetworkTopology e NetworkAttributes podem ser enviados para processos filhos (pickle).
+"""
+import math
+
+import numpy as np
+
+# Situação de um registro para o tracing
+VALVE_OPEN = 0  # visível e aberto: fechar este registro isola o trecho
+VALVE_CLOSED = 1  # já fechado: o tracing para nele
+VALVE_NOT_VISIBLE = 2  # não visível ou sem status: o tracing passa por ele
+
+
+# node_valve de um nó sem registro (feições novas, ainda não salvas, têm ids negativos)
+NO_VALVE = -2 ** 63
+
+
+class NetworkTopology:
+    """
+    Grafo da rede de água: as extremidades das redes são ligadas a nós e cada nó conhece
+    as redes que chegam nele (formato CSR: node_pipe_ptr/node_pipe_idx) e o registro que está sobre ele.
+    Os índices internos das redes são posições em pipe_ids (ids das feições).
+    Redes removidas por edição continuam ocupando a posição, com pipe_nodes = (-1, -1).
+    """
+
+    def __init__(self, pipe_ids, pipe_nodes, node_xy, node_pipe_ptr, node_pipe_idx, node_valve, snapper=None):
+        self.pipe_ids = pipe_ids  # int64 (n_pipes,)
+        self.pipe_nodes = pipe_nodes  # int32 (n_pipes, 2) -> nó inicial e nó final
+        self.node_xy = node_xy  # float64 (n_nodes, 2)
+        self.node_pipe_ptr = node_pipe_ptr  # int32 (n_nodes + 1,)
+        self.node_pipe_idx = node_pipe_idx  # int32 -> redes de cada nó
+        self.node_valve = node_valve  # int64 (n_nodes,) -> id do registro ou NO_VALVE
+        self.snapper = snapper  # NodeSnapper usado na montagem (necessário para editar)
+
+        alive = np.nonzero(pipe_nodes[:, 0] >= 0)[0]
+        self.pipe_index = dict(zip(pipe_ids[alive].tolist(), alive.tolist()))
+        self._lists = None
+
+    @classmethod
+    def from_edges(cls, pipe_ids, pipe_nodes, node_xy, node_valve=None):
+        """
+        Topologia a partir das extremidades de cada rede (cada nó lista as redes que terminam nele).
+        :param node_valve: id do registro de cada nó (NO_VALVE = sem registro); None = nenhum registro
+        """
+        pipe_nodes = np.asarray(pipe_nodes, dtype=np.int32).reshape(-1, 2)
+        node_xy = np.asarray(node_xy, dtype=np.float64).reshape(-1, 2)
+        ends = pipe_nodes.ravel()
+        alive = ends >= 0
+        order = np.argsort(ends[alive], kind='stable')
+        counts = np.bincount(ends[alive], minlength=len(node_xy))
+        if node_valve is None:
+            node_valve = np.full(len(node_xy), NO_VALVE, dtype=np.int64)
+        return cls(pipe_ids=np.asarray(pipe_ids, dtype=np.int64),
+                   pipe_nodes=pipe_nodes,
+                   node_xy=node_xy,
+                   node_pipe_ptr=np.concatenate([[0], np.cumsum(counts)]).astype(np.int32),
+                   node_pipe_idx=(np.nonzero(alive)[0][order] // 2).astype(np.int32),
+                   node_valve=np.asarray(node_valve, dtype=np.int64))
+
+    def __getstate__(self):
+        # As listas são recriadas sob demanda (pickle menor para os processos filhos)
+        state = dict(self.__dict__)
+        state['_lists'] = None
+        return state
+
+    @property
+    def n_pipes(self):
+        return len(self.pipe_ids)
+
+    @property
+    def n_nodes(self):
+        return len(self.node_xy)
+
+    def pipes_at(self, node):
+        return self.node_pipe_idx[self.node_pipe_ptr[node]:self.node_pipe_ptr[node + 1]]
+
+    def valve_at(self, node):
+        valve_id = int(self.node_valve[node])
+        return valve_id if valve_id != NO_VALVE else None
+
+    def is_alive(self, pipe_index):
+        return self.pipe_nodes[pipe_index][0] >= 0
+
+    def lists(self):
+        """
+        Os mesmos arrays convertidos para listas Python (criadas uma vez por topologia).
+        Indexar listas é bem mais rápido que indexar arrays numpy elemento a elemento.
+        """
+        if self._lists is None:
+            ptr = self.node_pipe_ptr.tolist()
+            idx = self.node_pipe_idx.tolist()
+            self._lists = (self.pipe_ids.tolist(),
+                           self.pipe_nodes.tolist(),
+                           [idx[ptr[node]:ptr[node + 1]] for node in range(self.n_nodes)],
+                           self.node_valve.tolist())
+        return self._lists
+
+    def nodes_touching(self, pipe_index):
+        """Nós nas extremidades da rede e nós que listam a rede entre as suas"""
+        positions = np.nonzero(self.node_pipe_idx == pipe_index)[0]
+        nodes = set((np.searchsorted(self.node_pipe_ptr, positions, side='right') - 1).tolist())
+        nodes.update(node for node in self.pipe_nodes[pipe_index].tolist() if node >= 0)
+        return nodes
+
+    def nodes_with_valve(self, valve_id):
+        return set(np.nonzero(self.node_valve == valve_id)[0].tolist())
+
+    def nodes_in_box(self, xmin, ymin, xmax, ymax):
+        x = self.node_xy[:, 0]
+        y = self.node_xy[:, 1]
+        return set(np.nonzero((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))[0].tolist())
+
+    def copy(self):
+        """
+        Cópia editável (set_pipe, remove_pipe, set_node_pipes, set_node_valve e depois commit).
+        Quem já usa esta topologia, por exemplo um tracing em andamento, continua com a versão antiga.
+        """
+        pipe_ids, pipe_nodes, node_pipes, node_valve = self.lists()
+        clone = NetworkTopology.__new__(NetworkTopology)
+        clone.snapper = self.snapper.copy() if self.snapper is not None else None
+        clone.node_xy = self.node_xy
+        clone.pipe_index = dict(self.pipe_index)
+        clone._lists = (list(pipe_ids), list(pipe_nodes), list(node_pipes), list(node_valve))
+        clone.commit()
+        return clone
+
+    def set_pipe(self, fid, first, last):
+        """Cria ou move a rede fid; retorna (índice da rede, nós das extremidades)"""
+        pipe_ids, pipe_nodes, node_pipes, node_valve = self._lists
+        n1 = self.__snap(*first)
+        n2 = self.__snap(*last)
+
+        index = self.pipe_index.get(fid)
+        if index is None:
+            index = len(pipe_ids)
+            pipe_ids.append(fid)
+            pipe_nodes.append([n1, n2])
+            self.pipe_index[fid] = index
+        else:
+            pipe_nodes[index] = [n1, n2]
+        return index, (n1, n2)
+
+    def remove_pipe(self, fid):
+        """Remove a rede fid; retorna o índice que ela ocupava ou None"""
+        index = self.pipe_index.pop(fid, None)
+        if index is not None:
+            self._lists[1][index] = [-1, -1]
+        return index
+
+    def set_node_pipes(self, node, pipe_indices):
+        self._lists[2][node] = list(pipe_indices)
+
+    def set_node_valve(self, node, valve_id):
+        self._lists[3][node] = NO_VALVE if valve_id is None else valve_id
+
+    def commit(self):
+        """Atualiza os arrays a partir das listas editadas"""
+        pipe_ids, pipe_nodes, node_pipes, node_valve = self._lists
+        self.pipe_ids = np.array(pipe_ids, dtype=np.int64)
+        self.pipe_nodes = np.array(pipe_nodes, dtype=np.int32).reshape(-1, 2)
+        if self.snapper is not None:
+            self.node_xy = np.array(self.snapper.points, dtype=np.float64).reshape(-1, 2)
+        self.node_pipe_ptr = np.zeros(len(node_pipes) + 1, dtype=np.int32)
+        self.node_pipe_ptr[1:] = np.cumsum([len(pipes) for pipes in node_pipes])
+        self.node_pipe_idx = np.fromiter((p for pipes in node_pipes for p in pipes), dtype=np.int32,
+                                         count=int(self.node_pipe_ptr[-1]))
+        self.node_valve = np.array(node_valve, dtype=np.int64)
+
+    def __snap(self, x, y):
+        node = self.snapper.snap(x, y)
+        if node == len(self._lists[2]):
+            self._lists[2].append([])
+            self._lists[3].append(NO_VALVE)
+        return node
+
+
+class NodeSnapper:
+    """Agrupa pontos a menos de 'tolerance' entre si em um mesmo nó, usando uma grade de células do tamanho da tolerância"""
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.points = []
+        self._grid = {}
+
+    @classmethod
+    def from_points(cls, tolerance, points):
+        """Snapper com os nós de uma topologia já montada (ex.: lida da cópia em disco)"""
+        snapper = cls(tolerance)
+        snapper.points = [(x, y) for x, y in points]
+        for node, (x, y) in enumerate(snapper.points):
+            key = (int(math.floor(x / tolerance)), int(math.floor(y / tolerance)))
+            snapper._grid.setdefault(key, []).append(node)
+        return snapper
+
+    def copy(self):
+        clone = NodeSnapper(self.tolerance)
+        clone.points = list(self.points)
+        clone._grid = dict(self._grid)
+        return clone
+
+    def near(self, x, y):
+        """Nós a menos de 'tolerance' do ponto"""
+        cx = int(math.floor(x / self.tolerance))
+        cy = int(math.floor(y / self.tolerance))
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for node in self._grid.get((cx + dx, cy + dy), ()):
+                    nx, ny = self.points[node]
+                    if (nx - x) ** 2 + (ny - y) ** 2 <= self.tolerance ** 2:
+                        yield node
+
+    def snap(self, x, y):
+        for node in self.near(x, y):
+            return node
+
+        node = len(self.points)
+        self.points.append((x, y))
+        key = (int(math.floor(x / self.tolerance)), int(math.floor(y / self.tolerance)))
+        # Nova lista em vez de append: cópias do snapper compartilham as listas das células
+        self._grid[key] = self._grid.get(key, []) + [node]
+        return node
+
+
+class TraceResult:
+    """Resultado de um tracing (ids das feições)"""
+
+    def __init__(self):
+        self.valves = set()
+        self.valves_closed = set()
+        self.valves_not_visible = set()
+        self.pipelines = set()
+        self.pipe_indices = []
+        self.iterations = 0
+        self.layers = 0  # camadas da busca em largura
+        self.max_frontier = 0  # maior quantidade de redes em uma mesma camada
+        # True quando cada rede da zona também alcança a semente: qualquer rede da zona gera o mesmo resultado
+        self.reversible = True
+
+
+def classify_valve(visivel, status):
+    # visivel = 'sim' = registro visível | visivel = 'não' = registro não visível
+    # status_operacao = 0 = 'Aberto' | status = 1 = 'Fechado'
+    status = str(status)
+    if str(visivel).upper() != 'NÃO' and status == '0':
+        return VALVE_OPEN
+    elif status == '1':
+        return VALVE_CLOSED
+    return VALVE_NOT_VISIBLE
+
+
+def is_downstream(origin_diameter, destination_diameter):
+    if origin_diameter > 100:
+        if destination_diameter <= 75:
+            return True
+        elif origin_diameter >= destination_diameter:
+            return False
+
+    if origin_diameter > destination_diameter:
+        return True
+    return False
+
+
+def _has_diameter(value):
+    return isinstance(value, (int, float)) and not (isinstance(value, float) and math.isnan(value))
+
+
+def can_flow(origin_diameter, destination_diameter):
+    """Regra de is_downstream entre duas redes; sem diâmetro conhecido a passagem é livre"""
+    if not _has_diameter(origin_diameter) or not _has_diameter(destination_diameter):
+        return True
+    return not is_downstream(origin_diameter, destination_diameter)
+
+
+class NetworkAttributes:
+    """
+    Atributos usados pelo tracing em arrays simples: diâmetro de cada rede (NaN = desconhecido, na ordem
+    da topologia) e situação de cada registro (VALVE_OPEN/VALVE_CLOSED/VALVE_NOT_VISIBLE).
+    valve_state e diameter têm a mesma assinatura das funções de consulta do tracing e, ao contrário
+    delas, podem ser enviadas para outros processos (pickle).
+    """
+
+    def __init__(self, diameters, valve_ids, valve_states):
+        self.diameters = np.asarray(diameters, dtype=np.float64)
+        self.valve_ids = np.asarray(valve_ids, dtype=np.int64)
+        self.valve_states = np.asarray(valve_states, dtype=np.int8)
+        self._lookups = None
+
+    @classmethod
+    def from_valves(cls, diameters, valve_ids, visivel, status):
+        """Situação dos registros a partir dos campos visivel e status_operacao"""
+        return cls(diameters, valve_ids, [classify_valve(v, s) for v, s in zip(visivel, status)])
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_lookups'] = None
+        return state
+
+    def __lookups(self):
+        if self._lookups is None:
+            self._lookups = (self.diameters.tolist(),
+                             dict(zip(self.valve_ids.tolist(), self.valve_states.tolist())))
+        return self._lookups
+
+    def diameter(self, pipe_index):
+        return self.__lookups()[0][pipe_index]
+
+    def valve_state(self, valve_id):
+        return self.__lookups()[1].get(valve_id, VALVE_NOT_VISIBLE)
+
+
+def trace(topology, seed_index, valve_state, diameter, is_canceled=None, known_zones=None, visited=None):
+    """
+    Percorre a rede a partir da rede seed_index (índice na topologia) em largura, por camadas (frontier).
+    Um registro aberto e visível ou já fechado interrompe o percurso no nó; nos demais casos o percurso
+    segue para as redes do nó, exceto as que is_downstream indicar a partir da rede de origem.
+    :param valve_state: função id do registro -> VALVE_OPEN | VALVE_CLOSED | VALVE_NOT_VISIBLE
+    :param diameter: função índice da rede -> diâmetro nominal (None quando desconhecido)
+    :param is_canceled: função consultada a cada camada; se retornar True o tracing é interrompido
+    :param known_zones: índice da rede -> TraceResult reversível já calculado; ao alcançar uma dessas
+        redes o resultado é incorporado inteiro, sem percorrer a zona de novo
+    :param visited: bytearray zerado de tamanho n_pipes para reaproveitar entre chamadas;
+        é devolvido zerado ao final
+    :return: TraceResult ou None se cancelado
+    """
+    if visited is None:
+        visited = bytearray(topology.n_pipes)
+    reached = [seed_index]
+    try:
+        return _trace(topology, seed_index, valve_state, diameter, is_canceled, known_zones, visited, reached)
+    finally:
+        for index in reached:
+            visited[index] = 0
+
+
+def _trace(topology, seed_index, valve_state, diameter, is_canceled, known_zones, visited, reached):
+    pipe_ids, pipe_nodes, node_pipes, node_valve = topology.lists()
+    result = TraceResult()
+    visited[seed_index] = 1
+    frontier = [seed_index]
+
+    while frontier:
+        if is_canceled is not None and is_canceled():
+            return None
+
+        result.layers += 1
+        if len(frontier) > result.max_frontier:
+            result.max_frontier = len(frontier)
+        next_frontier = []
+        for pipe in frontier:
+            result.iterations += 1
+            origin_diameter = diameter(pipe)
+
+            for node in pipe_nodes[pipe]:
+                valve = node_valve[node]
+                if valve != NO_VALVE:
+                    state = valve_state(valve)
+                    if state == VALVE_OPEN:
+                        result.valves.add(valve)
+                        continue
+                    elif state == VALVE_CLOSED:
+                        result.valves_closed.add(valve)  # Registros já fechados
+                        continue
+                    result.valves_not_visible.add(valve)  # Registro não visível ou NULL
+
+                for neighbor in node_pipes[node]:
+                    if visited[neighbor]:
+                        continue
+                    neighbor_diameter = diameter(neighbor)
+                    if not can_flow(origin_diameter, neighbor_diameter):
+                        continue
+
+                    # A zona só é reversível se cada passo também puder ser feito no sentido contrário
+                    if result.reversible and (node not in pipe_nodes[neighbor]
+                                              or pipe not in node_pipes[node]
+                                              or not can_flow(neighbor_diameter, origin_diameter)):
+                        result.reversible = False
+
+                    zone = known_zones.get(neighbor) if known_zones else None
+                    if zone is not None:
+                        _merge_zone(result, zone, visited, reached)
+                        continue
+
+                    visited[neighbor] = 1
+                    next_frontier.append(neighbor)
+                    reached.append(neighbor)
+        frontier = next_frontier
+
+    result.pipe_indices = reached
+    result.pipelines = {pipe_ids[i] for i in reached}
+    return result
+
+
+def _merge_zone(result, zone, visited, reached):
+    # Tudo que a zona alcança também é alcançado a partir daqui
+    for index in zone.pipe_indices:
+        if not visited[index]:
+            visited[index] = 1
+            reached.append(index)
+    result.valves |= zone.valves
+    result.valves_closed |= zone.valves_closed
+    result.valves_not_visible |= zone.valves_not_visible
+    result.reversible = result.reversible and zone.reversible
+
+
+def trace_many(topology, seed_indices, valve_state, diameter, is_canceled=None):
+    """
+    Tracing de várias redes de uma vez. Zonas reversíveis são compartilhadas: uma semente que cai
+    dentro de uma zona já calculada reaproveita o resultado e um tracing que alcança uma zona
+    já calculada a incorpora sem percorrê-la. O custo acompanha a união das redes visitadas.
+    :return: dicionário índice da semente -> TraceResult (sementes da mesma zona compartilham o objeto)
+        ou None se cancelado
+    """
+    results = {}
+    zones = {}
+    visited = bytearray(topology.n_pipes)
+    for seed in seed_indices:
+        if seed in results:
+            continue
+
+        result = zones.get(seed)
+        if result is None:
+            result = trace(topology, seed, valve_state, diameter, is_canceled, known_zones=zones, visited=visited)
+            if result is None:
+                return None
+            if result.reversible:
+                for index in result.pipe_indices:
+                    zones[index] = result
+        results[seed] = result
+    return results
+
+
+class IsolationSegments:
+    """
+    Partição da rede em segmentos de isolamento: pipe_segment liga cada rede (índice na topologia)
+    ao seu segmento e segments guarda o TraceResult de cada segmento (redes e registros de contorno).
+    Redes de zonas não reversíveis ficam em um segmento próprio. Segmentos descartados por update() ficam None.
+    """
+
+    def __init__(self, topology, pipe_segment, segments):
+        self.topology = topology
+        self.pipe_segment = pipe_segment  # int32 (n_pipes,)
+        self.segments = segments
+
+    def __len__(self):
+        return sum(1 for result in self.segments if result is not None)
+
+    def segment_of(self, pipe_index):
+        return int(self.pipe_segment[pipe_index])
+
+    def result(self, pipe_index):
+        segment = self.pipe_segment[pipe_index]
+        return self.segments[segment] if segment >= 0 else None
+
+    def results(self, pipe_indices, valve_state, diameter, is_canceled=None):
+        """
+        Resultado de cada rede pela tabela; redes sem segmento (descartado por update) são percorridas com trace_many.
+        :return: dicionário índice da rede -> TraceResult ou None se cancelado
+        """
+        results = {index: self.result(index) for index in pipe_indices}
+        missing = [index for index, result in results.items() if result is None]
+        if missing:
+            traced = trace_many(self.topology, missing, valve_state, diameter, is_canceled=is_canceled)
+            if traced is None:
+                return None
+            results.update(traced)
+        return results
+
+    def boundary_valves(self, segment):
+        return self.segments[segment].valves
+
+    def report(self):
+        """Linhas (segmento, redes, registros a fechar, registros fechados) para relatórios de criticidade"""
+        for segment, result in enumerate(self.segments):
+            if result is not None:
+                yield segment, len(result.pipelines), len(result.valves), len(result.valves_closed)
+
+    def update(self, topology, valve_state, diameter, nodes=(), pipes=()):
+        """
+        Nova partição para a topologia editada recalculando somente os segmentos afetados:
+        os que têm redes com extremidade em um dos nós alterados ou que contêm as redes alteradas.
+        Os segmentos não afetados são reaproveitados (e incorporados inteiros pelos novos tracings).
+        :param nodes: nós cujas redes ou registro mudaram
+        :param pipes: índices das redes criadas, movidas, removidas ou com diâmetro alterado
+        """
+        pipe_segment = np.full(topology.n_pipes, -1, dtype=np.int32)
+        pipe_segment[:len(self.pipe_segment)] = self.pipe_segment
+        segments = list(self.segments)
+
+        affected = set(pipes)
+        if nodes:
+            touching = np.isin(topology.pipe_nodes, np.fromiter(nodes, dtype=np.int32)).any(axis=1)
+            affected.update(np.nonzero(touching)[0].tolist())
+
+        stale = {int(pipe_segment[pipe]) for pipe in affected if pipe_segment[pipe] >= 0}
+        # Segmentos não reversíveis podem alcançar redes atribuídas a outros segmentos
+        for segment, result in enumerate(segments):
+            if result is not None and not result.reversible and not affected.isdisjoint(result.pipe_indices):
+                stale.add(segment)
+
+        pending = {pipe for pipe in affected if pipe < topology.n_pipes}
+        for segment in stale:
+            result = segments[segment]
+            if result.reversible:
+                pending.update(result.pipe_indices)
+            else:
+                pending.add(result.pipe_indices[0])  # Somente a semente pertence ao segmento
+            segments[segment] = None
+        pending = sorted(pending)
+        pipe_segment[pending] = -1
+        pending = [pipe for pipe in pending if topology.is_alive(pipe)]
+
+        _partition(topology, pending, pipe_segment, segments, valve_state, diameter,
+                   known_zones=_SegmentZones(pipe_segment, segments))
+        return IsolationSegments(topology, pipe_segment, segments)
+
+
+class _SegmentZones:
+    """known_zones de trace() a partir de uma partição: somente segmentos reversíveis"""
+
+    def __init__(self, pipe_segment, segments):
+        self.pipe_segment = pipe_segment
+        self.segments = segments
+
+    def get(self, pipe_index):
+        segment = self.pipe_segment[pipe_index]
+        if segment < 0:
+            return None
+        result = self.segments[segment]
+        return result if result is not None and result.reversible else None
+
+
+def _partition(topology, pipes, pipe_segment, segments, valve_state, diameter, known_zones,
+               is_canceled=None, progress=None):
+    visited = bytearray(topology.n_pipes)
+    total = max(len(pipes), 1)
+    assigned = 0
+    last_percent = -1
+
+    for pipe in pipes:
+        if pipe_segment[pipe] >= 0:
+            continue
+
+        result = trace(topology, pipe, valve_state, diameter, is_canceled, known_zones=known_zones, visited=visited)
+        if result is None:
+            return False
+
+        segment = len(segments)
+        segments.append(result)
+        if result.reversible:
+            pipe_segment[result.pipe_indices] = segment
+            assigned += len(result.pipe_indices)
+        else:
+            pipe_segment[pipe] = segment
+            assigned += 1
+
+        percent = 100 * assigned // total
+        if progress is not None and percent != last_percent:
+            last_percent = percent
+            progress(percent)
+    return True
+
+
+def partition_pipes(topology, pipes, valve_state, diameter, is_canceled=None):
+    """
+    Zonas (TraceResult) das redes 'pipes', com as mesmas regras de build_segments, mas sem
+    particionar o restante da rede: redes de uma zona reversível já calculada não são percorridas de novo.
+    :return: (pipe_segment (n_pipes,) com -1 nas redes sem zona, lista de TraceResult) ou None se cancelado
+    """
+    pipe_segment = np.full(topology.n_pipes, -1, dtype=np.int32)
+    segments = []
+    if not _partition(topology, pipes, pipe_segment, segments, valve_state, diameter,
+                      known_zones=_SegmentZones(pipe_segment, segments), is_canceled=is_canceled):
+        return None
+    return pipe_segment, segments
+
+
+def build_segments(topology, valve_state, diameter, is_canceled=None, progress=None):
+    """
+    Particiona toda a rede com as mesmas regras de trace().
+    :param progress: função chamada com o percentual (0-100) de redes já atribuídas
+    :return: IsolationSegments ou None se cancelado
+    """
+    pipe_segment = np.full(topology.n_pipes, -1, dtype=np.int32)
+    segments = []
+    pipes = [pipe for pipe in range(topology.n_pipes) if topology.is_alive(pipe)]
+    if not _partition(topology, pipes, pipe_segment, segments, valve_state, diameter,
+                      known_zones=_SegmentZones(pipe_segment, segments),
+                      is_canceled=is_canceled, progress=progress):
+        return None
+    return IsolationSegments(topology, pipe_segment, segments)
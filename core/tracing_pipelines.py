@@ -1,22 +1,43 @@
-from collections import deque
-
 from qgis._core import QgsVectorLayer
 from qgis.core import (QgsTask,
                               QgsMessageLog,
                               Qgis,
-                              QgsSpatialIndex,
-                              QgsPointXY,
                               QgsProject, QgsApplication)
 
+from core.attribute_cache import get_attribute_table
+from core.flow_direction import TRACE_MODE_NAMES, trace_directed_many
+from core.hydrometer_table import cached_hydrometer_table, export_hydrometers
+from core.instrumentation import DEBUG, INFO, WARNING, Instrumentation
+from core.isolation_segments import cached_isolation_segments, get_flow_direction
+from core.network_topology import VALVE_FIELDS, get_lookups, get_topology
+from core.result_cache import get_trace_results
+from core.result_highlight import clear_highlight, highlight_valves
+from core.tracing_engine import trace_many
+
 import global_vars
-import threading
 
 
 class TracingPipelines(QgsTask):
     def __init__(self, pipelines, valves, description='TracingCAJ', user_distance=0.001, onfinish=None, debug=False,
-                 parent=None):
+                 parent=None, log_level=None, profile_path=None, highlight=False, hydrometers=None,
+                 customers_path=None, direction=None, sources=None):
         super().__init__(description, QgsTask.CanCancel)
 
+        # Contadores e tempos por fase, registrados uma única vez no fim (e em JSON se profile_path for informado)
+        self.instrumentation = Instrumentation(description, DEBUG if debug else log_level)
+        self.__profile_path = profile_path
+        self.__highlight = highlight
+
+        # Clientes afetados pela tabela rede -> hidrômetros (se já montada) e lista opcional em CSV
+        self.__hydrometers = hydrometers
+        self.__customers_path = customers_path
+        self.hydrometers_affected = None
+        self.__hydrometer_table = None
+
+        # Tracing dirigido (flow_direction.UPSTREAM/DOWNSTREAM/BOTH) pelo sentido calculado a partir das fontes
+        self.__sources = sources
+        self.__direction = direction if sources is not None else None
+
         self.onfinish = onfinish
         self.debug = debug
         self.__user_distance = user_distance
@@ -25,89 +46,186 @@ class TracingPipelines(QgsTask):
         self.__list_valves = set()
         self.__list_valves_not_visible = set()
         self.__list_valves_closed = set()
-        self.__list_visited_pipelines = set()
         self.__list_visited_pipelines_ids = set()
-        self.__q_list_pipelines = deque()
-        self.__q_list_pipelines_ids = deque()
         self.__iterations = 0
         self.__exception = None
+        self.__warning = None  # motivo quando o tracing não pôde ser feito (sem ser cancelamento)
+        self.results = {}
 
         # Callbackmsg
         self._parent = parent
 
-        # Cria os índices espaciais
-        self.__idx_pipelines = None
-        self.__idx_valves = None
-        if self.__idx_valves is None or self.__idx_pipelines is None:
-            self.__create_spatial_index()
+        # Resultados anteriores das mesmas camadas (descartados a cada edição)
+        self.__cache = get_trace_results(pipelines, valves, user_distance)
+
+        # Topologia e atributos são carregados em run (já prontos se a tarefa PrepareNetwork rodou antes)
+        self.__segments = None
+        self.__topology = None
+        self.__valve_state = None
+        self.__diameter = None
+        self.__valves_table = None
 
         self.iface = None
         if self.iface is None:
             self.iface = global_vars.iface
 
+    def __prepare(self):
+        with self.instrumentation.phase('index_build'):
+            # Segmentos de isolamento já calculados em segundo plano (se houver) tornam o tracing uma consulta
+            # (somente no tracing normal; o dirigido percorre a rede orientada)
+            if self.__direction is None:
+                self.__segments = cached_isolation_segments(self._pipelines_features, self._valves_features,
+                                                            self.__user_distance)
+
+            # Topologia da rede (em cache enquanto as camadas não forem alteradas)
+            if self.__segments is not None:
+                self.__topology = self.__segments.topology
+            else:
+                self.__topology = get_topology(self._pipelines_features, self._valves_features,
+                                               self.__user_distance, self.instrumentation)
+
+            # Atributos usados no tracing, carregados uma única vez por camada
+            self.__valve_state, self.__diameter = get_lookups(self._pipelines_features, self._valves_features,
+                                                              self.__topology)
+            self.__valves_table = get_attribute_table(self._valves_features, VALVE_FIELDS)
+
+    def run_cached(self):
+        """
+        Usa somente os resultados em cache, sem tarefa nem percurso (na thread da interface).
+        :return: True se todas as redes selecionadas já tinham resultado; depois basta chamar finished(True)
+        """
+        if self.__direction is not None:
+            return False
+        # Clientes afetados ainda sem tabela: a tarefa espera a montagem
+        if self.__hydrometers is not None and cached_hydrometer_table(self._pipelines_features,
+                                                                      self.__hydrometers) is None:
+            return False
+        selected_ids = self._pipelines_features.selectedFeatureIds()
+        results = {fid: self.__cache.get(fid) for fid in selected_ids}
+        if not results or any(result is None for result in results.values()):
+            return False
+
+        self.__valves_table = get_attribute_table(self._valves_features, VALVE_FIELDS)
+        self.instrumentation.count('seeds', len(results))
+        self.instrumentation.count('cache_hits', len(results))
+        self.__collect(results)
+        self.__affected_customers()
+        return True
+
     def run(self):
-        print('RUN TracingPipelines: ', self.description())
-        QgsMessageLog.logMessage(f'Started task {self.description()}',
-                                 'TracingCAJ', Qgis.Info)
+        self.instrumentation.log(DEBUG, f'Started task {self.description()}')
 
-        # Busca por redes selecionadas (necessário ser apenas uma)
+        # Busca por redes selecionadas (uma ou várias sementes)
         if self.debug:
             self._pipelines_features.selectByIds([13853])
             # self._pipelines_features.getFeatures(16)
 
-        selected_pipeline = self._pipelines_features.selectedFeatures()
-        print(selected_pipeline)
+        selected_ids = self._pipelines_features.selectedFeatureIds()
 
-        if len(selected_pipeline) != 1:
-            QgsMessageLog.logMessage('Selecione apenas UMA rede', 'TracingCAJ', Qgis.Info)
+        if len(selected_ids) == 0:
+            self.__warning = 'Selecione ao menos uma rede'
             return False
-        else:
-
-            self.__q_list_pipelines.append(selected_pipeline[0].geometry())
-            self.__q_list_pipelines_ids.append(selected_pipeline[0].id())
-
-            while len(self.__q_list_pipelines) > 0:
-                self.__iterations += 1
-                QgsMessageLog.logMessage(f'Iteration {self.__iterations}', 'TracingCAJ', Qgis.Info)
-
-                # check isCanceled() to handle cancellation
-                if self.isCanceled():
-                    return False
-
-                pipeline = self.__q_list_pipelines.pop()
-                pipeline_id = self.__q_list_pipelines_ids.pop()
 
-                if pipeline_id not in self.__list_visited_pipelines_ids:
-                    self.__list_visited_pipelines.add(pipeline)
-                    self.__list_visited_pipelines_ids.add(pipeline_id)
-
-                    QgsMessageLog.logMessage(f'|-> Analisando Pipeline {pipeline_id}', 'TracingCAJ', Qgis.Info)
-
-                    v1 = pipeline.vertexAt(0)
-                    if self.debug:
-                        v2 = pipeline.vertexAt(pipeline.get()[0].childCount() - 1)
-                    else:
-                        v2 = pipeline.vertexAt(len(pipeline.get()) - 1)
+        try:
+            self.__prepare()
+        except Exception as e:
+            self.__exception = e
+            return False
 
-                    try:
-                        # Cria uma nova thread para cada pipeline
+        # Redes com resultado em cache não são percorridas de novo (o cache guarda somente o tracing normal)
+        cached = {}
+        seeds = {}
+        for fid in selected_ids:
+            result = self.__cache.get(fid) if self.__direction is None else None
+            if result is not None:
+                cached[fid] = result
+                continue
+            seed_index = self.__topology.pipe_index.get(fid)
+            if seed_index is None:
+                self.instrumentation.count('seeds_without_geometry')
+                self.instrumentation.log(DEBUG, lambda: f'Rede {fid} sem geometria')
+                continue
+            seeds[seed_index] = fid
+
+        if not seeds and not cached:
+            self.__warning = 'Nenhuma rede selecionada com geometria'
+            return False
 
-                        thread1 = threading.Thread(target=self.__find_neighbors, args=(v1, pipeline_id))
-                        thread2 = threading.Thread(target=self.__find_neighbors, args=(v2, pipeline_id))
+        self.instrumentation.count('seeds', len(seeds) + len(cached))
+        self.instrumentation.count('cache_hits', len(cached))
+        try:
+            with self.instrumentation.phase('traversal'):
+                if self.__direction is not None:
+                    results = self.__trace_directed(list(seeds))
+                elif self.__segments is not None:
+                    self.instrumentation.count('segment_lookups', len(seeds))
+                    results = self.__segments.results(list(seeds), self.__valve_state, self.__diameter,
+                                                      is_canceled=self.isCanceled)
+                else:
+                    results = trace_many(self.__topology, list(seeds),
+                                         valve_state=self.__valve_state,
+                                         diameter=self.__diameter,
+                                         is_canceled=self.isCanceled)
+        except Exception as e:
+            self.__exception = e
+            return False
 
-                        # Inicia as threads
-                        thread1.start()
-                        thread2.start()
+        if results is None:
+            return False
 
-                        # Aguarda as threads concluírem
-                        thread1.join()
-                        thread2.join()
-                    except Exception as e:
-                        print(e)
-                        self.__exception = e
-                        return False
+        if self.__direction is None:
+            for seed_index, result in results.items():
+                self.__cache.put(seeds[seed_index], result)
+
+        # Resultado de cada semente (redes da mesma zona compartilham o resultado)
+        results = {seeds[seed_index]: result for seed_index, result in results.items()}
+        results.update(cached)
+        self.__collect(results)
+        try:
+            self.__affected_customers()
+        except Exception as e:
+            self.__exception = e
+            return False
         return True
 
+    def __trace_directed(self, seed_indices):
+        # Orientação da rede calculada uma vez por conjunto de camadas (em cache até a próxima edição)
+        flow = get_flow_direction(self._pipelines_features, self._valves_features, self.__sources,
+                                  self.__user_distance, is_canceled=self.isCanceled)
+        if flow is None:
+            return None
+        self.instrumentation.count('unoriented_pipes', flow.n_unoriented)
+        return trace_directed_many(flow, seed_indices, self.__direction, is_canceled=self.isCanceled)
+
+    def __affected_customers(self):
+        if self.__hydrometers is None:
+            return
+        table = cached_hydrometer_table(self._pipelines_features, self.__hydrometers)
+        if table is None:
+            # Tabela descartada por uma edição durante o tracing ou montagem com erro
+            self.instrumentation.log(WARNING, 'Tabela rede -> hidrômetros não disponível: clientes não calculados')
+            return
+
+        self.__hydrometer_table = table
+        self.hydrometers_affected = table.hydrometers_of(self.__list_visited_pipelines_ids)
+        self.instrumentation.count('hydrometers', len(self.hydrometers_affected))
+        if self.__customers_path:
+            with self.instrumentation.phase('customers_export'):
+                export_hydrometers(self.__hydrometers, self.hydrometers_affected, self.__customers_path,
+                                   self.__hydrometers.fields().names())
+
+    def __collect(self, results):
+        self.results = results
+        for result in {id(r): r for r in self.results.values()}.values():
+            self.__iterations += result.iterations
+            self.instrumentation.count('iterations', result.iterations)
+            self.instrumentation.count('layers', result.layers)
+            self.instrumentation.maximum('frontier', result.max_frontier)
+            self.__list_valves |= result.valves
+            self.__list_valves_closed |= result.valves_closed
+            self.__list_valves_not_visible |= result.valves_not_visible
+            self.__list_visited_pipelines_ids |= result.pipelines
+
     def finished(self, result):
         # Ativa novamente o botão
 
@@ -115,135 +233,105 @@ class TracingPipelines(QgsTask):
             self._parent.set_enable_button_iniciar()
 
         if result:
-            # Seleciona os registros não visiveis
-            self._valves_features.selectByIds(list(self.__list_valves_not_visible))
-            names_valves_not_visible = [feat['codigo'] for feat in self._valves_features.selectedFeatures()]
-
-            # Seleciona os registros não visiveis
-            self._valves_features.selectByIds(list(self.__list_valves_closed))
-            names_valves_closed = [feat['codigo'] for feat in self._valves_features.selectedFeatures()]
-
-            # Seleciona os registros visiveis
-            self._valves_features.selectByIds(list(self.__list_valves))
-            names_valves = [feat['codigo'] for feat in self._valves_features.selectedFeatures()]
-
-            self._pipelines_features.selectByIds(list(self.__list_visited_pipelines_ids))
+            with self.instrumentation.phase('selection'):
+                # Códigos lidos da tabela de atributos em cache, sem consultar a camada
+                names_valves_not_visible = self.__valve_names(self.__list_valves_not_visible)
+                names_valves_closed = self.__valve_names(self.__list_valves_closed)
+                names_valves = self.__valve_names(self.__list_valves)
+
+                # Uma única seleção por camada: registros a operar e redes afetadas
+                self._valves_features.selectByIds(list(self.__list_valves))
+                self._pipelines_features.selectByIds(list(self.__list_visited_pipelines_ids))
+
+                # Registros fechados e não visíveis só destacados no mapa (opcional)
+                if self.__highlight and self.iface is not None:
+                    highlight_valves(self.iface.mapCanvas(), self._valves_features,
+                                     {'valves_closed': self.__list_valves_closed,
+                                      'valves_not_visible': self.__list_valves_not_visible})
+                else:
+                    clear_highlight()
 
             if self.onfinish:
                 self.onfinish()
 
-            QgsMessageLog.logMessage(f"Task {self.description()} has been executed correctly\n"
-                                     f"Iterações: {self.__iterations}\n"
-                                     f"Registros: {names_valves}\n"
-                                     f"Registros fechados: {names_valves_closed}\n"
-                                     f"Registro não visíveis: {names_valves_not_visible}",
-                                     level=Qgis.Success)
-            # copy to clipboard
-            self.iface.messageBar().pushMessage(
-                'TracingCAJ',
-                f"Task {self.description()} has been executed correctly\n"
-                f"Copy to clipboard: {names_valves}",
-                level=Qgis.Success,
-                duration=10)
-
-            if self._parent:
-                self._parent.set_status_msg('Finalizado! registros no CTRL+V')
-
-            if self._parent:
-                self._parent.set_final_msg(f"Registros: {','.join(names_valves)}\n"
-                                           f"Registro fechados: {','.join(names_valves_closed)}\n"
-                                           f"Registro não visíveis: {','.join(names_valves_not_visible)}"
-                                           )
-
-            QgsApplication.clipboard().setText(','.join(names_valves))
+            with self.instrumentation.phase('ui_update'):
+                self.__update_ui(names_valves, names_valves_closed, names_valves_not_visible)
+            self.__report()
         else:
-            if self.__exception is None:
-                QgsMessageLog.logMessage(f"Tracing {self.description()} not successful "
-                                         f"but without exception "
-                                         f"(probably the task was manually canceled by the user)",
-                                         level=Qgis.Warning)
+            self.__report()
+            if self.__warning is not None:
+                self.instrumentation.log(WARNING, self.__warning)
+                if self._parent:
+                    self._parent.set_status_msg(self.__warning)
+            elif self.__exception is None:
+                self.instrumentation.log(WARNING, f"Tracing {self.description()} not successful "
+                                                  f"but without exception "
+                                                  f"(probably the task was manually canceled by the user)")
             else:
                 QgsMessageLog.logMessage(f"Task {self.description()}"
                                          f"Exception: {self.__exception}", level=Qgis.Critical)
                 raise self.__exception
 
+    def __update_ui(self, names_valves, names_valves_closed, names_valves_not_visible):
+        QgsMessageLog.logMessage(f"Task {self.description()} has been executed correctly\n"
+                                 f"Iterações: {self.__iterations}\n"
+                                 f"Registros: {names_valves}\n"
+                                 f"Registros fechados: {names_valves_closed}\n"
+                                 f"Registro não visíveis: {names_valves_not_visible}",
+                                 level=Qgis.Success)
+        # copy to clipboard
+        self.iface.messageBar().pushMessage(
+            'TracingCAJ',
+            f"Task {self.description()} has been executed correctly\n"
+            f"Copy to clipboard: {names_valves}",
+            level=Qgis.Success,
+            duration=10)
+
+        if self._parent:
+            self._parent.set_status_msg('Finalizado! registros no CTRL+V')
+
+        if self._parent:
+            msg = (f"Registros: {','.join(names_valves)}\n"
+                   f"Registro fechados: {','.join(names_valves_closed)}\n"
+                   f"Registro não visíveis: {','.join(names_valves_not_visible)}")
+            if self.hydrometers_affected is not None:
+                msg += f"\nHidrômetros afetados: {len(self.hydrometers_affected)}"
+            elif self.__hydrometers is not None:
+                msg += "\nHidrômetros afetados: não calculados"
+            if self.__direction is not None:
+                msg += f"\nSentido: {TRACE_MODE_NAMES[self.__direction]}"
+            if len(self.results) > 1:
+                msg += '\n' + self.__results_by_seed_msg()
+            self._parent.set_final_msg(msg)
+
+        QgsApplication.clipboard().setText(','.join(names_valves))
+
+    def __report(self):
+        self.instrumentation.log(INFO, self.instrumentation.summary)
+        if self.__profile_path:
+            try:
+                self.instrumentation.export_json(self.__profile_path)
+            except OSError as e:
+                self.instrumentation.log(WARNING, f'Não foi possível salvar o perfil em {self.__profile_path}: {e}')
+
     def cancel(self):
-        print(f'TracingTrask {self.description()} was canceled')
-        QgsMessageLog.logMessage(
-            f'TracingTrask {self.description()} was canceled', level=Qgis.Info)
+        self.instrumentation.log(INFO, f'TracingTrask {self.description()} was canceled')
         super().cancel()
 
-    def __create_spatial_index(self):
-        self.__idx_pipelines = QgsSpatialIndex(self._pipelines_features.getFeatures(),
-                                               flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
-        self.__idx_valves = QgsSpatialIndex(self._valves_features.getFeatures(),
-                                            flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
-
-    def __find_neighbors(self, point_vertex, pipeline_origin_id=None):
-        reg_isvisivel = None
-        reg_status = None
-
-        # Busca pelo registro mais próximo, dentro do raio maxDistance=user_distance
-        reg_nearest = self.__idx_valves.nearestNeighbor(point=QgsPointXY(point_vertex), neighbors=1,
-                                                        maxDistance=self.__user_distance)
-        QgsMessageLog.logMessage(f'|---> Valve Nearest: {reg_nearest}', 'TracingCAJ', Qgis.Info)
-        if len(reg_nearest) > 0:
-            _feature = list(self._valves_features.getFeatures(reg_nearest))[0]
-
-            QgsMessageLog.logMessage(f'|----> Vertex {point_vertex} is near valve {reg_nearest[0]}', 'TracingCAJ',
-                                     Qgis.Info)
-            # visivel = 'sim' = registro visível | visivel = 'não' = registro não visível
-            reg_isvisivel = str(_feature['visivel'])
-            # status_operacao = 0 = 'Aberto' | status = 1 = 'Fechado'
-            reg_status = str(_feature['status_operacao'])
-
-            QgsMessageLog.logMessage(
-                f'|----> Valve {reg_nearest[0]} | visivel is {reg_isvisivel} and status is {reg_status}', 'TracingCAJ',
-                Qgis.Info)
-
-            if reg_isvisivel.upper() != 'NÃO' and reg_status == '0':
-                self.__list_valves.add(reg_nearest[0])
-            elif reg_status == '1':
-                self.__list_valves_closed.add(reg_nearest[0])  # Registros já fechados
-            else:
-                self.__list_valves_not_visible.add(reg_nearest[0])  # Registro não visível ou NULL
-                self.__find_pipelines_neighbors(point_vertex, pipeline_origin_id)
-        else:
-            self.__find_pipelines_neighbors(point_vertex, pipeline_origin_id)
-
-    def __find_pipelines_neighbors(self, point_vertex, pipeline_origin_id):
-        QgsMessageLog.logMessage(f'|----> Vertexis not near any valve', 'TracingCAJ', Qgis.Info)
-        # Busca pelas 4 redes mais próximas no raio maxDistance=user_distance
-        pipelines_nearest = self.__idx_pipelines.nearestNeighbor(point=QgsPointXY(point_vertex), neighbors=4,
-                                                                 maxDistance=self.__user_distance)
-        if len(pipelines_nearest) > 0:
-            for pipeline_id in pipelines_nearest:
-                if pipeline_origin_id:
-
-                    origin_diameter = list(self._pipelines_features.getFeatures([pipeline_origin_id]))[0][
-                        'diametro_nominal']
-                    pipeline_diameter = list(self._pipelines_features.getFeatures([pipeline_id]))[0]['diametro_nominal']
-                    if is_downstream(origin_diameter, pipeline_diameter):
-                        continue
-                        # self.__list_visited_pipelines.append(self.__idx_pipelines.geometry(pipeline_id))
-                        # self.__list_visited_pipelines_ids.append(pipeline_id)
-
-                pipeline_geometry = self.__idx_pipelines.geometry(pipeline_id)
-                if pipeline_id not in self.__list_visited_pipelines_ids:
-                    self.__q_list_pipelines_ids.append(pipeline_id)
-                    self.__q_list_pipelines.append(pipeline_geometry)
-
-
-def is_downstream(origin_diameter, destination_diameter):
-    if origin_diameter > 100:
-        if destination_diameter <= 75:
-            return True
-        elif origin_diameter >= destination_diameter:
-            return False
-
-    if origin_diameter > destination_diameter:
-        return True
-    return False
+    def __results_by_seed_msg(self):
+        lines = []
+        for fid, result in self.results.items():
+            customers = ''
+            if self.__hydrometer_table is not None:
+                customers = f", {self.__hydrometer_table.count(result.pipelines)} hidrômetros"
+            lines.append(f"\nRede {fid} ({len(result.pipelines)} redes afetadas{customers})\n"
+                         f"Registros: {','.join(self.__valve_names(result.valves))}\n"
+                         f"Registro fechados: {','.join(self.__valve_names(result.valves_closed))}\n"
+                         f"Registro não visíveis: {','.join(self.__valve_names(result.valves_not_visible))}")
+        return '\n'.join(lines)
+
+    def __valve_names(self, valve_ids):
+        return [str(self.__valves_table.value(valve_id, 'codigo')) for valve_id in sorted(valve_ids)]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,195 @@
+"""
+Isolamento ampliado quando registros falham (não fecham), sem QGIS.
+
+O resultado de um tracing é a zona da semente; um registro que falha liga essa zona às zonas do outro
+lado dele. A ampliação parte do resultado existente (não refaz o tracing da semente): para cada registro
+com falha no contorno, as redes do outro lado são percorridas com as regras normais, e as zonas
+encontradas (e os resultados ampliados) ficam em cache, então perguntas encadeadas do tipo
+"e se este também falhar?" só percorrem o anel novo.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from core.tracing_engine import NO_VALVE, TraceResult, VALVE_OPEN, can_flow, trace
+
+# Resultados ampliados guardados (os mais antigos são descartados)
+MAX_EXPANSIONS = 64
+
+
+class ExpandedResult(TraceResult):
+    """TraceResult ampliado: valves_failed são os registros com falha atravessados"""
+
+    def __init__(self):
+        super().__init__()
+        self.valves_failed = set()
+        self.reversible = False
+
+
+class ValveFailureAnalysis:
+    """
+    :param segments: IsolationSegments da mesma topologia (opcional); as zonas vêm dele sem percorrer a rede
+    """
+
+    def __init__(self, topology, valve_state, diameter, segments=None):
+        self.topology = topology
+        self.__valve_state = valve_state
+        self.__diameter = diameter
+        self.segments = segments
+        self.__zones = {}  # índice da rede -> TraceResult de zonas reversíveis já percorridas
+        self.__expansions = OrderedDict()  # (id do resultado base, frozenset de falhas) -> ExpandedResult
+        self.__bases = {}  # id do resultado base -> resultado (mantém o id válido enquanto está em cache)
+        self.__valve_nodes = None
+        self.__endpoints = None
+
+    def expand(self, result, failed_valves, is_canceled=None):
+        """
+        Zona alcançada pela semente de 'result' quando os registros failed_valves não fecham.
+        :param result: TraceResult de trace/trace_many/IsolationSegments (ou um ExpandedResult anterior)
+        :return: ExpandedResult ou None se cancelado
+        """
+        failed = frozenset(failed_valves)
+        base, base_failed = result, frozenset()
+        if isinstance(result, ExpandedResult):
+            base, base_failed = self.__base_of(result)
+        failed |= base_failed
+
+        # Maior ampliação já calculada para o mesmo resultado com um subconjunto das falhas
+        start, done = result, base_failed
+        for (base_id, cached_failed), cached in reversed(self.__expansions.items()):
+            if base_id == id(base) and cached_failed <= failed and len(cached_failed) > len(done):
+                start, done = cached, cached_failed
+        if done == failed and isinstance(start, ExpandedResult):
+            return start
+
+        expanded = self.__expand(start, failed, is_canceled)
+        if expanded is None:
+            return None
+        self.__remember(base, failed, expanded)
+        return expanded
+
+    def __base_of(self, expanded):
+        for (base_id, cached_failed), cached in self.__expansions.items():
+            if cached is expanded:
+                return self.__bases[base_id], cached_failed
+        return expanded, frozenset(expanded.valves_failed)
+
+    def __remember(self, base, failed, expanded):
+        self.__bases[id(base)] = base
+        self.__expansions[(id(base), failed)] = expanded
+        while len(self.__expansions) > MAX_EXPANSIONS:
+            (base_id, _), _ = self.__expansions.popitem(last=False)
+            if all(key[0] != base_id for key in self.__expansions):
+                self.__bases.pop(base_id, None)
+
+    def __expand(self, start, failed, is_canceled):
+        topology = self.topology
+        pipe_ids, pipe_nodes, node_pipes, node_valve = topology.lists()
+        diameter = self.__diameter
+
+        expanded = ExpandedResult()
+        expanded.valves = set(start.valves)
+        expanded.valves_closed = set(start.valves_closed)
+        expanded.valves_not_visible = set(start.valves_not_visible)
+        expanded.valves_failed = set(getattr(start, 'valves_failed', ()))
+        expanded.iterations = start.iterations
+        reached = list(start.pipe_indices)
+        visited = set(reached)
+
+        # Pares (rede alcançada, nó com registro com falha) a atravessar; cada par uma única vez
+        crossings = []
+        crossed = set()
+
+        def fail(valve):
+            expanded.valves.discard(valve)
+            expanded.valves_failed.add(valve)
+            for node in self.__nodes_of(valve):
+                crossings.extend((origin, node) for origin in self.__pipes_ending_at(node) if origin in visited)
+
+        def merge(zone):
+            expanded.iterations += zone.iterations
+            expanded.valves_closed |= zone.valves_closed
+            expanded.valves_not_visible |= zone.valves_not_visible
+            for index in zone.pipe_indices:
+                if index in visited:
+                    continue
+                visited.add(index)
+                reached.append(index)
+                # Rede nova que termina em um registro que já falhou também atravessa o registro
+                for node in pipe_nodes[index]:
+                    if node >= 0 and node_valve[node] in expanded.valves_failed:
+                        crossings.append((index, node))
+            for valve in zone.valves:
+                if valve in failed:
+                    if valve not in expanded.valves_failed:
+                        fail(valve)
+                elif valve not in expanded.valves_failed:
+                    expanded.valves.add(valve)
+
+        for valve in [valve for valve in expanded.valves if valve in failed]:
+            fail(valve)
+
+        while crossings:
+            if is_canceled is not None and is_canceled():
+                return None
+            origin, node = crossings.pop()
+            if (origin, node) in crossed:
+                continue
+            crossed.add((origin, node))
+
+            origin_diameter = diameter(origin)
+            for neighbor in node_pipes[node]:
+                if neighbor not in visited and can_flow(origin_diameter, diameter(neighbor)):
+                    merge(self.zone(neighbor))
+
+        # As redes do início vêm primeiro em 'reached': só as novas são convertidas para ids
+        expanded.pipe_indices = reached
+        expanded.pipelines = set(start.pipelines)
+        expanded.pipelines.update(pipe_ids[i] for i in reached[len(start.pipe_indices):])
+        return expanded
+
+    def zone(self, pipe_index):
+        """Resultado do tracing normal a partir da rede (das zonas em cache sempre que possível)"""
+        if self.segments is not None:
+            zone = self.segments.result(pipe_index)
+            if zone is not None:
+                return zone
+        zone = self.__zones.get(pipe_index)
+        if zone is None:
+            zone = trace(self.topology, pipe_index, self.__valve_state, self.__diameter, known_zones=self.__zones)
+            if zone.reversible:
+                for index in zone.pipe_indices:
+                    self.__zones[index] = zone
+        return zone
+
+    def zones_at(self, valve_id):
+        """Zonas das redes ligadas ao registro (dos dois lados dele)"""
+        zones = {}
+        for node in self.__nodes_of(valve_id):
+            for pipe in self.topology.pipes_at(node).tolist():
+                zone = self.zone(pipe)
+                zones[id(zone)] = zone
+        return list(zones.values())
+
+    def __nodes_of(self, valve_id):
+        if self.__valve_nodes is None:
+            node_valve = self.topology.node_valve
+            nodes = np.nonzero(node_valve != NO_VALVE)[0]
+            self.__valve_nodes = {}
+            for node, valve in zip(nodes.tolist(), node_valve[nodes].tolist()):
+                self.__valve_nodes.setdefault(valve, []).append(node)
+        return self.__valve_nodes.get(valve_id, ())
+
+    def __pipes_ending_at(self, node):
+        # Redes com extremidade no nó (o tracing só avalia o registro de um nó a partir dessas redes)
+        if self.__endpoints is None:
+            ends = self.topology.pipe_nodes.ravel()
+            order = np.argsort(ends, kind='stable')
+            ptr = np.searchsorted(ends[order], np.arange(self.topology.n_nodes + 1))
+            self.__endpoints = (ptr.tolist(), (order // 2).tolist())
+        ptr, pipes = self.__endpoints
+        return pipes[ptr[node]:ptr[node + 1]]
+
+    def is_failable(self, valve_id):
+        """Somente registros que o tracing manda fechar (abertos e visíveis) podem falhar"""
+        return self.__valve_state(valve_id) == VALVE_OPEN
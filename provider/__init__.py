@@ -0,0 +1 @@
+from provider.tracing_provider import TracingProvider
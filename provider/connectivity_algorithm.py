@@ -0,0 +1,116 @@
+import numpy as np
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsFeature,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsPointXY,
+                       QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsWkbTypes)
+
+from core.connectivity_qa import DEFAULT_GAP, ERROR_TYPES, check_connectivity, summary
+from core.feature_stream import WRITE_BATCH_SIZE
+from core.network_topology import pipeline_segments, point_chunks
+
+
+class ConnectivityAlgorithm(QgsProcessingAlgorithm):
+    """Camada de erros de conectividade das redes e registros (pontas soltas, quase conexões, registros fora do nó)"""
+
+    PIPELINES = 'PIPELINES'
+    VALVES = 'VALVES'
+    USER_DISTANCE = 'USER_DISTANCE'
+    GAP = 'GAP'
+    OUTPUT = 'OUTPUT'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(self.PIPELINES, 'Redes',
+                                                              [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.VALVES, 'Registros',
+                                                              [QgsProcessing.TypeVectorPoint]))
+        self.addParameter(QgsProcessingParameterNumber(self.USER_DISTANCE, 'Tolerância de conexão',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=0.001, minValue=0.000001))
+        self.addParameter(QgsProcessingParameterNumber(self.GAP, 'Distância máxima para "quase conectada"',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=DEFAULT_GAP, minValue=0))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, 'Erros de conectividade',
+                                                            QgsProcessing.TypeVectorPoint))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        pipelines = self.parameterAsSource(parameters, self.PIPELINES, context)
+        valves = self.parameterAsSource(parameters, self.VALVES, context)
+        user_distance = self.parameterAsDouble(parameters, self.USER_DISTANCE, context)
+        gap = self.parameterAsDouble(parameters, self.GAP, context)
+
+        feedback.pushInfo('Lendo as redes e os registros')
+        starts, ends, owners = pipeline_segments(pipelines)
+        valve_ids, valve_xy = [np.zeros(0, dtype=np.int64)], [np.zeros((0, 2))]
+        for ids, points in point_chunks(valves):
+            if feedback.isCanceled():
+                return {}
+            valve_ids.append(ids)
+            valve_xy.append(points)
+        feedback.setProgress(40)
+
+        feedback.pushInfo('Verificando a conectividade')
+        errors = check_connectivity(starts, ends, owners, np.concatenate(valve_ids), np.vstack(valve_xy),
+                                    user_distance, gap)
+        for kind, count in summary(errors).items():
+            feedback.pushInfo(f'{kind}: {count}')
+        feedback.setProgress(70)
+
+        fields = QgsFields()
+        fields.append(QgsField('tipo', QVariant.String))
+        fields.append(QgsField('fid_feicao', QVariant.LongLong))
+        fields.append(QgsField('fid_outra', QVariant.LongLong))
+        fields.append(QgsField('distancia', QVariant.Double))
+        sink, dest_id = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.Point,
+                                             pipelines.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        values = [errors[name].tolist() for name in ('kind', 'x', 'y', 'feature', 'other', 'distance')]
+        feats = []
+        for kind, x, y, feature, other, distance in zip(*values):
+            feat = QgsFeature(fields)
+            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            feat.setAttributes([ERROR_TYPES[kind], feature, other if other >= 0 else None,
+                                None if np.isnan(distance) else distance])
+            feats.append(feat)
+            if len(feats) >= WRITE_BATCH_SIZE:
+                if feedback.isCanceled():
+                    return {}
+                sink.addFeatures(feats, QgsFeatureSink.FastInsert)
+                feats = []
+        sink.addFeatures(feats, QgsFeatureSink.FastInsert)
+        feedback.setProgress(100)
+        return {self.OUTPUT: dest_id}
+
+    def name(self):
+        return 'connectivity'
+
+    def displayName(self):
+        return 'Verificar conectividade da rede'
+
+    def group(self):
+        return 'Tracing'
+
+    def groupId(self):
+        return 'tracing'
+
+    def shortHelpString(self):
+        return ('Camada de pontos com os erros que fazem o tracing vazar ou parar: extremidades de rede sem '
+                'outra rede por perto (ponta_solta), extremidades a mais da tolerância de conexão mas a até a '
+                'distância máxima de outra rede (quase_conectada), registros fora da extremidade de uma rede '
+                '(registro_fora_do_no, ignorados pelo tracing) e segmentos repetidos (segmento_duplicado). '
+                'Use a mesma tolerância de conexão do tracing.')
+
+    def createInstance(self):
+        return ConnectivityAlgorithm()
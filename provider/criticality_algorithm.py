@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsFeature,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterVectorLayer,
+                       QgsProcessingUtils,
+                       QgsWkbTypes)
+
+from core.criticality import CRITICALITY_FIELDS, DEFAULT_SHARD_SIZE, CriticalityRun
+from core.feature_stream import WRITE_BATCH_SIZE
+from core.find_points import HD_MAX_DISTANCE
+from core.hydrometer_table import build_hydrometer_table
+from core.network_topology import load_network, pipe_lengths
+from core.process_pool import default_workers
+
+
+class CriticalityAlgorithm(QgsProcessingAlgorithm):
+    """Criticidade de cada rede da camada (registros a operar, comprimento e hidrômetros afetados)"""
+
+    PIPELINES = 'PIPELINES'
+    VALVES = 'VALVES'
+    HYDROMETERS = 'HYDROMETERS'
+    USER_DISTANCE = 'USER_DISTANCE'
+    MAX_DISTANCE = 'MAX_DISTANCE'
+    WORKERS = 'WORKERS'
+    SHARD_SIZE = 'SHARD_SIZE'
+    WORK_DIR = 'WORK_DIR'
+    OUTPUT = 'OUTPUT'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterVectorLayer(self.PIPELINES, 'Redes',
+                                                            [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterVectorLayer(self.VALVES, 'Registros',
+                                                            [QgsProcessing.TypeVectorPoint]))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.HYDROMETERS, 'Hidrômetros',
+                                                              [QgsProcessing.TypeVectorPoint], optional=True))
+        self.addParameter(QgsProcessingParameterNumber(self.USER_DISTANCE, 'Tolerância de conexão',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=0.001, minValue=0.000001))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_DISTANCE, 'Distância máxima hidrômetro-rede',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=HD_MAX_DISTANCE, minValue=0))
+        self.addParameter(QgsProcessingParameterNumber(self.WORKERS, 'Processos (0 = automático)',
+                                                       defaultValue=0, minValue=0))
+        self.addParameter(QgsProcessingParameterNumber(self.SHARD_SIZE, 'Redes por lote',
+                                                       defaultValue=DEFAULT_SHARD_SIZE, minValue=1))
+        self.addParameter(QgsProcessingParameterFile(self.WORK_DIR, 'Diretório de trabalho (para continuar depois)',
+                                                     behavior=QgsProcessingParameterFile.Folder, optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, 'Criticidade', QgsProcessing.TypeVector))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        pipelines = self.parameterAsVectorLayer(parameters, self.PIPELINES, context)
+        valves = self.parameterAsVectorLayer(parameters, self.VALVES, context)
+        hydrometers = self.parameterAsSource(parameters, self.HYDROMETERS, context)
+        user_distance = self.parameterAsDouble(parameters, self.USER_DISTANCE, context)
+        max_distance = self.parameterAsDouble(parameters, self.MAX_DISTANCE, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context) or default_workers()
+        shard_size = self.parameterAsInt(parameters, self.SHARD_SIZE, context)
+        work_dir = (self.parameterAsFile(parameters, self.WORK_DIR, context)
+                    or os.path.join(QgsProcessingUtils.tempFolder(), 'criticality'))
+
+        feedback.pushInfo('Montando a topologia da rede')
+        topology, attributes = load_network(pipelines, valves, user_distance)
+        lengths = pipe_lengths(pipelines, topology)
+        counts = self.__hydrometers_per_pipe(pipelines, hydrometers, topology, max_distance, feedback)
+        if feedback.isCanceled():
+            return {}
+
+        run = CriticalityRun(work_dir, topology, attributes, lengths, counts, shard_size)
+        pending = len(run.pending())
+        feedback.pushInfo(f'{len(run.shards)} lotes, {len(run.shards) - pending} já concluídos em {work_dir}')
+        if not run.run(workers, is_canceled=feedback.isCanceled,
+                       progress=lambda percent: feedback.setProgress(10 + 0.8 * percent)):
+            feedback.pushInfo('Cancelado: os lotes concluídos ficam no diretório de trabalho')
+            return {}
+
+        fields = QgsFields()
+        fields.append(QgsField('fid_rede', QVariant.LongLong))
+        for field in CRITICALITY_FIELDS:
+            fields.append(QgsField(field, QVariant.Double if field == 'length' else QVariant.LongLong))
+        sink, dest_id = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.NoGeometry)
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        columns = run.results()
+        values = [columns['fid'].tolist()] + [columns[field].tolist() for field in CRITICALITY_FIELDS]
+        feats = []
+        for row in zip(*values):
+            feat = QgsFeature(fields)
+            feat.setAttributes(list(row))
+            feats.append(feat)
+            if len(feats) >= WRITE_BATCH_SIZE:
+                sink.addFeatures(feats, QgsFeatureSink.FastInsert)
+                feats = []
+        sink.addFeatures(feats, QgsFeatureSink.FastInsert)
+        feedback.setProgress(100)
+        return {self.OUTPUT: dest_id}
+
+    @staticmethod
+    def __hydrometers_per_pipe(pipelines, hydrometers, topology, max_distance, feedback):
+        """Hidrômetros ligados a cada rede (rede mais próxima até max_distance)"""
+        if hydrometers is None:
+            return np.zeros(topology.n_pipes, dtype=np.int64)
+
+        feedback.pushInfo('Ligando os hidrômetros às redes')
+        table = build_hydrometer_table(pipelines, hydrometers, max_distance, is_canceled=feedback.isCanceled)
+        if table is None:
+            return np.zeros(topology.n_pipes, dtype=np.int64)
+        return table.counts(topology)
+
+    def name(self):
+        return 'criticality'
+
+    def displayName(self):
+        return 'Criticidade da rede'
+
+    def group(self):
+        return 'Tracing'
+
+    def groupId(self):
+        return 'tracing'
+
+    def shortHelpString(self):
+        return ('Para cada rede: registros a operar, registros já fechados e não visíveis, redes, comprimento '
+                'e hidrômetros afetados se ela falhar, e a zona de isolamento (-1 = zona própria). '
+                'Redes da mesma zona são calculadas uma vez; os lotes rodam em processos paralelos e ficam '
+                'gravados no diretório de trabalho, então uma execução interrompida continua de onde parou.')
+
+    def createInstance(self):
+        return CriticalityAlgorithm()
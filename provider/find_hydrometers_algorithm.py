@@ -0,0 +1,84 @@
+from qgis.core import (QgsFeatureRequest,
+                       QgsFeatureSink,
+                       QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingOutputNumber,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterVectorLayer)
+
+from core.feature_stream import iter_features
+from core.find_points import HD_MAX_DISTANCE, points_near_pipeline
+from core.index_cache import get_spatial_index
+
+
+class FindHydrometersAlgorithm(QgsProcessingAlgorithm):
+    """Hidrômetros próximos das redes informadas (ex.: redes afetadas de um tracing)"""
+
+    PIPELINES = 'PIPELINES'
+    HYDROMETERS = 'HYDROMETERS'
+    MAX_DISTANCE = 'MAX_DISTANCE'
+    OUTPUT = 'OUTPUT'
+    COUNT = 'COUNT'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(self.PIPELINES, 'Redes',
+                                                              [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterVectorLayer(self.HYDROMETERS, 'Hidrômetros',
+                                                            [QgsProcessing.TypeVectorPoint]))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_DISTANCE, 'Distância máxima até a rede',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=HD_MAX_DISTANCE, minValue=0))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, 'Hidrômetros encontrados',
+                                                            QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputNumber(self.COUNT, 'Hidrômetros'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        pipelines = self.parameterAsSource(parameters, self.PIPELINES, context)
+        if pipelines is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.PIPELINES))
+        hydrometers = self.parameterAsVectorLayer(parameters, self.HYDROMETERS, context)
+        max_distance = self.parameterAsDouble(parameters, self.MAX_DISTANCE, context)
+
+        idx_hydrometers = get_spatial_index(hydrometers)
+        total = max(pipelines.featureCount(), 1)
+        found = set()
+        for current, pipeline in enumerate(pipelines.getFeatures(QgsFeatureRequest().setNoAttributes())):
+            if feedback.isCanceled():
+                return {}
+            if pipeline.hasGeometry():
+                found.update(points_near_pipeline(idx_hydrometers, pipeline.geometry(), max_distance, found))
+            feedback.setProgress(80.0 * current / total)
+
+        sink, dest_id = self.parameterAsSink(parameters, self.OUTPUT, context, hydrometers.fields(),
+                                             hydrometers.wkbType(), hydrometers.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+        for feature in iter_features(hydrometers, fids=sorted(found), fields=hydrometers.fields().names()):
+            if feedback.isCanceled():
+                return {}
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+        feedback.setProgress(100)
+
+        return {self.OUTPUT: dest_id, self.COUNT: len(found)}
+
+    def name(self):
+        return 'findhydrometers'
+
+    def displayName(self):
+        return 'Hidrômetros próximos das redes'
+
+    def group(self):
+        return 'Tracing'
+
+    def groupId(self):
+        return 'tracing'
+
+    def shortHelpString(self):
+        return ('Hidrômetros a até a distância máxima de qualquer rede da camada de entrada. '
+                'Use "Somente feições selecionadas" ou a saída do tracing como camada de redes.')
+
+    def createInstance(self):
+        return FindHydrometersAlgorithm()
@@ -0,0 +1,194 @@
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingOutputNumber,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterVectorLayer)
+
+from core.attribute_cache import get_attribute_table
+from core.find_points import HD_MAX_DISTANCE
+from core.hydrometer_table import get_hydrometer_table
+from core.isolation_segments import get_valve_failure_analysis
+from core.network_topology import VALVE_FIELDS, pipe_lengths
+from core.outage_planner import plan_outages
+from provider.tracing_algorithm import output_fields, parameter_fids, valve_fields, write_rows
+
+# Opções do parâmetro OBJECTIVE: impacto de cada rede desligada
+OBJECTIVES = ('Comprimento das redes (m)', 'Hidrômetros (clientes)')
+
+
+class OutageAlgorithm(QgsProcessingAlgorithm):
+    """
+    Planejamento de desligamentos para várias obras: agrupa as redes de obra em desligamentos
+    com o menor custo (registros a operar e comprimento ou clientes afetados).
+    """
+
+    PIPELINES = 'PIPELINES'
+    VALVES = 'VALVES'
+    SITE_IDS = 'SITE_IDS'
+    SITE_LAYER = 'SITE_LAYER'
+    SITE_FIELD = 'SITE_FIELD'
+    HYDROMETERS = 'HYDROMETERS'
+    OBJECTIVE = 'OBJECTIVE'
+    VALVE_COST = 'VALVE_COST'
+    MAX_IMPACT = 'MAX_IMPACT'
+    BRIDGES = 'BRIDGES'
+    USER_DISTANCE = 'USER_DISTANCE'
+    OUTPUT_PIPELINES = 'OUTPUT_PIPELINES'
+    OUTPUT_VALVES = 'OUTPUT_VALVES'
+    SHUTDOWNS = 'SHUTDOWNS'
+    OPERATIONS = 'OPERATIONS'
+    IMPACT = 'IMPACT'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterVectorLayer(self.PIPELINES, 'Redes',
+                                                            [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterVectorLayer(self.VALVES, 'Registros',
+                                                            [QgsProcessing.TypeVectorPoint]))
+        self.addParameter(QgsProcessingParameterString(self.SITE_IDS, 'Ids das redes de obra (separados por vírgula)',
+                                                       optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.SITE_LAYER, 'Camada com as redes de obra',
+                                                              [QgsProcessing.TypeVector], optional=True))
+        self.addParameter(QgsProcessingParameterField(self.SITE_FIELD, 'Campo com o id da rede (vazio = id da feição)',
+                                                      parentLayerParameterName=self.SITE_LAYER,
+                                                      type=QgsProcessingParameterField.Numeric, optional=True))
+        self.addParameter(QgsProcessingParameterVectorLayer(self.HYDROMETERS, 'Hidrômetros',
+                                                            [QgsProcessing.TypeVectorPoint], optional=True))
+        self.addParameter(QgsProcessingParameterEnum(self.OBJECTIVE, 'Minimizar', options=list(OBJECTIVES),
+                                                     defaultValue=0))
+        self.addParameter(QgsProcessingParameterNumber(self.VALVE_COST,
+                                                       'Custo de operar um registro (em metros ou clientes)',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=100.0, minValue=0))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_IMPACT,
+                                                       'Impacto máximo de um desligamento (0 = sem limite)',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=0.0, minValue=0))
+        self.addParameter(QgsProcessingParameterBoolean(self.BRIDGES,
+                                                        'Juntar obras separadas por uma zona sem obra',
+                                                        defaultValue=True))
+        self.addParameter(QgsProcessingParameterNumber(self.USER_DISTANCE, 'Tolerância de conexão',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=0.001, minValue=0.000001))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_PIPELINES, 'Redes desligadas',
+                                                            QgsProcessing.TypeVectorLine))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_VALVES, 'Registros dos desligamentos',
+                                                            QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputNumber(self.SHUTDOWNS, 'Desligamentos'))
+        self.addOutput(QgsProcessingOutputNumber(self.OPERATIONS, 'Registros a operar'))
+        self.addOutput(QgsProcessingOutputNumber(self.IMPACT, 'Impacto total'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        pipelines = self.parameterAsVectorLayer(parameters, self.PIPELINES, context)
+        valves = self.parameterAsVectorLayer(parameters, self.VALVES, context)
+        hydrometers = self.parameterAsVectorLayer(parameters, self.HYDROMETERS, context)
+        customers = self.parameterAsEnum(parameters, self.OBJECTIVE, context) == 1
+        valve_cost = self.parameterAsDouble(parameters, self.VALVE_COST, context)
+        max_impact = self.parameterAsDouble(parameters, self.MAX_IMPACT, context) or None
+        bridges = self.parameterAsBoolean(parameters, self.BRIDGES, context)
+        user_distance = self.parameterAsDouble(parameters, self.USER_DISTANCE, context)
+        if customers and hydrometers is None:
+            raise QgsProcessingException('Informe a camada de hidrômetros para minimizar os clientes afetados')
+
+        site_fids = parameter_fids(self, parameters, context, self.SITE_IDS, self.SITE_LAYER, self.SITE_FIELD)
+        if not site_fids:
+            raise QgsProcessingException('Informe ao menos uma rede de obra')
+
+        feedback.pushInfo('Montando a topologia da rede')
+        analysis = get_valve_failure_analysis(pipelines, valves, user_distance)
+        topology = analysis.topology
+        if customers:
+            feedback.pushInfo('Ligando os hidrômetros às redes')
+            table = get_hydrometer_table(pipelines, hydrometers, HD_MAX_DISTANCE, is_canceled=feedback.isCanceled)
+            if table is None:
+                return {}
+            pipe_weight = table.counts(topology)
+        else:
+            pipe_weight = pipe_lengths(pipelines, topology)
+        if feedback.isCanceled():
+            return {}
+
+        sites = {}
+        for fid in site_fids:
+            site_index = topology.pipe_index.get(fid)
+            if site_index is None:
+                feedback.reportError(f'Rede {fid} não encontrada ou sem geometria')
+                continue
+            sites[site_index] = fid
+        feedback.setProgress(25)
+
+        feedback.pushInfo(f'Planejando os desligamentos de {len(sites)} redes de obra')
+        plan = plan_outages(analysis, list(sites), pipe_weight, valve_cost=valve_cost, max_impact=max_impact,
+                            bridges=bridges, is_canceled=feedback.isCanceled)
+        if plan is None or feedback.isCanceled():
+            return {}
+        feedback.setProgress(50)
+
+        # Cada rede/registro com os desligamentos (numerados a partir de 1) que o usam
+        pipes_by_shutdown = {}
+        valves_by_shutdown = {}
+        for number, shutdown in enumerate(plan.shutdowns, start=1):
+            site_ids = {sites[site] for site in shutdown.sites}
+            for fid in shutdown.result.pipelines:
+                pipes_by_shutdown.setdefault(fid, []).append((number, int(fid in site_ids)))
+            for fid in shutdown.result.valves:
+                valves_by_shutdown.setdefault(fid, []).append((number, 'fechar'))
+            for fid in shutdown.failed:
+                valves_by_shutdown.setdefault(fid, []).append((number, 'manter_aberto'))
+            feedback.pushInfo(f'Desligamento {number}: {len(shutdown.sites)} obras, '
+                              f'{len(shutdown.result.valves)} registros, impacto {shutdown.impact:.1f}')
+
+        pipeline_fields = output_fields(('desligamento', QVariant.Int), ('pipeline', QVariant.LongLong),
+                                        ('obra', QVariant.Int))
+        pipelines_sink, pipelines_id = self.parameterAsSink(parameters, self.OUTPUT_PIPELINES, context,
+                                                            pipeline_fields, pipelines.wkbType(),
+                                                            pipelines.sourceCrs())
+        if pipelines_sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT_PIPELINES))
+        write_rows(pipelines, pipes_by_shutdown, pipelines_sink, lambda fid, row: [row[0], fid, row[1]], feedback)
+        feedback.setProgress(75)
+
+        valves_table = get_attribute_table(valves, VALVE_FIELDS)
+        valves_sink, valves_id = self.parameterAsSink(parameters, self.OUTPUT_VALVES, context,
+                                                      valve_fields('desligamento', QVariant.Int), valves.wkbType(),
+                                                      valves.sourceCrs())
+        if valves_sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT_VALVES))
+        write_rows(valves, valves_by_shutdown, valves_sink,
+                   lambda fid, row: [row[0], fid, str(valves_table.value(fid, 'codigo')), row[1]], feedback)
+        feedback.setProgress(100)
+
+        return {self.OUTPUT_PIPELINES: pipelines_id,
+                self.OUTPUT_VALVES: valves_id,
+                self.SHUTDOWNS: len(plan.shutdowns),
+                self.OPERATIONS: plan.operations,
+                self.IMPACT: plan.impact}
+
+    def name(self):
+        return 'outage_planner'
+
+    def displayName(self):
+        return 'Planejamento de desligamentos'
+
+    def group(self):
+        return 'Tracing'
+
+    def groupId(self):
+        return 'tracing'
+
+    def shortHelpString(self):
+        return ('Agrupa as redes de obra em desligamentos: cada obra começa com a sua zona de isolamento e '
+                'desligamentos vizinhos são juntados (deixando aberto o registro entre eles) enquanto o custo total '
+                'diminui. Custo = custo por registro x registros distintos a operar + comprimento ou hidrômetros '
+                'das redes desligadas. As zonas são calculadas uma vez e reaproveitadas em todas as avaliações. '
+                'Registros "manter_aberto" ficam dentro do desligamento e não são operados.')
+
+    def createInstance(self):
+        return OutageAlgorithm()
@@ -0,0 +1,108 @@
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingOutputNumber,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsWkbTypes)
+
+from core.feature_stream import DEFAULT_CHUNK_SIZE, WRITE_BATCH_SIZE
+from core.geometry_kernels import SegmentGrid
+from core.lancamento_ramal import hydrometer_chunks, nearest_by_chunk, ramal_features
+from core.network_topology import pipeline_segments
+from core.process_pool import default_workers
+
+
+class RamalAlgorithm(QgsProcessingAlgorithm):
+    """Ramais (linha do hidrômetro até o ponto mais próximo da rede), como o LancamentoRamal"""
+
+    PIPELINES = 'PIPELINES'
+    HYDROMETERS = 'HYDROMETERS'
+    MAX_DISTANCE = 'MAX_DISTANCE'
+    WORKERS = 'WORKERS'
+    CHUNK_SIZE = 'CHUNK_SIZE'
+    OUTPUT = 'OUTPUT'
+    COUNT = 'COUNT'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(self.PIPELINES, 'Redes',
+                                                              [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.HYDROMETERS, 'Hidrômetros',
+                                                              [QgsProcessing.TypeVectorPoint]))
+        self.addParameter(QgsProcessingParameterNumber(self.MAX_DISTANCE, 'Distância máxima até a rede',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=30, minValue=0))
+        self.addParameter(QgsProcessingParameterNumber(self.WORKERS, 'Processos (0 = automático)',
+                                                       defaultValue=1, minValue=0))
+        self.addParameter(QgsProcessingParameterNumber(self.CHUNK_SIZE, 'Hidrômetros por bloco',
+                                                       defaultValue=DEFAULT_CHUNK_SIZE, minValue=1))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT, 'Ramais', QgsProcessing.TypeVectorLine))
+        self.addOutput(QgsProcessingOutputNumber(self.COUNT, 'Ramais'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        pipelines = self.parameterAsSource(parameters, self.PIPELINES, context)
+        if pipelines is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.PIPELINES))
+        hydrometers = self.parameterAsSource(parameters, self.HYDROMETERS, context)
+        if hydrometers is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.HYDROMETERS))
+        max_distance = self.parameterAsDouble(parameters, self.MAX_DISTANCE, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context) or default_workers()
+        chunk_size = self.parameterAsInt(parameters, self.CHUNK_SIZE, context)
+
+        fields = QgsFields()
+        fields.append(QgsField('id', QVariant.Int))
+        fields.append(QgsField('distance', QVariant.Double, len=20, prec=2))
+        fields.append(QgsField('pipeline', QVariant.LongLong))
+        sink, dest_id = self.parameterAsSink(parameters, self.OUTPUT, context, fields,
+                                             QgsWkbTypes.LineString, hydrometers.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        feedback.pushInfo('Lendo os segmentos das redes')
+        starts, ends, owners = pipeline_segments(pipelines)
+        grid = SegmentGrid(starts, ends, owners, max_distance)
+
+        total = max(hydrometers.featureCount(), 1)
+        read = 0
+        count = 0
+        feats = []
+        chunks = hydrometer_chunks(hydrometers, chunk_size)
+        for points, nearest in nearest_by_chunk(grid, chunks, workers, feedback.isCanceled):
+            if feedback.isCanceled():
+                return {}
+            feats.extend(ramal_features(points, nearest, read, fields))
+            if len(feats) >= WRITE_BATCH_SIZE:
+                sink.addFeatures(feats, QgsFeatureSink.FastInsert)
+                count += len(feats)
+                feats = []
+            read += len(points)
+            feedback.setProgress(100.0 * read / total)
+
+        sink.addFeatures(feats, QgsFeatureSink.FastInsert)
+        count += len(feats)
+        return {self.OUTPUT: dest_id, self.COUNT: count}
+
+    def name(self):
+        return 'ramal'
+
+    def displayName(self):
+        return 'Lançamento de ramais'
+
+    def group(self):
+        return 'Tracing'
+
+    def groupId(self):
+        return 'tracing'
+
+    def shortHelpString(self):
+        return ('Liga cada hidrômetro ao ponto mais próximo da rede mais próxima, até a distância máxima. '
+                'Os hidrômetros são lidos em blocos e, com mais de um processo, os blocos são calculados em paralelo.')
+
+    def createInstance(self):
+        return RamalAlgorithm()
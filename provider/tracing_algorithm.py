@@ -0,0 +1,229 @@
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsFeature,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingOutputNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterVectorLayer)
+
+from core.attribute_cache import get_attribute_table
+from core.feature_stream import WRITE_BATCH_SIZE, iter_features
+from core.flow_direction import BOTH, DOWNSTREAM, TRACE_MODE_NAMES, UPSTREAM, trace_directed_many
+from core.isolation_segments import cached_isolation_segments, get_flow_direction
+from core.network_topology import VALVE_FIELDS, get_lookups, get_topology
+from core.tracing_engine import trace_many
+
+# Situação de cada registro na saída
+VALVE_SITUATIONS = (('valves', 'operar'), ('valves_closed', 'fechado'), ('valves_not_visible', 'nao_visivel'))
+
+# Opções do parâmetro DIRECTION (None = tracing normal, sem sentido de escoamento)
+DIRECTIONS = (None, UPSTREAM, DOWNSTREAM, BOTH)
+
+
+def parameter_fids(algorithm, parameters, context, ids_name, layer_name, field_name):
+    """Ids das redes informados no texto (separados por vírgula) e/ou pelas feições de uma camada"""
+    fids = [int(value) for value in
+            algorithm.parameterAsString(parameters, ids_name, context).replace(';', ',').split(',')
+            if value.strip()]
+
+    source = algorithm.parameterAsSource(parameters, layer_name, context)
+    if source is not None:
+        field = algorithm.parameterAsString(parameters, field_name, context)
+        for feature in source.getFeatures():
+            fids.append(int(feature[field]) if field else feature.id())
+    return list(dict.fromkeys(fids))
+
+
+def write_rows(layer, rows_by_fid, sink, attributes, feedback):
+    """
+    Grava uma feição de saída por linha de rows_by_fid (fid -> linhas), com a geometria da feição da camada
+    e os atributos attributes(fid, linha). Geometrias lidas uma única vez por feição, em blocos,
+    mesmo quando várias linhas usam a mesma feição.
+    """
+    feats = []
+    for feature in iter_features(layer, fids=sorted(rows_by_fid)):
+        if feedback.isCanceled():
+            return
+        for row in rows_by_fid[feature.id()]:
+            output = QgsFeature()
+            output.setGeometry(feature.geometry())
+            output.setAttributes(attributes(feature.id(), row))
+            feats.append(output)
+        if len(feats) >= WRITE_BATCH_SIZE:
+            sink.addFeatures(feats, QgsFeatureSink.FastInsert)
+            feats = []
+    sink.addFeatures(feats, QgsFeatureSink.FastInsert)
+
+
+def output_fields(*definitions):
+    """QgsFields a partir de pares (nome, tipo QVariant)"""
+    fields = QgsFields()
+    for name, kind in definitions:
+        fields.append(QgsField(name, kind))
+    return fields
+
+
+def valve_fields(key, key_type=QVariant.LongLong):
+    """Campos da saída de registros: chave (rede de partida, desligamento...), id, código e situação"""
+    return output_fields((key, key_type), ('valve', QVariant.LongLong), ('codigo', QVariant.String),
+                         ('situacao', QVariant.String))
+
+
+class TracingAlgorithm(QgsProcessingAlgorithm):
+    """
+    Tracing a partir de uma ou várias redes (ids e/ou camada de partida), sem interface:
+    grava as redes afetadas e os registros de cada rede de partida.
+    """
+
+    PIPELINES = 'PIPELINES'
+    VALVES = 'VALVES'
+    SEED_IDS = 'SEED_IDS'
+    SEED_LAYER = 'SEED_LAYER'
+    SEED_FIELD = 'SEED_FIELD'
+    USER_DISTANCE = 'USER_DISTANCE'
+    SOURCES = 'SOURCES'
+    DIRECTION = 'DIRECTION'
+    OUTPUT_PIPELINES = 'OUTPUT_PIPELINES'
+    OUTPUT_VALVES = 'OUTPUT_VALVES'
+    SEEDS = 'SEEDS'
+    ITERATIONS = 'ITERATIONS'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterVectorLayer(self.PIPELINES, 'Redes',
+                                                            [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterVectorLayer(self.VALVES, 'Registros',
+                                                            [QgsProcessing.TypeVectorPoint]))
+        self.addParameter(QgsProcessingParameterString(self.SEED_IDS, 'Ids das redes de partida (separados por vírgula)',
+                                                       optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSource(self.SEED_LAYER, 'Camada com as redes de partida',
+                                                              [QgsProcessing.TypeVector], optional=True))
+        self.addParameter(QgsProcessingParameterField(self.SEED_FIELD, 'Campo com o id da rede (vazio = id da feição)',
+                                                      parentLayerParameterName=self.SEED_LAYER,
+                                                      type=QgsProcessingParameterField.Numeric, optional=True))
+        self.addParameter(QgsProcessingParameterNumber(self.USER_DISTANCE, 'Tolerância de conexão',
+                                                       type=QgsProcessingParameterNumber.Double,
+                                                       defaultValue=0.001, minValue=0.000001))
+        self.addParameter(QgsProcessingParameterVectorLayer(self.SOURCES, 'Fontes (reservatórios, bombas, VRPs)',
+                                                            [QgsProcessing.TypeVectorPoint], optional=True))
+        self.addParameter(QgsProcessingParameterEnum(self.DIRECTION, 'Sentido',
+                                                     options=['Normal'] + [TRACE_MODE_NAMES[mode].capitalize()
+                                                                           for mode in DIRECTIONS[1:]],
+                                                     defaultValue=0))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_PIPELINES, 'Redes afetadas',
+                                                            QgsProcessing.TypeVectorLine))
+        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_VALVES, 'Registros do tracing',
+                                                            QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputNumber(self.SEEDS, 'Redes de partida'))
+        self.addOutput(QgsProcessingOutputNumber(self.ITERATIONS, 'Iterações'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        pipelines = self.parameterAsVectorLayer(parameters, self.PIPELINES, context)
+        valves = self.parameterAsVectorLayer(parameters, self.VALVES, context)
+        user_distance = self.parameterAsDouble(parameters, self.USER_DISTANCE, context)
+        sources = self.parameterAsVectorLayer(parameters, self.SOURCES, context)
+        direction = DIRECTIONS[self.parameterAsEnum(parameters, self.DIRECTION, context)]
+        if direction is not None and sources is None:
+            raise QgsProcessingException('Informe a camada de fontes para o tracing a montante/jusante')
+
+        seed_fids = parameter_fids(self, parameters, context, self.SEED_IDS, self.SEED_LAYER, self.SEED_FIELD)
+        if not seed_fids:
+            raise QgsProcessingException('Informe ao menos uma rede de partida')
+
+        feedback.pushInfo('Montando a topologia da rede')
+        segments = cached_isolation_segments(pipelines, valves, user_distance) if direction is None else None
+        topology = segments.topology if segments is not None else get_topology(pipelines, valves, user_distance)
+        valve_state, diameter = get_lookups(pipelines, valves, topology)
+
+        seeds = {}
+        for fid in seed_fids:
+            seed_index = topology.pipe_index.get(fid)
+            if seed_index is None:
+                feedback.reportError(f'Rede {fid} não encontrada ou sem geometria')
+                continue
+            seeds[seed_index] = fid
+
+        feedback.pushInfo(f'Tracing de {len(seeds)} redes')
+        if direction is not None:
+            feedback.pushInfo('Orientando a rede a partir das fontes')
+            flow = get_flow_direction(pipelines, valves, sources, user_distance, is_canceled=feedback.isCanceled)
+            if flow is None:
+                return {}
+            if flow.n_unoriented:
+                feedback.pushInfo(f'{flow.n_unoriented} redes sem sentido definido (percorridas nos dois sentidos)')
+            results = trace_directed_many(flow, list(seeds), direction, is_canceled=feedback.isCanceled)
+        elif segments is not None:
+            results = segments.results(list(seeds), valve_state, diameter, is_canceled=feedback.isCanceled)
+        else:
+            results = trace_many(topology, list(seeds), valve_state=valve_state, diameter=diameter,
+                                 is_canceled=feedback.isCanceled)
+        if results is None or feedback.isCanceled():
+            return {}
+        feedback.setProgress(50)
+
+        # Para cada rede/registro alcançado, as redes de partida que o alcançam
+        pipes_by_seed = {}
+        valves_by_seed = {}
+        for seed_index, result in results.items():
+            seed = seeds[seed_index]
+            for fid in result.pipelines:
+                pipes_by_seed.setdefault(fid, []).append(seed)
+            for attribute, situation in VALVE_SITUATIONS:
+                for fid in getattr(result, attribute):
+                    valves_by_seed.setdefault(fid, []).append((seed, situation))
+
+        pipeline_fields = output_fields(('seed', QVariant.LongLong), ('pipeline', QVariant.LongLong))
+        pipelines_sink, pipelines_id = self.parameterAsSink(parameters, self.OUTPUT_PIPELINES, context,
+                                                            pipeline_fields, pipelines.wkbType(),
+                                                            pipelines.sourceCrs())
+        if pipelines_sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT_PIPELINES))
+        write_rows(pipelines, pipes_by_seed, pipelines_sink, lambda fid, seed: [seed, fid], feedback)
+        feedback.setProgress(75)
+
+        valves_table = get_attribute_table(valves, VALVE_FIELDS)
+        valves_sink, valves_id = self.parameterAsSink(parameters, self.OUTPUT_VALVES, context,
+                                                      valve_fields('seed'), valves.wkbType(), valves.sourceCrs())
+        if valves_sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT_VALVES))
+        write_rows(valves, valves_by_seed, valves_sink,
+                   lambda fid, row: [row[0], fid, str(valves_table.value(fid, 'codigo')), row[1]], feedback)
+        feedback.setProgress(100)
+
+        unique = {id(result): result for result in results.values()}.values()
+        return {self.OUTPUT_PIPELINES: pipelines_id,
+                self.OUTPUT_VALVES: valves_id,
+                self.SEEDS: len(seeds),
+                self.ITERATIONS: sum(result.iterations for result in unique)}
+
+    def name(self):
+        return 'tracing'
+
+    def displayName(self):
+        return 'Tracing de redes'
+
+    def group(self):
+        return 'Tracing'
+
+    def groupId(self):
+        return 'tracing'
+
+    def shortHelpString(self):
+        return ('Redes afetadas e registros a operar a partir de cada rede de partida '
+                '(ids separados por vírgula e/ou feições de uma camada). '
+                'Redes de partida na mesma zona compartilham o resultado. '
+                'Com a camada de fontes, o sentido a montante/jusante segue o escoamento calculado uma vez '
+                'a partir delas (redes mais próximas das fontes ficam a montante). '
+                'Para processar muitas redes em paralelo, execute várias chamadas do qgis_process '
+                'com listas de ids diferentes.')
+
+    def createInstance(self):
+        return TracingAlgorithm()
@@ -0,0 +1,34 @@
+import os
+
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import QgsProcessingProvider
+
+from provider.connectivity_algorithm import ConnectivityAlgorithm
+from provider.criticality_algorithm import CriticalityAlgorithm
+from provider.find_hydrometers_algorithm import FindHydrometersAlgorithm
+from provider.outage_algorithm import OutageAlgorithm
+from provider.ramal_algorithm import RamalAlgorithm
+from provider.tracing_algorithm import TracingAlgorithm
+
+ICON_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'icons', 'tracingcaj.png')
+
+
+class TracingProvider(QgsProcessingProvider):
+    """Algoritmos do plugin para o Processing (ferramentas, modelos, lote e qgis_process)"""
+
+    def loadAlgorithms(self):
+        for algorithm in (TracingAlgorithm, FindHydrometersAlgorithm, RamalAlgorithm, CriticalityAlgorithm,
+                          ConnectivityAlgorithm, OutageAlgorithm):
+            self.addAlgorithm(algorithm())
+
+    def id(self):
+        return 'tracingcaj'
+
+    def name(self):
+        return 'TracingCAJ'
+
+    def longName(self):
+        return 'Tracing de redes de água'
+
+    def icon(self):
+        return QIcon(ICON_PATH)
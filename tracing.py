@@ -13,6 +13,9 @@ import os
 
 from global_vars import init_global_vars
 from controller import ConfigController
+from provider import TracingProvider
+from core.result_highlight import clear_highlight
+from view.break_tool import BreakTool
 
 
 class Tracing:
@@ -24,12 +27,22 @@ class Tracing:
 
         self.__pipeline = None
         self.__valves = None
+        self.provider = None
+        self.break_tool = None
 
         # Initialize plugin directory
         self.plugin_dir = os.path.dirname(__file__)
         self.icon_folder = self.plugin_dir + os.sep + 'icons' + os.sep
 
+    def initProcessing(self):
+        # Algoritmos disponíveis também sem interface (qgis_process)
+        if self.provider is None:
+            self.provider = TracingProvider()
+            QgsApplication.processingRegistry().addProvider(self.provider)
+
     def initGui(self):
+        self.initProcessing()
+
         # create action that will start plugin configuration
         self._set_info_button()
         self.action.setObjectName("TracingAction")
@@ -40,6 +53,17 @@ class Tracing:
         self.iface.addToolBarIcon(self.action)
         self.iface.addPluginToMenu("&Tracing plugins", self.action)
 
+        # Isolamento a partir de um ponto de rompimento clicado no mapa
+        self.break_action = QAction("Isolar rompimento", self.iface.mainWindow())
+        self.break_action.setObjectName("TracingBreakAction")
+        self.break_action.setStatusTip("Valves to close ordered by network distance from the clicked break point")
+        self.break_action.setCheckable(True)
+        self.break_action.triggered.connect(self.run_break)
+        self.iface.addToolBarIcon(self.break_action)
+        self.iface.addPluginToMenu("&Tracing plugins", self.break_action)
+        self.break_tool = BreakTool(self.iface.mapCanvas(), self.start_break)
+        self.break_tool.setAction(self.break_action)
+
         # Initialize global variables
         init_global_vars(self.iface)
 
@@ -47,6 +71,15 @@ class Tracing:
         # remove the plugin menu item and icon
         self.iface.removePluginMenu("&Tracing plugins", self.action)
         self.iface.removeToolBarIcon(self.action)
+        self.iface.removePluginMenu("&Tracing plugins", self.break_action)
+        self.iface.removeToolBarIcon(self.break_action)
+        if self.iface.mapCanvas().mapTool() is self.break_tool:
+            self.iface.mapCanvas().unsetMapTool(self.break_tool)
+        clear_highlight()
+
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
 
     def run(self):
         if self.dlg_config is None:
@@ -71,6 +104,15 @@ class Tracing:
         self.dlg_config.show()
 
 
+    def run_break(self):
+        # As camadas vêm da tela de configurações (aberta na primeira vez)
+        if self.dlg_config is None:
+            self.run()
+        self.iface.mapCanvas().setMapTool(self.break_tool)
+
+    def start_break(self, point, search_distance):
+        self.dlg_config.start_break(point, search_distance)
+
     def error(self):
         self.iface.messageBar().pushMessage("Error occorred",
                                             "Error",
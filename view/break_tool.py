@@ -0,0 +1,23 @@
+from qgis.PyQt.QtCore import Qt
+from qgis.gui import QgsMapToolEmitPoint
+
+# Tolerância do clique em pixels (convertida para unidades do mapa na escala atual)
+CLICK_TOLERANCE_PIXELS = 8
+
+
+class BreakTool(QgsMapToolEmitPoint):
+    """Ferramenta de mapa: um clique no ponto de rompimento inicia o isolamento a partir dele"""
+
+    def __init__(self, canvas, on_break):
+        """
+        :param on_break: função (ponto no SRC do mapa, tolerância em unidades do mapa)
+        """
+        super().__init__(canvas)
+        self.__on_break = on_break
+        self.setCursor(Qt.CrossCursor)
+        self.canvasClicked.connect(self.__clicked)
+
+    def __clicked(self, point, button):
+        if button != Qt.LeftButton:
+            return
+        self.__on_break(point, self.canvas().mapUnitsPerPixel() * CLICK_TOLERANCE_PIXELS)